@@ -0,0 +1,197 @@
+"""
+Circuit breaker in front of the elasticsearch views.
+
+When the cluster is down, every request would wait for the connection
+timeout before falling back on the database. After
+ELASTICSEARCH_BREAKER_THRESHOLD consecutive failures the circuit opens
+and the views go straight to the fallback, after
+ELASTICSEARCH_BREAKER_COOLDOWN seconds a single call is let through
+to probe the cluster (half-open), its outcome closes or opens the circuit.
+
+The breaker only applies to the elasticsearch calls made within
+circuit_breaker.call (by the views and the restframework mixins),
+each of them is checked and recorded by the client (see client.instrument),
+so a request that doesn't reach elasticsearch neither takes the probe
+nor counts as a success.
+
+The state is local to the process, like the connection pool.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    from elasticsearch import ConnectionError
+except ImportError:
+    from urllib3.connection import ConnectionError
+from elasticsearch import TransportError
+
+
+logger = logging.getLogger('django_elasticsearch')
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised instead of calling elasticsearch while the circuit is open.
+    """
+
+
+def is_budget_timeout(error):
+    """
+    True for the timeouts of a request_timeout shorter than the client's
+    one (see EsQueryset.timeout), the call was only slower than the view
+    wanted, so they count neither as a failure nor as a success.
+    """
+    return getattr(error, 'budget_timeout', False)
+
+
+def is_failure(error):
+    """
+    Only the errors of the cluster count, a missing document
+    or a bad query don't mean that it is down.
+    """
+    if isinstance(error, CircuitOpenError) or is_budget_timeout(error):
+        return False
+    if isinstance(error, ConnectionError):
+        return True
+    if isinstance(error, TransportError):
+        status = error.args and error.args[0]
+        return not isinstance(status, int) or status >= 500
+    return False
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=None, cooldown=None):
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    @property
+    def threshold(self):
+        if self._threshold is not None:
+            return self._threshold
+        return getattr(settings, 'ELASTICSEARCH_BREAKER_THRESHOLD', 5)
+
+    @property
+    def cooldown(self):
+        if self._cooldown is not None:
+            return self._cooldown
+        return getattr(settings, 'ELASTICSEARCH_BREAKER_COOLDOWN', 30)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._cooled_down():
+                return self.HALF_OPEN
+            return self._state
+
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._probe_at = None
+
+    def _cooled_down(self):
+        return time.time() - self._opened_at >= self.cooldown
+
+    def allow_request(self):
+        """
+        Returns True if elasticsearch can be called.
+        """
+        if not self.threshold:
+            return True
+
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+
+            now = time.time()
+            if self._state == self.OPEN:
+                if not self._cooled_down():
+                    return False
+                self._state = self.HALF_OPEN
+            elif self._probe_at is not None and \
+                    now - self._probe_at < self.cooldown:
+                # only one probe at a time, unless it never came back
+                return False
+            self._probe_at = now
+            return True
+
+    def check(self):
+        if not self.allow_request():
+            raise CircuitOpenError('N/A', 'The elasticsearch circuit is open.')
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Elasticsearch circuit closed.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._probe_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and self.threshold and
+                    self._failures >= self.threshold):
+                logger.warning("Elasticsearch circuit opened after %s "
+                               "failure(s).", self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.time()
+                self._probe_at = None
+
+    def record(self, error=None):
+        """
+        Records the outcome of an elasticsearch call, error is the
+        exception it raised. Only the answers of the cluster count
+        as successes (e.g. a 404), not the other exceptions.
+        """
+        if error is None:
+            self.record_success()
+        elif is_failure(error):
+            self.record_failure()
+        elif isinstance(error, TransportError) and \
+                not isinstance(error, ConnectionError):
+            self.record_success()
+
+    @property
+    def active(self):
+        """
+        True within circuit_breaker.call, in the current thread.
+        """
+        return getattr(self._local, 'depth', 0) > 0
+
+    @contextmanager
+    def protect(self):
+        """
+        The elasticsearch calls made in the block go through the breaker.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func, the elasticsearch calls it makes raise CircuitOpenError
+        while the circuit is open, and their outcome is recorded.
+        """
+        with self.protect():
+            return func(*args, **kwargs)
+
+
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,303 @@
+"""
+Caching of elasticsearch responses.
+
+The result cache uses the django cache framework, every key embeds
+the current generation of the index, any write on the index bumps it
+so the old entries are never hit again. The generations are only kept
+when a cache is enabled (see generations_enabled).
+Note: a write is only searchable after the next refresh, a search made
+in between is cached under the new generation without it, and stays
+stale until the next write or the end of its timeout.
+
+The request memo lives in the current thread from the start to the end
+of a request (see middleware.EsRequestMemoMiddleware), it deduplicates
+identical calls without any risk of cross-request staleness.
+The responses are copied in and out of it, the callers are free
+to modify them.
+
+The completion cache is a bounded LRU local to the process, disabled
+by default, it answers the successive keystrokes of an auto completion
+field. It follows the shared generations when those are enabled,
+otherwise it only sees the writes made in the same process.
+"""
+import copy
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+try:
+    from django.core.cache import caches
+except ImportError:  # django < 1.7
+    from django.core.cache import get_cache
+else:
+    def get_cache(alias):
+        return caches[alias]
+
+
+KEY_PREFIX = 'django_elasticsearch'
+
+logger = logging.getLogger('django_elasticsearch')
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+_local = threading.local()
+
+# index -> number of writes made by this process
+_local_generations = {}
+
+
+def get_es_cache():
+    return get_cache(getattr(settings, 'ELASTICSEARCH_CACHE_BACKEND', 'default'))
+
+
+def get_default_timeout():
+    return getattr(settings, 'ELASTICSEARCH_CACHE_TIMEOUT', None) or 60
+
+
+def _generation_key(index):
+    return '{0}:generation:{1}'.format(KEY_PREFIX, index)
+
+
+def _modified_key(index):
+    return '{0}:modified:{1}'.format(KEY_PREFIX, index)
+
+
+def generations_enabled():
+    """
+    The writes only touch the django cache if something reads it:
+    ELASTICSEARCH_CACHE_TIMEOUT or ELASTICSEARCH_DOCUMENT_CACHE_TIMEOUT
+    is set, or ELASTICSEARCH_CACHE_GENERATIONS is True (for querysets
+    using .cached() explicitly and the Last-Modified of the views).
+    """
+    enabled = getattr(settings, 'ELASTICSEARCH_CACHE_GENERATIONS', None)
+    if enabled is not None:
+        return enabled
+    return bool(getattr(settings, 'ELASTICSEARCH_CACHE_TIMEOUT', None) or
+                getattr(settings, 'ELASTICSEARCH_DOCUMENT_CACHE_TIMEOUT', None))
+
+
+def get_generation(index):
+    return get_es_cache().get(_generation_key(index), 0)
+
+
+def get_local_generation(index):
+    return _local_generations.get(index, 0)
+
+
+def get_completion_generation(index):
+    """
+    The shared generation if those are kept, so that the writes of the
+    other processes are seen too, else the one of this process.
+    """
+    if generations_enabled():
+        return get_generation(index)
+    return get_local_generation(index)
+
+
+def get_modified(index):
+    """
+    Returns the timestamp of the last write on the index, or None.
+    """
+    return get_es_cache().get(_modified_key(index))
+
+
+def bump_generation(index):
+    """
+    Invalidates every cached response of the index.
+    """
+    clear_memo()
+    with _stats_lock:
+        _local_generations[index] = _local_generations.get(index, 0) + 1
+    if not generations_enabled():
+        return
+
+    try:
+        cache = get_es_cache()
+        cache.set(_modified_key(index), time.time(), None)
+        key = _generation_key(index)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # the key is missing, but someone else may be creating it too
+            if not cache.add(key, 1, None):
+                cache.incr(key)
+    except Exception:
+        # the document is already written, don't fail the save for it
+        logger.warning("Could not bump the cache generation of %s.", index,
+                       exc_info=True)
+
+
+def make_key(operation, params):
+    """
+    Returns a stable key for the given operation (search, count, ...)
+    and elasticsearch parameters (index, doc_type, body, from, size...)
+    """
+    index = params.get('index')
+    return '{0}:{1}:{2}:{3}:{4}'.format(KEY_PREFIX, operation, index,
+                                        get_generation(index),
+                                        _digest(params))
+
+
+def _digest(params):
+    return hashlib.md5(json.dumps(params, sort_keys=True,
+                                  default=str)).hexdigest()
+
+
+def _incr_stat(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_cached(key):
+    value = get_es_cache().get(key)
+    _incr_stat(value is None and 'misses' or 'hits')
+    return value
+
+
+def set_cached(key, value, timeout=None):
+    if timeout is None:
+        timeout = get_default_timeout()
+    get_es_cache().set(key, value, timeout)
+
+
+def get_stats():
+    """
+    Returns the hits/misses counters of the current process.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats['hits'] + stats['misses']
+    stats['ratio'] = total and float(stats['hits']) / total or 0.0
+    return stats
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats['hits'] = 0
+        _stats['misses'] = 0
+
+
+def start_memo():
+    _local.memo = {}
+    _local.saved = 0
+
+
+def stop_memo():
+    """
+    Drops the memo and returns the number of calls it saved.
+    """
+    saved = getattr(_local, 'saved', 0)
+    _local.memo = None
+    _local.saved = 0
+    return saved
+
+
+def clear_memo():
+    if getattr(_local, 'memo', None):
+        _local.memo.clear()
+
+
+def get_memoized(operation, params):
+    memo = getattr(_local, 'memo', None)
+    if memo is None:
+        return None
+    value = memo.get((operation, _digest(params)))
+    if value is not None:
+        _local.saved += 1
+        value = copy.deepcopy(value)
+    return value
+
+
+def memoize(operation, params, value):
+    memo = getattr(_local, 'memo', None)
+    if memo is not None:
+        memo[(operation, _digest(params))] = copy.deepcopy(value)
+
+
+class CompletionCache(object):
+    """
+    Bounded LRU of completion options keyed by (index, field, prefix).
+    A longer prefix can be answered by filtering the options
+    of a shorter one, as long as those were not truncated.
+    Note: the options that only matched thanks to fuzziness
+    are lost when filtering.
+    """
+
+    def __init__(self, max_size=None, timeout=None):
+        self._max_size = max_size
+        self._timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return getattr(settings, 'ELASTICSEARCH_COMPLETION_CACHE_SIZE', 0)
+
+    @property
+    def timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        return getattr(settings, 'ELASTICSEARCH_COMPLETION_CACHE_TIMEOUT', 60)
+
+    @staticmethod
+    def normalize(prefix):
+        return u' '.join(prefix.lower().split())
+
+    def get(self, index, field_name, prefix, size):
+        """
+        Returns the cached options or None.
+        """
+        if not self.max_size:
+            return None
+
+        prefix = self.normalize(prefix)
+        generation = get_completion_generation(index)
+        now = time.time()
+        with self._lock:
+            for i in range(len(prefix), -1, -1):
+                key = (index, field_name, prefix[:i])
+                try:
+                    expires, gen, options, truncated = self._data.pop(key)
+                except KeyError:
+                    continue
+                if expires < now or gen != generation:
+                    continue
+                # most recently used
+                self._data[key] = (expires, gen, options, truncated)
+
+                if i == len(prefix):
+                    if truncated and size > len(options):
+                        return None
+                    return options[:size]
+                elif not truncated:
+                    return [option for option in options
+                            if self.normalize(option).startswith(prefix)][:size]
+
+        return None
+
+    def set(self, index, field_name, prefix, size, options):
+        if not self.max_size:
+            return
+
+        key = (index, field_name, self.normalize(prefix))
+        entry = (time.time() + self.timeout, get_completion_generation(index),
+                 options, len(options) >= size)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = entry
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+completion_cache = CompletionCache()
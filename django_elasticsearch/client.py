@@ -1,11 +1,290 @@
+"""
+Simple wrapper around elasticsearch-py to index/search a django Model.
+"""
+import os
+import copy
+import time
+import threading
+try:
+    import importlib
+except ImportError:  # python < 2.7
+    from django.utils import importlib
+
 from django.conf import settings
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # django < 1.8
+    from django.test.signals import setting_changed
 
 from elasticsearch import Elasticsearch
+from elasticsearch import ConnectionTimeout
+from elasticsearch.client.utils import _make_path
+from elasticsearch.client.utils import NamespacedClient
+
+from django_elasticsearch.signals import es_request
+from django_elasticsearch.breaker import circuit_breaker
+from django_elasticsearch.slowlog import get_threshold
+from django_elasticsearch.slowlog import log_slow_query
+
+
+# django setting -> Elasticsearch kwarg
+CLIENT_SETTINGS = (
+    ('ELASTICSEARCH_MAXSIZE', 'maxsize'),
+    ('ELASTICSEARCH_TIMEOUT', 'timeout'),
+    ('ELASTICSEARCH_MAX_RETRIES', 'max_retries'),
+    ('ELASTICSEARCH_SNIFF_ON_START', 'sniff_on_start'),
+    ('ELASTICSEARCH_SNIFF_ON_CONNECTION_FAIL', 'sniff_on_connection_fail'),
+    ('ELASTICSEARCH_SNIFFER_TIMEOUT', 'sniffer_timeout'),
+    ('ELASTICSEARCH_TRANSPORT_CLASS', 'transport_class'),
+)
+
+
+def get_client_kwargs():
+    kwargs = {}
+    for setting, kwarg in CLIENT_SETTINGS:
+        if hasattr(settings, setting):
+            kwargs[kwarg] = getattr(settings, setting)
+    kwargs.update(getattr(settings, 'ELASTICSEARCH_CONNECTION_KWARGS', {}))
+
+    transport_class = kwargs.get('transport_class')
+    if isinstance(transport_class, basestring):
+        module, kls = transport_class.rsplit(".", 1)
+        mod = importlib.import_module(module)
+        kwargs['transport_class'] = getattr(mod, kls)
+    return kwargs
+
+
+def get_client_timeout():
+    """
+    Returns the default request timeout of the client, in seconds.
+    """
+    # elasticsearch-py's default
+    return get_client_kwargs().get('timeout', 10)
+
+
+def make_client():
+    # ELASTICSEARCH_URL can also be a list of hosts
+    return Elasticsearch(getattr(settings,
+                                 'ELASTICSEARCH_URL',
+                                 'http://localhost:9200'),
+                         **get_client_kwargs())
+
+
+def _get_size(serializer, data):
+    if data is None:
+        return 0
+    if isinstance(data, basestring):
+        return len(data)
+    if isinstance(data, (list, tuple)):
+        # bulk and msearch bodies, one line per item
+        return sum([_get_size(serializer, line) + 1 for line in data])
+    return len(serializer.dumps(data))
+
+
+def _get_hits(response):
+    if not isinstance(response, dict):
+        return None
+    if 'hits' in response:
+        return response['hits']['total']
+    if 'responses' in response:
+        return sum([r['hits']['total'] for r in response['responses']
+                    if 'hits' in r])
+    if 'count' in response:
+        return response['count']
+    if 'docs' in response:
+        return len([d for d in response['docs'] if d.get('found')])
+    if 'found' in response:
+        return int(response['found'])
+    return None
+
+
+def _get_took(response):
+    if not isinstance(response, dict):
+        return None
+    if 'responses' in response:
+        return max([r.get('took', 0) for r in response['responses']] or [0])
+    return response.get('took')
+
+
+def send_request_signal(client, operation, args, kwargs,
+                        response, error, duration):
+    index = kwargs.get('index')
+    if index is None and args and isinstance(args[0], basestring):
+        index = args[0]
+    request_size = response_size = None
+    if getattr(settings, 'ELASTICSEARCH_SIGNAL_SIZES', False):
+        # Note: the sizes are those of the re-serialized bodies,
+        # they can differ slightly from what went on the wire.
+        serializer = client.transport.serializer
+        request_size = _get_size(serializer, kwargs.get('body'))
+        response_size = _get_size(serializer, response)
+    es_request.send(sender=LazyEsClient,
+                    operation=operation,
+                    index=index,
+                    doc_type=kwargs.get('doc_type'),
+                    params=kwargs,
+                    duration=duration,
+                    took=_get_took(response),
+                    hits=_get_hits(response),
+                    request_size=request_size,
+                    response_size=response_size,
+                    error=error)
+
+
+def mark_budget_timeout(error, kwargs):
+    """
+    Flags the timeouts of a request_timeout shorter than the client's one,
+    see breaker.is_budget_timeout.
+    """
+    if not isinstance(error, ConnectionTimeout):
+        return
+    request_timeout = kwargs.get('request_timeout')
+    if request_timeout is None:
+        request_timeout = (kwargs.get('params') or {}).get('request_timeout')
+    if request_timeout is not None:
+        error.budget_timeout = request_timeout < get_client_timeout()
+
+
+def instrument(client, func, operation):
+    """
+    Wraps a client method to send the es_request signal after each call,
+    and to go through the circuit breaker within circuit_breaker.call.
+    """
+    def wrapper(*args, **kwargs):
+        protected = circuit_breaker.active
+        if protected:
+            circuit_breaker.check()
+        start = time.time()
+        response = error = None
+        try:
+            response = func(*args, **kwargs)
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            duration = (time.time() - start) * 1000
+            mark_budget_timeout(error, kwargs)
+            if protected:
+                circuit_breaker.record(error)
+            threshold = get_threshold()
+            if threshold is not None and duration >= threshold:
+                log_slow_query(operation, kwargs, duration, response)
+            if es_request.receivers:
+                send_request_signal(client, operation, args, kwargs,
+                                    response, error, duration)
+    return wrapper
+
+
+class InstrumentedNamespace(object):
+    """
+    Proxy to a namespaced client, like es_client.indices
+    """
+
+    def __init__(self, client, namespace, name):
+        self.client = client
+        self.namespace = namespace
+        self.name = name
+
+    def __getattr__(self, name):
+        attr = getattr(self.namespace, name)
+        if callable(attr) and not name.startswith('_'):
+            return instrument(self.client, attr,
+                              '{0}.{1}'.format(self.name, name))
+        return attr
+
+
+class LazyEsClient(object):
+    """
+    Proxy to an Elasticsearch client that is only instantiated on first use,
+    and instantiated again in a forked process so that the workers
+    don't share the connection pool of their parent.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    self._client = make_client()
+                    self._pid = pid
+        return self._client
+
+    def reset(self):
+        with self._lock:
+            self._client = None
+            self._pid = None
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_client', '_pid', '_lock'):
+            raise AttributeError(name)
+
+        client = self.get_client()
+        attr = getattr(client, name)
+        if name.startswith('_'):
+            return attr
+        if isinstance(attr, NamespacedClient):
+            return InstrumentedNamespace(client, attr, name)
+        if callable(attr):
+            return instrument(client, attr, name)
+        return attr
+
+
+es_client = LazyEsClient()
+
+
+class RawDeserializer(object):
+    """
+    Leaves the body of the responses as it was received.
+    """
+
+    def loads(self, s, mimetype=None):
+        return s
+
+
+def perform_raw_request(transport, method, url, params=None, body=None):
+    """
+    Like transport.perform_request, but returns the body of the response
+    as it was received, without deserializing it.
+    The request goes through the same retries, dead connections and
+    sniffing as the other requests of the transport.
+    """
+    if hasattr(transport, 'perform_raw_request'):
+        # in-memory stand-in
+        return transport.perform_raw_request(method, url, params, body)
+
+    # a copy sharing the connection pool, only the deserializer differs
+    raw_transport = copy.copy(transport)
+    raw_transport.deserializer = RawDeserializer()
+    # the sniffed nodes are deserialized and kept by the transport itself
+    raw_transport.sniff_hosts = transport.sniff_hosts
+    status, data = raw_transport.perform_request(method, url,
+                                                 dict(params or {}), body)
+    return data
+
+
+def raw_search(index=None, doc_type=None, body=None, params=None):
+    """
+    Searches and returns the response as a json string, meant to be
+    sent as is, see the filter_path parameter to trim it.
+    """
+    client = es_client.get_client()
+
+    def search(index=None, doc_type=None, body=None, params=None):
+        # POST, some proxies drop the body of a GET
+        return perform_raw_request(client.transport, 'POST',
+                                   _make_path(index, doc_type, '_search'),
+                                   params, body)
+    return instrument(client, search, 'raw_search')(
+        index=index, doc_type=doc_type, body=body, params=params)
 
 
-es_client = Elasticsearch(getattr(settings,
-                                  'ELASTICSEARCH_URL',
-                                  'http://localhost:9200'),
-                          **getattr(settings,
-                                    'ELASTICSEARCH_CONNECTION_KWARGS',
-                                    {}))
+def reset_client(sender, setting, **kwargs):
+    if setting.startswith('ELASTICSEARCH_'):
+        es_client.reset()
+setting_changed.connect(reset_client)
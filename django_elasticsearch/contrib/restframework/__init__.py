@@ -8,7 +8,10 @@ if int(VERSION[0]) < 3:
 else:
     from django_elasticsearch.contrib.restframework.restframework3 import IndexableModelMixin
     from django_elasticsearch.contrib.restframework.restframework3 import ElasticsearchFilterBackend
+    from django_elasticsearch.contrib.restframework.restframework3 import ElasticsearchCursorPagination
 
 __all__ = [ElasticsearchFilterBackend,
            IndexableModelMixin,
            AutoCompletionMixin]
+if int(VERSION[0]) >= 3:
+    __all__.append(ElasticsearchCursorPagination)
@@ -1,15 +1,43 @@
 from django.http import Http404
+from django.views.decorators.http import condition
 
 from rest_framework.response import Response
 from rest_framework.mixins import ListModelMixin
 from rest_framework.decorators import list_route
 
+from elasticsearch import NotFoundError
+
+from django_elasticsearch.views import get_list_etag
+from django_elasticsearch.views import get_document_etag
+from django_elasticsearch.views import get_last_modified
+
+
+def get_source_fields(serializer_class):
+    """
+    Returns the fields of the _source read by the serializer.
+    """
+    fields = set()
+    for name, field in serializer_class().fields.items():
+        if getattr(field, 'write_only', False):
+            continue
+        source = getattr(field, 'source', None) or name
+        if source and source != '*':
+            fields.add(source.split('.')[0])
+    return sorted(fields)
+
 
 class AutoCompletionMixin(ListModelMixin):
     """
     Add a route to the ViewSet to get a list of completion suggestion.
     """
 
+    def get_completion_context(self, request):
+        """
+        Returns the context restricting the completion options,
+        e.g. {'category': request.GET.get('category')}, None by default.
+        """
+        return None
+
     @list_route()
     def autocomplete(self, request, **kwargs):
         try:
@@ -18,13 +46,56 @@ class AutoCompletionMixin(ListModelMixin):
             # restframework 2
             qp = request.QUERY_PARAMS
 
-        field_name = qp.get('f', None)
+        # ?f=title&f=author or ?f=title,author
+        field_names = []
+        for value in qp.getlist('f'):
+            field_names.extend([f for f in value.split(',') if f])
         query = qp.get('q', '')
 
         try:
-            data = self.model.es.complete(field_name, query)
+            if not field_names:
+                raise ValueError
+            data = self.model.es.complete(
+                field_names, query,
+                context=self.get_completion_context(request))
         except ValueError:
             raise Http404("field {0} is either missing or "
                           "not in Elasticsearch.completion_fields.")
 
         return Response(data)
+
+
+class ConditionalGetMixin(object):
+    """
+    Adds ETag and Last-Modified headers to the list and retrieve actions,
+    and answers 304 Not Modified to the clients that are up to date.
+    The etag of a list is computed without any search (see
+    django_elasticsearch.views.get_list_etag), the one of a document
+    comes from its _version.
+    Opt-in, the lists need ELASTICSEARCH_CACHE_GENERATIONS and a shared cache.
+    """
+    conditional = False
+
+    def get_etag(self, request, *args, **kwargs):
+        if self.action == 'list':
+            return get_list_etag(self.model.es.index, request)
+
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        queryset = self.get_queryset()
+        try:
+            # reused by get_object
+            self.es_object = queryset.get(pk=pk)
+        except NotFoundError:
+            raise Http404
+        return get_document_etag(queryset.index, queryset.doc_type, pk,
+                                 queryset._response.get('_version'))
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return get_last_modified(self.model.es.index)
+
+    def conditional_get(self, handler, request, *args, **kwargs):
+        if self.es_failed or not self.conditional:
+            return handler(request, *args, **kwargs)
+        return condition(etag_func=self.get_etag,
+                         last_modified_func=self.get_last_modified)(handler)(
+                             request, *args, **kwargs)
@@ -10,6 +10,10 @@ from rest_framework.filters import OrderingFilter
 from rest_framework.filters import DjangoFilterBackend
 
 from django_elasticsearch.models import EsIndexable
+from django_elasticsearch.breaker import circuit_breaker
+from django_elasticsearch.contrib.restframework.base import ConditionalGetMixin
+from django_elasticsearch.contrib.restframework.base import get_source_fields
+from django_elasticsearch.paginator import EsPaginator
 
 
 from elasticsearch import NotFoundError
@@ -74,11 +78,22 @@ class ElasticsearchFilterBackend(OrderingFilter, DjangoFilterBackend):
                 ordering = self.get_default_ordering(view)
 
             filterable = getattr(view, 'filter_fields', [])
+            # filtered after the facets are counted
+            post_filterable = getattr(view, 'post_filter_fields', [])
             filters = dict([(k, v)
                             for k, v in request.GET.iteritems()
-                            if k in filterable])
+                            if k in filterable and k not in post_filterable])
+            post_filters = dict([(k, v)
+                                 for k, v in request.GET.iteritems()
+                                 if k in post_filterable])
 
             q = queryset.query(query).filter(**filters)
+            if post_filters:
+                q = q.post_filter(**post_filters)
+                if q.facets_fields and q.global_facets:
+                    # the global facets would ignore the search
+                    q = q.facet(q.facets_fields, limit=q.facets_limit,
+                                use_globals=False)
             if ordering:
                 q = q.order_by(*ordering)
 
@@ -89,19 +104,33 @@ class ElasticsearchFilterBackend(OrderingFilter, DjangoFilterBackend):
             )
 
 
-class IndexableModelMixin(object):
+class IndexableModelMixin(ConditionalGetMixin):
     """
     Use EsQueryset and ElasticsearchFilterBackend if available
     """
     filter_backends = [ElasticsearchFilterBackend,]
+    paginator_class = EsPaginator
+    # time budgets, see ElasticsearchView
+    es_timeout = None
+    es_search_timeout = None
+    # the _source fields of a retrieve, True to read them from the serializer
+    es_source_fields = None
+    # see EsQueryset.realtime
+    es_realtime = True
+    es_refresh = False
     FILTER_STATUS_MESSAGE_OK = 'Ok'
     FILTER_STATUS_MESSAGE_FAILED = 'Failed'
 
     def __init__(self, *args, **kwargs):
         self.es_failed = False
+        self.es_object = None
         super(IndexableModelMixin, self).__init__(*args, **kwargs)
 
     def get_object(self):
+        if self.es_object is not None:
+            # already fetched by get_etag
+            self.check_object_permissions(self.request, self.es_object)
+            return self.es_object
         try:
             return super(IndexableModelMixin, self).get_object()
         except NotFoundError:
@@ -119,9 +148,27 @@ class IndexableModelMixin(object):
             return ElasticsearchPaginationSerializer(instance=page, context=context)
         return super(IndexableModelMixin, self).get_pagination_serializer(page)
 
+    def get_source_fields(self):
+        if self.es_source_fields is True:
+            # not the FakeSerializer
+            return get_source_fields(
+                super(IndexableModelMixin, self).get_serializer_class())
+        return self.es_source_fields
+
     def get_queryset(self):
         if self.action in ['list', 'retrieve'] and not self.es_failed:
-            return self.model.es.search("")
+            queryset = self.model.es.search("")
+            if self.es_timeout is not None or self.es_search_timeout is not None:
+                queryset = queryset.timeout(self.es_search_timeout,
+                                            self.es_timeout)
+            if self.action == 'retrieve':
+                source_fields = self.get_source_fields()
+                if source_fields:
+                    queryset = queryset.only(*source_fields)
+                if not self.es_realtime or self.es_refresh:
+                    queryset = queryset.realtime(self.es_realtime,
+                                                 self.es_refresh)
+            return queryset
         # db fallback
         return super(IndexableModelMixin, self).get_queryset()
 
@@ -133,7 +180,14 @@ class IndexableModelMixin(object):
         else:
             return super(IndexableModelMixin, self).filter_queryset(queryset)
 
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(super(IndexableModelMixin, self).retrieve,
+                                    request, *args, **kwargs)
+
     def list(self, request, *args, **kwargs):
+        return self.conditional_get(self._list, request, *args, **kwargs)
+
+    def _list(self, request, *args, **kwargs):
         r = super(IndexableModelMixin, self).list(request, *args, **kwargs)
         if not self.es_failed:
             if getattr(self.object_list, 'facets', None):
@@ -142,23 +196,46 @@ class IndexableModelMixin(object):
             if getattr(self.object_list, 'suggestions', None):
                 r.data['suggestions'] = self.object_list.suggestions
 
+            if getattr(self.object_list, 'timed_out', False):
+                # partial results, see es_search_timeout
+                r.data['timed_out'] = True
+
         return r
 
     def dispatch(self, request, *args, **kwargs):
-        try:
-            r = super(IndexableModelMixin, self).dispatch(request, *args, **kwargs)
-        except (ConnectionError, TransportError), e:
-            # reset object list
-            self.queryset = None
+        # only the reads go through elasticsearch
+        reading = request.method == 'GET'
+        dispatch = super(IndexableModelMixin, self).dispatch
+        # Note: checking the state doesn't take the probe of a half-open
+        # circuit, only an actual elasticsearch call does
+        if reading and circuit_breaker.state == circuit_breaker.OPEN:
+            # straight to the db fallback while the circuit is open
             self.es_failed = True
-            # db fallback
-            r = super(IndexableModelMixin, self).dispatch(request, *args, **kwargs)
+            r = dispatch(request, *args, **kwargs)
             if settings.DEBUG and isinstance(r.data, dict):
-                r.data["filter_fail_cause"] = str(e)
+                r.data["filter_fail_cause"] = "circuit open"
+        else:
+            try:
+                if reading:
+                    # the client checks and records each elasticsearch call
+                    r = circuit_breaker.call(dispatch, request, *args, **kwargs)
+                else:
+                    r = dispatch(request, *args, **kwargs)
+            except (ConnectionError, TransportError), e:
+                # reset object list
+                self.queryset = None
+                self.es_object = None
+                self.es_failed = True
+                # db fallback
+                r = dispatch(request, *args, **kwargs)
+                if settings.DEBUG and isinstance(r.data, dict):
+                    r.data["filter_fail_cause"] = str(e)
 
         # Add a failed message in case something went wrong with elasticsearch
         # for example if the cluster went down.
-        if isinstance(r.data, dict) and self.action in ['list', 'retrieve']:
+        # Note: a 304 has no data
+        data = getattr(r, 'data', None)
+        if isinstance(data, dict) and self.action in ['list', 'retrieve']:
             r.data['filter_status'] = (self.es_failed
                                        and self.FILTER_STATUS_MESSAGE_FAILED
                                        or self.FILTER_STATUS_MESSAGE_OK)
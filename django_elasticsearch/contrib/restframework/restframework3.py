@@ -1,13 +1,33 @@
+import json
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+
 from django.http import Http404
+from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
 from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.core.paginator import Paginator
+from django.utils import six
 
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.serializers import OrderedDict
 from rest_framework.settings import api_settings
 from rest_framework.filters import OrderingFilter
 from rest_framework.filters import DjangoFilterBackend
 
+from django_elasticsearch.query import EsQueryset
 from django_elasticsearch.models import EsIndexable
+from django_elasticsearch.breaker import circuit_breaker
+from django_elasticsearch.contrib.restframework.base import ConditionalGetMixin
+from django_elasticsearch.contrib.restframework.base import get_source_fields
+from django_elasticsearch.paginator import EsPaginator
 
 
 try:
@@ -18,6 +38,171 @@ from elasticsearch import TransportError
 from elasticsearch import NotFoundError
 
 
+has_paginator_hook = hasattr(PageNumberPagination, 'django_paginator_class')
+
+
+class ElasticsearchPagination(PageNumberPagination):
+    """
+    PageNumberPagination that takes the count from the search response.
+    """
+    django_paginator_class = EsPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if has_paginator_hook:
+            return super(ElasticsearchPagination, self).paginate_queryset(
+                queryset, request, view=view)
+
+        # restframework < 3.2 has no django_paginator_class hook
+        if hasattr(self, '_handle_backwards_compat'):
+            self._handle_backwards_compat(view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(
+                page_number=page_number, message=six.text_type(exc)
+            )
+            raise NotFound(msg)
+
+        if paginator.count > 1 and self.template is not None:
+            # The browsable API should display pagination controls.
+            self.display_page_controls = True
+
+        self.request = request
+        return list(self.page)
+
+
+class ElasticsearchCursorPagination(BasePagination):
+    """
+    Keyset pagination, the cursor is the ordering values and the pk
+    of the last row of the page, the next page only fetches the rows
+    sorted after them so any page costs the same as the first one.
+    Pages through an EsQueryset (see EsQueryset.seek) as well as
+    through the database fallback.
+    Only paginates forward (no previous link) and has no count.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request, view=None):
+        if self.page_size_query_param:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+                if page_size > 0:
+                    return page_size
+            except (KeyError, ValueError):
+                pass
+        # restframework < 3.1 style
+        return getattr(view, 'paginate_by', None) or self.page_size
+
+    def encode_cursor(self, values):
+        return urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(str(encoded)))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def get_db_ordering(self, queryset):
+        """
+        The ordering of a database queryset, the pk is the tiebreaker.
+        """
+        ordering = []
+        for field in (queryset.query.order_by or
+                      queryset.model._meta.ordering or []):
+            ordering.append(field)
+            if field.lstrip('-') in ('pk', queryset.model._meta.pk.name):
+                return ordering
+        return ordering + ['pk']
+
+    def seek_db(self, queryset, ordering, values):
+        """
+        The rows of a database queryset sorted after the values,
+        see EsQueryset.make_seek_filter.
+        """
+        queryset = queryset.order_by(*ordering)
+        if values is None:
+            return queryset
+        if len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = None
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            if value is None:
+                equal[name + '__isnull'] = True
+                continue
+            after = dict(equal)
+            after[name + (field.startswith('-') and '__lt' or '__gt')] = value
+            q = Q(**after)
+            condition = condition is None and q or condition | q
+            equal[name] = value
+        try:
+            return queryset.filter(condition or Q())
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request, view)
+        if not page_size:
+            return None
+
+        self.request = request
+        values = self.decode_cursor(request)
+        if isinstance(queryset, EsQueryset):
+            if (values is not None and
+                    len(values) != len(queryset.get_seek_ordering())):
+                raise NotFound(self.invalid_cursor_message)
+            self.queryset = queryset.seek(values)
+        else:
+            ordering = self.get_db_ordering(queryset)
+            self.queryset = self.seek_db(queryset, ordering, values)
+
+        # one more to know if there is a next page
+        results = list(self.queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(results) > page_size:
+            if isinstance(queryset, EsQueryset):
+                self.next_cursor = self.queryset.sort_values[page_size - 1]
+            else:
+                names = [field.lstrip('-') for field in ordering]
+                self.next_cursor = list(self.queryset.filter(
+                    pk=results[page_size - 1].pk).values_list(*names)[0])
+        return results[:page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.next_cursor))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+
 class ElasticsearchFilterBackend(OrderingFilter, DjangoFilterBackend):
     def filter_queryset(self, request, queryset, view):
         model = queryset.model
@@ -37,11 +222,22 @@ class ElasticsearchFilterBackend(OrderingFilter, DjangoFilterBackend):
                 ordering = self.get_default_ordering(view)
 
             filterable = getattr(view, 'filter_fields', [])
+            # filtered after the facets are counted
+            post_filterable = getattr(view, 'post_filter_fields', [])
             filters = dict([(k, v)
                             for k, v in request.GET.iteritems()
-                            if k in filterable])
+                            if k in filterable and k not in post_filterable])
+            post_filters = dict([(k, v)
+                                 for k, v in request.GET.iteritems()
+                                 if k in post_filterable])
 
             q = queryset.query(query).filter(**filters)
+            if post_filters:
+                q = q.post_filter(**post_filters)
+                if q.facets_fields and q.global_facets:
+                    # the global facets would ignore the search
+                    q = q.facet(q.facets_fields, limit=q.facets_limit,
+                                use_globals=False)
             if ordering:
                 q = q.order_by(*ordering)
 
@@ -52,27 +248,78 @@ class ElasticsearchFilterBackend(OrderingFilter, DjangoFilterBackend):
             )
 
 
-class IndexableModelMixin(object):
+class IndexableModelMixin(ConditionalGetMixin):
     """
     Use EsQueryset and ElasticsearchFilterBackend if available
     """
     filter_backends = [ElasticsearchFilterBackend,]
+    # splice the hits of elasticsearch as is in the response,
+    # trimmed by es_raw_filter_path
+    es_raw = False
+    es_raw_filter_path = ['hits.hits._source']
+    # time budgets, see ElasticsearchView
+    es_timeout = None
+    es_search_timeout = None
+    # the _source fields of a retrieve, True to read them from the serializer,
+    # None for the whole _source
+    es_source_fields = True
+    # see EsQueryset.realtime
+    es_realtime = True
+    es_refresh = False
     FILTER_STATUS_MESSAGE_OK = 'Ok'
     FILTER_STATUS_MESSAGE_FAILED = 'Failed'
 
     def __init__(self, *args, **kwargs):
         self.es_failed = False
+        self.es_object = None
         super(IndexableModelMixin, self).__init__(*args, **kwargs)
 
+    @property
+    def paginator(self):
+        paginator = super(IndexableModelMixin, self).paginator
+        if has_paginator_hook:
+            if getattr(paginator, 'django_paginator_class', None) is Paginator:
+                # the count comes from the search response
+                paginator.django_paginator_class = EsPaginator
+        elif type(paginator) is PageNumberPagination:
+            # no hook, same pagination with the EsPaginator
+            paginator = self._paginator = ElasticsearchPagination()
+        return paginator
+
     def get_object(self):
+        if self.es_object is not None:
+            # already fetched by get_etag
+            self.check_object_permissions(self.request, self.es_object)
+            return self.es_object
         try:
             return super(IndexableModelMixin, self).get_object()
         except NotFoundError:
             raise Http404
 
+    def get_source_fields(self):
+        fields = self.es_source_fields
+        if fields is True:
+            fields = get_source_fields(self.get_serializer_class())
+        if fields:
+            # the instance given to the serializer needs its pk
+            pk = self.model._meta.pk.name
+            fields = [pk] + [field for field in fields if field != pk]
+        return fields
+
     def get_queryset(self):
         if self.action in ['list', 'retrieve'] and not self.es_failed:
-            return self.model.es.search("")
+            queryset = self.model.es.search("")
+            if self.es_timeout is not None or self.es_search_timeout is not None:
+                queryset = queryset.timeout(self.es_search_timeout,
+                                            self.es_timeout)
+            if self.action == 'retrieve':
+                source_fields = self.get_source_fields()
+                if source_fields:
+                    queryset = queryset.only(*source_fields)
+                if not self.es_realtime or self.es_refresh:
+                    queryset = queryset.realtime(self.es_realtime,
+                                                 self.es_refresh)
+            return queryset
         # db fallback
         return self.queryset or self.model.objects.all()
 
@@ -85,39 +332,128 @@ class IndexableModelMixin(object):
             return super(IndexableModelMixin, self).filter_queryset(queryset)
 
     def dispatch(self, request, *args, **kwargs):
-        try:
-            r = super(IndexableModelMixin, self).dispatch(request, *args, **kwargs)
-        except (ConnectionError, TransportError), e:
-            # reset object list
-            self.queryset = None
+        # only the reads go through elasticsearch
+        reading = request.method == 'GET'
+        dispatch = super(IndexableModelMixin, self).dispatch
+        # Note: checking the state doesn't take the probe of a half-open
+        # circuit, only an actual elasticsearch call does
+        if reading and circuit_breaker.state == circuit_breaker.OPEN:
+            # straight to the db fallback while the circuit is open
             self.es_failed = True
-            # db fallback
-            r = super(IndexableModelMixin, self).dispatch(request, *args, **kwargs)
+            r = dispatch(request, *args, **kwargs)
             if settings.DEBUG and isinstance(r.data, dict):
-                r.data["filter_fail_cause"] = str(e)
+                r.data["filter_fail_cause"] = "circuit open"
+        else:
+            try:
+                if reading:
+                    # the client checks and records each elasticsearch call
+                    r = circuit_breaker.call(dispatch, request, *args, **kwargs)
+                else:
+                    r = dispatch(request, *args, **kwargs)
+            except (ConnectionError, TransportError), e:
+                # reset object list
+                self.queryset = None
+                self.es_object = None
+                self.es_failed = True
+                # db fallback
+                r = dispatch(request, *args, **kwargs)
+                if settings.DEBUG and isinstance(r.data, dict):
+                    r.data["filter_fail_cause"] = str(e)
 
         # Add a failed message in case something went wrong with elasticsearch
         # for example if the cluster went down.
-        if isinstance(r.data, dict) and self.action in ['list', 'retrieve']:
+        # Note: a 304 has no data
+        data = getattr(r, 'data', None)
+        if isinstance(data, dict) and self.action in ['list', 'retrieve']:
             r.data['filter_status'] = (self.es_failed
                                        and self.FILTER_STATUS_MESSAGE_FAILED
                                        or self.FILTER_STATUS_MESSAGE_OK)
         return r
 
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(self._retrieve, request, *args, **kwargs)
+
+    def _retrieve(self, request, *args, **kwargs):
+        if self.es_failed:
+            return super(IndexableModelMixin, self).retrieve(request, *args, **kwargs)
+        # the serializer reads an instance, not the _source
+        instance = self.model.es.deserialize(self.get_object())
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
     def list(self, request, *args, **kwargs):
+        return self.conditional_get(self._list, request, *args, **kwargs)
+
+    def get_raw_bounds(self, request):
+        """
+        Returns the bounds of the page for the raw list.
+        """
+        paginator = self.paginator
+        if not isinstance(paginator, PageNumberPagination):
+            return None, None
+        # restframework 3.1 reads paginate_by & co on the view
+        if hasattr(paginator, '_handle_backwards_compat'):
+            paginator._handle_backwards_compat(self)
+        page_size = paginator.get_page_size(request)
+        if not page_size:
+            return None, None
+        try:
+            page = int(request.query_params.get(paginator.page_query_param, 1))
+        except ValueError:
+            raise NotFound(paginator.invalid_page_message.format(
+                page_number=request.query_params[paginator.page_query_param],
+                message='That page number is not an integer'))
+        start = (max(page, 1) - 1) * page_size
+        return start, start + page_size
+
+    def raw_list(self, request):
+        """
+        Splices the json of the hits of elasticsearch in the usual envelope,
+        without decoding and encoding the documents.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        start, stop = self.get_raw_bounds(request)
+        hits, response = queryset.raw_hits(self.es_raw_filter_path,
+                                           start, stop)
+
+        data = OrderedDict()
+        if queryset.facets_fields:
+            data['facets'] = queryset.make_facets(response)
+        if response.get('suggest'):
+            data['suggestions'] = response['suggest']
+        if response.get('timed_out'):
+            data['timed_out'] = True
+        # Note: dispatch can't add it to an HttpResponse
+        data['filter_status'] = self.FILTER_STATUS_MESSAGE_OK
+
+        content = '{{"count": {0}, "results": {1}, {2}'.format(
+            json.dumps(response['hits']['total']), hits, json.dumps(data)[1:])
+        return HttpResponse(content, content_type='application/json')
+
+    def _list(self, request, *args, **kwargs):
         if self.es_failed:
             return super(IndexableModelMixin, self).list(request, *args, **kwargs)
+        elif self.es_raw:
+            return self.raw_list(request)
         else:
             # bypass serialization
             queryset = self.filter_queryset(self.get_queryset())
 
             # evaluates the query and cast it to list (why ?)
             page = self.paginate_queryset(queryset)
+            cursor = (page is not None and
+                      isinstance(self.paginator, ElasticsearchCursorPagination))
+            if cursor:
+                # the paginator searched a clone
+                queryset = self.paginator.queryset
 
-            data = OrderedDict([
-                ('count', queryset.count()),
-                ('results', page)
-            ])
+            if cursor:
+                # the count would only cover the rows after the cursor
+                data = OrderedDict([('next', self.paginator.get_next_link())])
+            else:
+                # Note: the count comes from the search response
+                data = OrderedDict([('count', queryset.count())])
+            data['results'] = page
 
             if queryset.facets:
                 data['facets'] = queryset.facets
@@ -125,4 +461,8 @@ class IndexableModelMixin(object):
             if queryset.suggestions:
                 data['suggestions'] = queryset.suggestions
 
+            if queryset.timed_out:
+                # partial results, see es_search_timeout
+                data['timed_out'] = True
+
             return Response(data)
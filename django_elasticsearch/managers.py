@@ -14,6 +14,7 @@ from django.db.models import FieldDoesNotExist
 
 from django_elasticsearch.query import EsQueryset
 from django_elasticsearch.client import es_client
+from django_elasticsearch.cache import bump_generation
 
 # Note: we use long/double because different db backends
 # could store different sizes of numerics ?
@@ -121,6 +122,11 @@ class ElasticsearchManager():
 
     @needs_instance
     def do_index(self):
+        self._do_index()
+        bump_generation(self.index)
+
+    @needs_instance
+    def _do_index(self):
         body = self.serialize()
         es_client.index(index=self.index,
                         doc_type=self.doc_type,
@@ -133,6 +139,7 @@ class ElasticsearchManager():
                          doc_type=self.doc_type,
                          id=self.instance.id,
                          ignore=404)
+        bump_generation(self.index)
 
     def get(self, **kwargs):
         if 'pk' in kwargs:
@@ -147,6 +154,13 @@ class ElasticsearchManager():
 
         return self.queryset.get(id=pk)
 
+    def get_many(self, id_list, fields=None):
+        """
+        Returns a dict of documents keyed by pk in a single request,
+        see EsQueryset.in_bulk
+        """
+        return self.queryset.in_bulk(id_list, fields=fields)
+
     @needs_instance
     def mlt(self, **kwargs):
         """
@@ -222,17 +236,26 @@ class ElasticsearchManager():
     def exclude(self, **kwargs):
         return self.queryset.exclude(**kwargs)
 
-    def complete(self, field_name, query):
+    def complete(self, field_name, query, size=5, context=None):
         """
-        Returns a list of close values for auto-completion
+        Returns a list of close values for auto-completion,
+        field_name can be a list of fields, see EsQueryset.complete
         """
-        if field_name not in (self.model.Elasticsearch.completion_fields or []):
-            raise ValueError("{0} is not in the completion_fields list, "
-                             "it is required to have a specific mapping."
-                             .format(field_name))
+        if isinstance(field_name, basestring):
+            field_names = [field_name]
+        else:
+            field_names = list(field_name)
+
+        completion_fields = self.model.Elasticsearch.completion_fields or []
+        for name in field_names:
+            if name not in completion_fields:
+                raise ValueError("{0} is not in the completion_fields list, "
+                                 "it is required to have a specific mapping."
+                                 .format(name))
 
-        complete_name = "{0}_complete".format(field_name)
-        return self.queryset.complete(complete_name, query)
+        complete_names = ["{0}_complete".format(name) for name in field_names]
+        return self.queryset.complete(complete_names, query, size=size,
+                                      context=context)
 
     def do_update(self):
         """
@@ -240,6 +263,8 @@ class ElasticsearchManager():
         the recently indexed items will be available right away.
         """
         es_client.indices.refresh(index=self.index)
+        # searches done before the refresh may have cached stale results
+        bump_generation(self.index)
 
     def get_fields(self):
         model_fields = [f.name for f in self.model._meta.fields +
@@ -281,6 +306,12 @@ class ElasticsearchManager():
         for field_name in fields:
             complete_name = "{0}_complete".format(field_name)
             mappings[complete_name] = {"type": "completion"}
+            try:
+                # e.g. a context to complete by category
+                mappings[complete_name].update(
+                    self.model.Elasticsearch.mappings[complete_name])
+            except (AttributeError, KeyError, TypeError):
+                pass
 
         return {
             self.doc_type: {
@@ -343,11 +374,14 @@ class ElasticsearchManager():
     def reindex_all(self, queryset=None):
         q = queryset or self.model.objects.all()
         for instance in q:
-            instance.es.do_index()
+            instance.es._do_index()
+        # once for the whole reindexation
+        bump_generation(self.index)
 
     def flush(self):
         es_client.indices.delete_mapping(index=self.index,
                                          doc_type=self.doc_type,
                                          ignore=404)
         self.create_index()
+        # bumps the generation
         self.reindex_all()
@@ -0,0 +1,1592 @@
+"""
+In-process stand-in for an elasticsearch cluster.
+
+MemoryTransport replaces the http transport of the client,
+select it with:
+    ELASTICSEARCH_TRANSPORT_CLASS = 'django_elasticsearch.memory.MemoryTransport'
+
+It implements the subset of the api used by django_elasticsearch:
+index, get, mget, delete, bulk, update, search (and scroll), msearch,
+count, mlt, suggest (term, and completion with category contexts),
+the indices api (create, delete, exists,
+mappings, refresh, settings), the term/terms/range/missing/exists/bool
+filters, match/bool/filtered queries, terms/global/filter aggregations,
+sorting, highlighting and source filtering.
+
+It is not a search engine: the analysis is a naive standard analyzer,
+the scores are rough, and the documents are searchable right away
+(refresh is a no-op). Anything else is answered with a 400 error.
+The data lives in the process and is shared by every client.
+"""
+import re
+import json
+import math
+import time
+import uuid
+import fnmatch
+import calendar
+import threading
+from datetime import datetime
+from datetime import timedelta
+from collections import OrderedDict
+try:
+    from urllib import unquote
+except ImportError:  # python 3
+    from urllib.parse import unquote
+
+from elasticsearch import Transport
+from elasticsearch import TransportError
+from elasticsearch.exceptions import HTTP_EXCEPTIONS
+
+
+_lock = threading.RLock()
+_indices = OrderedDict()
+# scroll id -> (remaining hits, page size, total)
+_scrolls = {}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}'
+                     r'(T\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?'
+                     r'(Z|[+-]\d{2}:?\d{2})?$')
+DATE_MATH_RE = re.compile(r'([+-])(\d+)([yMwdhHms])')
+NUMERIC_TYPES = ('long', 'integer', 'short', 'byte', 'double', 'float')
+
+
+class ApiError(Exception):
+    def __init__(self, status, error):
+        self.status = status
+        self.error = error
+
+
+def reset():
+    """
+    Deletes all the indices.
+    """
+    with _lock:
+        _indices.clear()
+        _scrolls.clear()
+
+
+class MemoryIndex(object):
+    def __init__(self, name, settings=None):
+        self.name = name
+        self.settings = settings or {}
+        self.mappings = {}  # doc_type -> properties
+        self.docs = OrderedDict()  # (doc_type, id) -> Document
+
+    def get_properties(self, doc_type):
+        return self.mappings.setdefault(doc_type, {})
+
+
+class Document(object):
+    def __init__(self, index, doc_type, id, source, version):
+        self.index = index
+        self.doc_type = doc_type
+        self.id = id
+        self.source = source
+        self.version = version
+        self._terms = {}
+
+    @property
+    def properties(self):
+        return self.index.get_properties(self.doc_type)
+
+    def meta(self):
+        return OrderedDict([('_index', self.index.name),
+                            ('_type', self.doc_type),
+                            ('_id', self.id)])
+
+
+# analysis
+
+def tokenize(text):
+    return [(m.group().lower(), m.start(), m.end() - m.start())
+            for m in TOKEN_RE.finditer(text)]
+
+
+def analyze(text):
+    return [token for token, start, length in tokenize(text)]
+
+
+def edit_distance(a, b, max_distance=2):
+    """
+    Optimal string alignment distance (a transposition is one edit),
+    anything farther than max_distance is max_distance + 1.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = None
+    current = range(len(b) + 1)
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1] and 1 or 0
+            current[j] = min(previous[j] + 1,
+                             current[j - 1] + 1,
+                             previous[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2]
+                    and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+    return min(current[len(b)], max_distance + 1)
+
+
+def fuzziness_to_edits(fuzziness, term):
+    if not fuzziness:
+        return 0
+    if isinstance(fuzziness, basestring):
+        if fuzziness.upper() == 'AUTO':
+            return len(term) < 3 and 0 or len(term) < 6 and 1 or 2
+        fuzziness = float(fuzziness)
+    if fuzziness >= 1:
+        return int(min(fuzziness, 2))
+    # a similarity, like lucene's FuzzyQuery.floatToEdits
+    return min(int((1 - fuzziness) * len(term)), 2)
+
+
+def match_score(query_term, term, edits):
+    if query_term == term:
+        return 1.0
+    if edits and edit_distance(query_term, term, edits) <= edits:
+        distance = edit_distance(query_term, term, edits)
+        return 1.0 - float(distance) / min(len(query_term), len(term))
+    return None
+
+
+# dates
+
+def to_millis(d):
+    return calendar.timegm(d.timetuple()) * 1000 + d.microsecond // 1000
+
+
+def parse_date(value):
+    """
+    Returns the number of milliseconds since epoch
+    of a date, a datetime, an iso string or some date math.
+    """
+    if isinstance(value, datetime):
+        return to_millis(value)
+    if isinstance(value, (int, long, float)):
+        return int(value)
+    value = unicode(value)
+    if value.startswith('now'):
+        return parse_date_math(datetime.utcnow(), value[3:])
+    if '||' in value:
+        anchor, math_expr = value.split('||', 1)
+        return parse_date_math(datetime.utcfromtimestamp(
+            parse_date(anchor) / 1000.0), math_expr)
+    if value.isdigit():
+        return int(value)
+
+    value = re.sub(r'(Z|[+-]\d{2}:?\d{2})$', '', value)
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return to_millis(datetime.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise ApiError(400, u'MapperParsingException[failed to parse date '
+                        u'field [{0}]]'.format(value))
+
+
+def parse_date_math(d, expression):
+    rounding = None
+    if '/' in expression:
+        expression, rounding = expression.split('/', 1)
+    for sign, amount, unit in DATE_MATH_RE.findall(expression):
+        amount = int(amount) * (sign == '-' and -1 or 1)
+        if unit == 'y':
+            d = d.replace(year=d.year + amount)
+        elif unit == 'M':
+            month = d.month - 1 + amount
+            d = d.replace(year=d.year + month // 12, month=month % 12 + 1)
+        else:
+            d += timedelta(**{{'w': 'weeks', 'd': 'days', 'h': 'hours',
+                               'H': 'hours', 'm': 'minutes',
+                               's': 'seconds'}[unit]: amount})
+    if rounding:
+        fields = ['y', 'M', 'd', 'h', 'm', 's']
+        rounding = rounding.replace('H', 'h').replace('w', 'd')
+        kwargs = {'microsecond': 0}
+        for unit, attr in zip(fields[fields.index(rounding) + 1:],
+                              ['month', 'day', 'hour', 'minute', 'second']
+                              [fields.index(rounding):]):
+            kwargs[attr] = unit in ('M', 'd') and 1 or 0
+        d = d.replace(**kwargs)
+    return to_millis(d)
+
+
+# mappings
+
+def get_field_mapping(properties, path):
+    mapping = {'properties': properties}
+    for part in path.split('.'):
+        mapping = mapping.get('properties', {}).get(part)
+        if mapping is None:
+            return {}
+    return mapping
+
+
+def get_field_type(mapping):
+    if 'properties' in mapping:
+        return 'object'
+    return mapping.get('type', 'string')
+
+
+def normalize_mapping(properties):
+    for mapping in properties.values():
+        if mapping.get('type') == 'date':
+            mapping.setdefault('format', 'dateOptionalTime')
+        if 'properties' in mapping:
+            if mapping.get('type') == 'object':
+                del mapping['type']
+            normalize_mapping(mapping['properties'])
+    return properties
+
+
+def merge_mapping(properties, new_properties):
+    for field, mapping in new_properties.items():
+        if field in properties and 'properties' in mapping:
+            existing = properties[field]
+            merge_mapping(existing.setdefault('properties', {}),
+                          mapping['properties'])
+            existing.pop('type', None)
+        elif field not in properties:
+            properties[field] = mapping
+
+
+def guess_mapping(value):
+    if isinstance(value, list):
+        mapping = {}
+        for v in value:
+            guessed = guess_mapping(v)
+            if guessed and 'properties' in guessed:
+                merge_mapping(mapping.setdefault('properties', {}),
+                              guessed['properties'])
+            elif guessed:
+                return guessed
+        return mapping or None
+    if isinstance(value, dict):
+        properties = {}
+        for k, v in value.items():
+            guessed = guess_mapping(v)
+            if guessed is not None:
+                properties[k] = guessed
+        return {'properties': properties}
+    if isinstance(value, bool):
+        return {'type': 'boolean'}
+    if isinstance(value, (int, long)):
+        return {'type': 'long'}
+    if isinstance(value, float):
+        return {'type': 'double'}
+    if isinstance(value, basestring):
+        if DATE_RE.match(value):
+            return {'type': 'date', 'format': 'dateOptionalTime'}
+        return {'type': 'string'}
+    return None
+
+
+def update_mapping(properties, source):
+    # dynamic mapping of the unknown fields
+    merge_mapping(properties, guess_mapping(source)['properties'])
+
+
+# field values
+
+def get_values(source, path):
+    values = [source]
+    for part in path.split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict) and value.get(part) is not None:
+                next_values.append(value[part])
+        values = flatten(next_values)
+    return values
+
+
+def flatten(values):
+    flat = []
+    for value in values:
+        if isinstance(value, list):
+            flat.extend(flatten(value))
+        elif value is not None:
+            flat.append(value)
+    return flat
+
+
+def to_term(mapping, value):
+    """
+    Converts a value to what would be stored in the index (unanalyzed).
+    """
+    typ = get_field_type(mapping)
+    if typ == 'date':
+        return parse_date(value)
+    if typ in NUMERIC_TYPES:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ApiError(400, u'NumberFormatException[For input '
+                                u'string: "{0}"]'.format(value))
+    if typ == 'boolean':
+        return value in (True, 1, 'true', 'T', 'on', 'yes', '1')
+    if isinstance(value, bool):
+        return value and u'true' or u'false'
+    return unicode(value)
+
+
+def is_analyzed(mapping):
+    return (get_field_type(mapping) == 'string'
+            and mapping.get('index', 'analyzed') == 'analyzed')
+
+
+def get_terms(doc, field):
+    """
+    Returns the indexed terms of a field.
+    """
+    if field in doc._terms:
+        return doc._terms[field]
+
+    if field == '_all':
+        terms = []
+        for value in get_values_all(doc.source):
+            terms.extend(analyze(to_term({}, value)))
+    elif field == '_id':
+        terms = [doc.id]
+    elif field == '_type':
+        terms = [doc.doc_type]
+    else:
+        mapping = get_field_mapping(doc.properties, field)
+        terms = []
+        for value in get_values(doc.source, field):
+            if isinstance(value, dict):
+                continue
+            if is_analyzed(mapping):
+                terms.extend(analyze(to_term(mapping, value)))
+            else:
+                terms.append(to_term(mapping, value))
+
+    doc._terms[field] = terms
+    return terms
+
+
+def get_values_all(source):
+    values = []
+    for value in flatten(source.values()):
+        if isinstance(value, dict):
+            values.extend(get_values_all(value))
+        else:
+            values.append(value)
+    return values
+
+
+def has_value(doc, field):
+    for value in get_values(doc.source, field):
+        if value != [] and value != {}:
+            return True
+    return False
+
+
+# queries and filters
+
+def unsupported(kind, name):
+    raise ApiError(400, u'SearchPhaseExecutionException[{0} [{1}] is not '
+                        u'supported by MemoryTransport]'.format(kind, name))
+
+
+def field_params(params):
+    # {'field': value, '_cache': True} -> ('field', value)
+    for key, value in params.items():
+        if not key.startswith('_') or key in ('_id', '_type', '_all'):
+            return key, value
+    unsupported('filter', params)
+
+
+class Matcher(object):
+    """
+    Evaluates a query (with a score) and its filters against a document.
+    Also collects the query terms for the highlighting.
+    """
+
+    def __init__(self, query=None):
+        self.query = query
+        self.highlight_terms = []
+        if query:
+            self.collect_terms(query)
+
+    def collect_terms(self, query):
+        for name, params in query.items():
+            if name == 'match':
+                field, params = field_params(params)
+                if not isinstance(params, dict):
+                    params = {'query': params}
+                for term in analyze(unicode(params.get('query', ''))):
+                    self.highlight_terms.append(
+                        (term, fuzziness_to_edits(params.get('fuzziness'),
+                                                  term)))
+            elif name == 'term':
+                field, value = field_params(params)
+                if isinstance(value, dict):
+                    value = value.get('value')
+                self.highlight_terms.append((unicode(value).lower(), 0))
+            elif name == 'bool':
+                for occur in ('must', 'should', 'filter'):
+                    clauses = params.get(occur, [])
+                    if isinstance(clauses, dict):
+                        clauses = [clauses]
+                    for clause in clauses:
+                        self.collect_terms(clause)
+            elif name == 'filtered' and params.get('query'):
+                self.collect_terms(params['query'])
+
+    def score(self, doc):
+        if not self.query:
+            return 1.0
+        return self.score_query(self.query, doc)
+
+    def score_query(self, query, doc):
+        """
+        Returns the score of the document or None if it does not match.
+        """
+        if len(query) != 1:
+            unsupported('query', query.keys())
+        name, params = query.items()[0]
+
+        if name == 'match_all':
+            return 1.0
+
+        if name == 'match':
+            return self.score_match(params, doc)
+
+        if name == 'multi_match':
+            match = dict([(k, v) for k, v in params.items() if k != 'fields'])
+            scores = [self.score_match({field: match}, doc)
+                      for field in params.get('fields', ['_all'])]
+            scores = [s for s in scores if s is not None]
+            return scores and max(scores) or None
+
+        if name in ('term', 'terms', 'range', 'ids', 'prefix', 'missing', 'exists'):
+            return self.match_filter(query, doc) and 1.0 or None
+
+        if name in ('filtered', 'constant_score'):
+            if 'filter' in params and not self.match_filter(params['filter'], doc):
+                return None
+            if params.get('query'):
+                score = self.score_query(params['query'], doc)
+                if score is None or name == 'constant_score':
+                    return score is not None and 1.0 or None
+                return score
+            return 1.0
+
+        if name == 'bool':
+            return self.score_bool(params, doc)
+
+        unsupported('query', name)
+
+    def score_match(self, params, doc):
+        field, params = field_params(params)
+        if not isinstance(params, dict):
+            params = {'query': params}
+        text = params.get('query', '')
+        fuzziness = params.get('fuzziness')
+        operator = params.get('operator', 'or').lower()
+
+        mapping = field != '_all' and get_field_mapping(doc.properties, field) or {}
+        if field == '_all' or is_analyzed(mapping):
+            query_terms = analyze(unicode(text))
+        else:
+            query_terms = [to_term(mapping, text)]
+
+        terms = get_terms(doc, field)
+        score = 0.0
+        matched = 0
+        for query_term in query_terms:
+            if isinstance(query_term, basestring):
+                edits = fuzziness_to_edits(fuzziness, query_term)
+                scores = [match_score(query_term, term, edits)
+                          for term in terms if isinstance(term, basestring)]
+                scores = [s for s in scores if s is not None]
+            else:
+                scores = query_term in terms and [1.0] or []
+            if scores:
+                matched += 1
+                score += max(scores)
+
+        if not matched or (operator == 'and' and matched < len(query_terms)):
+            return None
+        return score
+
+    def score_bool(self, params, doc):
+        score = 0.0
+        for clause in as_list(params.get('must')):
+            s = self.score_query(clause, doc)
+            if s is None:
+                return None
+            score += s
+        for clause in as_list(params.get('filter')):
+            if not self.match_filter(clause, doc):
+                return None
+        for clause in as_list(params.get('must_not')):
+            if self.score_query(clause, doc) is not None:
+                return None
+
+        should = as_list(params.get('should'))
+        matched = 0
+        for clause in should:
+            s = self.score_query(clause, doc)
+            if s is not None:
+                matched += 1
+                score += s
+        minimum = params.get('minimum_should_match')
+        if minimum is None:
+            minimum = (should and not params.get('must')
+                       and not params.get('filter')) and 1 or 0
+        if matched < int(minimum):
+            return None
+        return score or 1.0
+
+    def match_filter(self, filtr, doc):
+        name, params = [(k, v) for k, v in filtr.items()
+                        if not k.startswith('_')][0]
+
+        if name == 'match_all':
+            return True
+
+        if name == 'term':
+            field, value = field_params(params)
+            if isinstance(value, dict):
+                value = value.get('value')
+            return self.match_term(doc, field, value)
+
+        if name == 'terms':
+            field, values = field_params(params)
+            return any([self.match_term(doc, field, value)
+                        for value in values])
+
+        if name == 'range':
+            field, bounds = field_params(params)
+            return self.match_range(doc, field, bounds)
+
+        if name == 'prefix':
+            field, value = field_params(params)
+            if isinstance(value, dict):
+                value = value.get('value')
+            return any([isinstance(term, basestring) and
+                        term.startswith(unicode(value))
+                        for term in get_terms(doc, field)])
+
+        if name == 'ids':
+            return doc.id in [unicode(v) for v in params.get('values', [])]
+
+        if name == 'type':
+            return doc.doc_type == params.get('value')
+
+        if name == 'missing':
+            return not has_value(doc, params['field'])
+
+        if name == 'exists':
+            return has_value(doc, params['field'])
+
+        if name == 'bool':
+            for clause in as_list(params.get('must')):
+                if not self.match_filter(clause, doc):
+                    return False
+            for clause in as_list(params.get('must_not')):
+                if self.match_filter(clause, doc):
+                    return False
+            should = as_list(params.get('should'))
+            if should and not any([self.match_filter(clause, doc)
+                                   for clause in should]):
+                return False
+            return True
+
+        if name in ('and', 'or'):
+            clauses = isinstance(params, dict) and params['filters'] or params
+            results = [self.match_filter(clause, doc) for clause in clauses]
+            return name == 'and' and all(results) or name == 'or' and any(results)
+
+        if name == 'not':
+            return not self.match_filter(params.get('filter', params), doc)
+
+        if name in ('fquery', 'query'):
+            query = name == 'fquery' and params['query'] or params
+            return self.score_query(query, doc) is not None
+
+        unsupported('filter', name)
+
+    def match_term(self, doc, field, value):
+        mapping = get_field_mapping(doc.properties, field)
+        if is_analyzed(mapping) or field in ('_id', '_type'):
+            return unicode(to_term({}, value)) in get_terms(doc, field)
+        return to_term(mapping, value) in get_terms(doc, field)
+
+    def match_range(self, doc, field, bounds):
+        mapping = get_field_mapping(doc.properties, field)
+        bounds = dict(bounds)
+        if 'from' in bounds:
+            key = bounds.pop('include_lower', True) and 'gte' or 'gt'
+            bounds[key] = bounds.pop('from')
+        if 'to' in bounds:
+            key = bounds.pop('include_upper', True) and 'lte' or 'lt'
+            bounds[key] = bounds.pop('to')
+
+        checks = []
+        for op, value in bounds.items():
+            if op not in ('gt', 'gte', 'lt', 'lte') or value is None:
+                continue
+            if is_analyzed(mapping):
+                value = unicode(value).lower()
+            else:
+                value = to_term(mapping, value)
+            checks.append((op, value))
+
+        for term in get_terms(doc, field):
+            for op, value in checks:
+                if ((op == 'gt' and not term > value) or
+                        (op == 'gte' and not term >= value) or
+                        (op == 'lt' and not term < value) or
+                        (op == 'lte' and not term <= value)):
+                    break
+            else:
+                return True
+        return False
+
+    def highlight(self, doc, params):
+        pre = params.get('pre_tags', ['<em>'])[0]
+        post = params.get('post_tags', ['</em>'])[0]
+        highlights = {}
+        for field in params.get('fields', {}):
+            fragments = []
+            for value in get_values(doc.source, field):
+                if not isinstance(value, basestring):
+                    continue
+                fragment = []
+                last = 0
+                found = False
+                for token, start, length in tokenize(value):
+                    if any([match_score(term, token, edits) is not None
+                            for term, edits in self.highlight_terms]):
+                        found = True
+                        fragment.extend([value[last:start], pre,
+                                         value[start:start + length], post])
+                        last = start + length
+                if found:
+                    fragment.append(value[last:])
+                    fragments.append(u''.join(fragment))
+            if fragments:
+                highlights[field] = fragments
+        return highlights
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+# source filtering
+
+def parse_patterns(value):
+    if value in (None, '', True):
+        return []
+    if isinstance(value, basestring):
+        return value.split(',')
+    return list(value)
+
+
+def filter_source(source, includes, excludes, prefix=''):
+    filtered = {}
+    for key, value in source.items():
+        path = prefix + key
+        if any([fnmatch.fnmatch(path, p) for p in excludes]):
+            continue
+        if not includes or any([fnmatch.fnmatch(path, p) for p in includes]):
+            filtered[key] = value
+        elif isinstance(value, dict) and any([p.startswith(path + '.')
+                                              for p in includes]):
+            filtered[key] = filter_source(value, includes, excludes,
+                                          path + '.')
+    return filtered
+
+
+# aggregations
+
+def aggregate(aggs, docs, all_docs):
+    results = {}
+    for name, agg in aggs.items():
+        sub_aggs = agg.get('aggs') or agg.get('aggregations')
+        kinds = [k for k in agg if k not in ('aggs', 'aggregations', 'meta')]
+        kind = kinds[0]
+        params = agg[kind]
+
+        if kind == 'global':
+            result = {'doc_count': len(all_docs)}
+            if sub_aggs:
+                result.update(aggregate(sub_aggs, all_docs, all_docs))
+
+        elif kind == 'filter':
+            matcher = Matcher()
+            matched = [d for d in docs if matcher.match_filter(params, d)]
+            result = {'doc_count': len(matched)}
+            if sub_aggs:
+                result.update(aggregate(sub_aggs, matched, all_docs))
+
+        elif kind == 'missing':
+            matched = [d for d in docs if not has_value(d, params['field'])]
+            result = {'doc_count': len(matched)}
+            if sub_aggs:
+                result.update(aggregate(sub_aggs, matched, all_docs))
+
+        elif kind == 'terms':
+            result = aggregate_terms(params, sub_aggs, docs, all_docs)
+
+        elif kind in ('min', 'max', 'sum', 'avg', 'value_count'):
+            values = []
+            for doc in docs:
+                values.extend([t for t in get_terms(doc, params['field'])
+                               if isinstance(t, (int, long, float))])
+            if kind == 'value_count':
+                value = len(values)
+            elif not values:
+                value = kind == 'sum' and 0 or None
+            else:
+                value = {'min': min, 'max': max, 'sum': sum,
+                         'avg': lambda v: float(sum(v)) / len(v)}[kind](values)
+            result = {'value': value}
+
+        else:
+            unsupported('aggregation', kind)
+
+        results[name] = result
+    return results
+
+
+def aggregate_terms(params, sub_aggs, docs, all_docs):
+    buckets = OrderedDict()
+    for doc in docs:
+        for term in set(get_terms(doc, params['field'])):
+            buckets.setdefault(term, []).append(doc)
+
+    order = params.get('order', {'_count': 'desc'})
+    if order.get('_term') or order.get('_key'):
+        reverse = (order.get('_term') or order.get('_key')) == 'desc'
+        items = sorted(buckets.items(), key=lambda i: i[0], reverse=reverse)
+    else:
+        reverse = order.get('_count', 'desc') == 'desc'
+        items = sorted(sorted(buckets.items(), key=lambda i: i[0]),
+                       key=lambda i: len(i[1]), reverse=reverse)
+
+    size = int(params.get('size', 10)) or len(items)
+    result_buckets = []
+    for term, bucket_docs in items[:size]:
+        if isinstance(term, bool):
+            # elasticsearch 1.x
+            term = term and u'T' or u'F'
+        elif isinstance(term, float) and term.is_integer():
+            term = int(term)
+        bucket = {'key': term, 'doc_count': len(bucket_docs)}
+        if sub_aggs:
+            bucket.update(aggregate(sub_aggs, bucket_docs, all_docs))
+        result_buckets.append(bucket)
+
+    return {'doc_count_error_upper_bound': 0,
+            'sum_other_doc_count': sum([len(d) for t, d in items[size:]]),
+            'buckets': result_buckets}
+
+
+# suggesters
+
+def suggest(body, docs):
+    results = {}
+    global_text = body.get('text')
+    for name, params in body.items():
+        if name == 'text':
+            continue
+        text = params.get('text', global_text) or u''
+        if 'term' in params:
+            results[name] = suggest_terms(text, params['term'], docs)
+        elif 'completion' in params:
+            results[name] = suggest_completion(text, params['completion'], docs)
+        else:
+            unsupported('suggester', params.keys())
+    return results
+
+
+def suggest_terms(text, params, docs):
+    field = params['field']
+    size = int(params.get('size', 5))
+    mode = params.get('suggest_mode', 'missing')
+    max_edits = int(params.get('max_edits', 2))
+    prefix_length = int(params.get('prefix_length', 1))
+    min_word_length = int(params.get('min_word_length', 4))
+
+    freqs = {}
+    for doc in docs:
+        for term in set(get_terms(doc, field)):
+            if isinstance(term, basestring):
+                freqs[term] = freqs.get(term, 0) + 1
+
+    entries = []
+    for token, start, length in tokenize(text):
+        options = []
+        freq = freqs.get(token, 0)
+        if (len(token) >= min_word_length
+                and not (mode == 'missing' and freq)):
+            for term, term_freq in freqs.items():
+                if term == token or term[:prefix_length] != token[:prefix_length]:
+                    continue
+                if mode == 'popular' and term_freq <= freq:
+                    continue
+                distance = edit_distance(token, term, max_edits)
+                if distance > max_edits:
+                    continue
+                options.append({
+                    'text': term,
+                    'score': 1.0 - float(distance) / min(len(token), len(term)),
+                    'freq': term_freq})
+            options.sort(key=lambda o: (-o['score'], -o['freq'], o['text']))
+        entries.append({'text': token, 'offset': start, 'length': length,
+                        'options': options[:size]})
+    return entries
+
+
+def suggest_completion(text, params, docs):
+    field = params['field']
+    size = int(params.get('size', 5))
+    fuzzy = params.get('fuzzy')
+    prefix = u' '.join(text.lower().split())
+
+    edits = 0
+    prefix_length = min_length = 0
+    if fuzzy is not None:
+        edits = fuzziness_to_edits(fuzzy.get('fuzziness',
+                                             fuzzy.get('edit_distance', 1)),
+                                   prefix)
+        prefix_length = int(fuzzy.get('prefix_length', 1))
+        min_length = int(fuzzy.get('min_length', 3))
+    if len(prefix) < min_length:
+        edits = 0
+
+    context = params.get('context')
+    options = {}
+    for doc in docs:
+        if context and not match_context(doc, field, context):
+            continue
+        for value in get_values(doc.source, field):
+            if isinstance(value, dict):
+                inputs = as_list(value.get('input'))
+                output = value.get('output')
+                weight = value.get('weight', 1)
+            else:
+                inputs, output, weight = [value], None, 1
+            for input in inputs:
+                normalized = u' '.join(unicode(input).lower().split())
+                if not match_prefix(normalized, prefix, edits, prefix_length):
+                    continue
+                option = output or unicode(input)
+                options[option] = max(options.get(option, 0), float(weight))
+
+    options = sorted(options.items(), key=lambda o: (-o[1], o[0]))[:size]
+    return [{'text': text, 'offset': 0, 'length': len(text),
+             'options': [{'text': t, 'score': s} for t, s in options]}]
+
+
+def match_context(doc, field, context):
+    """
+    Category contexts only, the values are read at the path
+    of the context mapping or taken from its default.
+    """
+    mapping = get_field_mapping(doc.properties, field) or {}
+    config = mapping.get('context') or {}
+    for name, wanted in context.items():
+        if name not in config:
+            raise ApiError(400, u'ElasticsearchIllegalArgumentException'
+                                u'[unknown context [{0}]]'.format(name))
+        if config[name].get('type', 'category') != 'category':
+            unsupported('context', config[name]['type'])
+        path = config[name].get('path')
+        values = path and get_values(doc.source, path) or []
+        if not values:
+            values = as_list(config[name].get('default'))
+        if not set([unicode(v) for v in values]) & \
+                set([unicode(v) for v in as_list(wanted)]):
+            return False
+    return True
+
+
+def match_prefix(value, prefix, edits, prefix_length):
+    if value.startswith(prefix):
+        return True
+    if not edits or value[:prefix_length] != prefix[:prefix_length]:
+        return False
+    for length in range(len(prefix) - edits, len(prefix) + edits + 1):
+        if 0 < length <= len(value) and \
+                edit_distance(value[:length], prefix, edits) <= edits:
+            return True
+    return False
+
+
+# sorting
+
+def get_sort_keys(sort):
+    """
+    Returns the (field, order) tuples of a sort clause.
+    """
+    keys = []
+    for spec in as_list(sort):
+        if isinstance(spec, basestring):
+            field, order = spec, spec == '_score' and 'desc' or 'asc'
+        else:
+            field, order = spec.items()[0]
+            if isinstance(order, dict):
+                order = order.get('order', 'asc')
+        keys.append((field, order))
+    return keys
+
+
+def sort_docs(hits, sort):
+    """
+    Sorts (score, doc) tuples, returns the sort values of every hit.
+    """
+    sort_values = dict([(id(doc), []) for score, doc in hits])
+    keys = get_sort_keys(sort)
+
+    for field, order in keys:
+        for score, doc in hits:
+            if field == '_score':
+                value = score
+            else:
+                terms = get_terms(doc, field)
+                value = terms and (order == 'desc' and max(terms)
+                                   or min(terms)) or None
+            sort_values[id(doc)].append(value)
+
+    # stable sorts, from the last key to the first
+    for i in range(len(keys) - 1, -1, -1):
+        field, order = keys[i]
+        present = [h for h in hits if sort_values[id(h[1])][i] is not None]
+        missing = [h for h in hits if sort_values[id(h[1])][i] is None]
+        present.sort(key=lambda h: sort_values[id(h[1])][i],
+                     reverse=order == 'desc')
+        hits[:] = present + missing
+
+    return sort_values
+
+
+def apply_filter_path(data, filter_path):
+    """
+    Only keeps the parts of a response matching one of the dotted paths,
+    the lists are traversed and * matches any key.
+    """
+    if isinstance(filter_path, basestring):
+        filter_path = filter_path.split(',')
+    return _filter_path(data, [path.split('.') for path in filter_path])
+
+
+def _filter_path(data, paths):
+    if isinstance(data, list):
+        items = [_filter_path(item, paths) for item in data]
+        return [item for item in items if item not in (None, {}, [])]
+    if not isinstance(data, dict):
+        return None
+
+    result = {}
+    for key, value in data.items():
+        rest = [path[1:] for path in paths if fnmatch.fnmatch(key, path[0])]
+        if not rest:
+            continue
+        if [] in rest:
+            result[key] = value
+            continue
+        value = _filter_path(value, rest)
+        if value not in (None, {}, []):
+            result[key] = value
+    return result
+
+
+# the keys of a search response, in the order elasticsearch writes them
+RESPONSE_KEYS = ('took', 'timed_out', '_shards', 'hits', 'aggregations',
+                 'suggest')
+HITS_KEYS = ('total', 'max_score', 'hits')
+
+
+def _in_order(data, keys):
+    ordered = OrderedDict([(key, data[key]) for key in keys if key in data])
+    for key in sorted(data):
+        if key not in ordered:
+            ordered[key] = data[key]
+    return ordered
+
+
+def in_wire_order(data):
+    """
+    Orders the keys of a search response like elasticsearch does,
+    the raw responses are spliced relying on it.
+    """
+    if not isinstance(data, dict):
+        return data
+    data = _in_order(data, RESPONSE_KEYS)
+    if isinstance(data.get('hits'), dict):
+        data['hits'] = _in_order(data['hits'], HITS_KEYS)
+    return data
+
+
+def to_sort_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+class MemoryTransport(Transport):
+    """
+    Transport that stores the documents in memory instead of
+    sending the requests to a cluster.
+    """
+
+    def __init__(self, hosts, **kwargs):
+        kwargs['sniff_on_start'] = False
+        kwargs['sniff_on_connection_fail'] = False
+        super(MemoryTransport, self).__init__(hosts, **kwargs)
+
+    def perform_request(self, method, url, params=None, body=None):
+        start = time.time()
+        params = dict(params or {})
+        params.pop('request_timeout', None)
+        filter_path = params.pop('filter_path', None)
+        ignore = params.pop('ignore', ())
+        if isinstance(ignore, int):
+            ignore = (ignore,)
+
+        # like it went through the wire
+        if isinstance(body, basestring) and url.startswith('/_search/scroll'):
+            # a bare scroll id
+            pass
+        elif isinstance(body, basestring) and ('_bulk' in url or '_msearch' in url):
+            body = [self.deserializer.loads(line, 'application/json')
+                    for line in body.splitlines() if line.strip()]
+        elif body is not None:
+            body = self.deserializer.loads(self.serializer.dumps(body),
+                                           'application/json')
+            if isinstance(body, list) and len(body) == 1:
+                body = body[0]
+
+        parts = [unquote(part) for part in url.split('?')[0].split('/') if part]
+        try:
+            with _lock:
+                status, data = self.dispatch(method, parts, params, body)
+        except ApiError as e:
+            status, data = e.status, {'error': e.error, 'status': e.status}
+
+        if isinstance(data, dict) and 'took' in data:
+            data['took'] = int((time.time() - start) * 1000)
+        if filter_path and isinstance(data, dict) and 200 <= status < 300:
+            data = apply_filter_path(data, filter_path)
+        if data is not None:
+            data = self.deserializer.loads(self.serializer.dumps(data),
+                                           'application/json')
+
+        if not 200 <= status < 300 and status not in ignore:
+            error = isinstance(data, dict) and data.get('error') or data
+            raise HTTP_EXCEPTIONS.get(status, TransportError)(status, error,
+                                                              data)
+        return status, data
+
+    def perform_raw_request(self, method, url, params=None, body=None):
+        """
+        Returns the body of the response as a json string,
+        formatted like elasticsearch does.
+        """
+        status, data = self.perform_request(method, url, params, body)
+        # compact, like elasticsearch
+        return json.dumps(in_wire_order(data), separators=(',', ':'),
+                          default=self.serializer.default)
+
+    def dispatch(self, method, parts, params, body):
+        endpoint = None
+        for i, part in enumerate(parts):
+            if part.startswith('_') and part != '_all':
+                endpoint = part
+                prefix, suffix = parts[:i], parts[i + 1:]
+                break
+        else:
+            prefix, suffix = parts, []
+
+        if endpoint is None:
+            if not prefix:
+                return 200, {'status': 200,
+                             'name': 'memory',
+                             'version': {'number': '1.7.0'},
+                             'tagline': 'You Know, for Search'}
+            if len(prefix) == 1:
+                return self.index_api(method, prefix[0], body)
+            if len(prefix) == 2 and method == 'HEAD':
+                return self.exists_type(*prefix)
+            if len(prefix) == 2 and method in ('POST', 'PUT'):
+                return self.index_doc(prefix[0], prefix[1], None, body, params)
+            if len(prefix) == 3:
+                return self.doc_api(method, prefix[0], prefix[1], prefix[2],
+                                    body, params)
+
+        handlers = {
+            '_search': self.search,
+            '_count': self.count,
+            '_msearch': self.msearch,
+            '_mget': self.mget,
+            '_bulk': self.bulk,
+            '_suggest': self.suggest,
+            '_mlt': self.mlt,
+            '_update': self.update,
+            '_mapping': self.mapping_api,
+            '_refresh': self.refresh,
+            '_flush': self.refresh,
+            '_optimize': self.refresh,
+            '_settings': self.get_settings,
+        }
+        if endpoint == '_search' and suffix[:1] == ['scroll'] and not prefix:
+            return self.scroll(method, suffix[1:], params, body)
+        if endpoint in handlers and not (suffix and endpoint != '_mapping'):
+            return handlers[endpoint](method, prefix, suffix, params, body)
+
+        unsupported('api', '{0} /{1}'.format(method, '/'.join(parts)))
+
+    # indices
+
+    def get_index(self, name, create=False):
+        if name not in _indices:
+            if not create:
+                raise ApiError(404, u'IndexMissingException[[{0}] '
+                                    u'missing]'.format(name))
+            _indices[name] = MemoryIndex(name)
+        return _indices[name]
+
+    def get_indices(self, names):
+        if not names or names in ('_all', '*'):
+            return list(_indices.values())
+        indices = []
+        for name in names.split(','):
+            if '*' in name:
+                indices.extend([i for n, i in _indices.items()
+                                if fnmatch.fnmatch(n, name)])
+            else:
+                indices.append(self.get_index(name))
+        return indices
+
+    def index_api(self, method, name, body):
+        if method == 'PUT':
+            if name in _indices:
+                raise ApiError(400, u'IndexAlreadyExistsException[[{0}] '
+                                    u'already exists]'.format(name))
+            body = body or {}
+            index = _indices[name] = MemoryIndex(name, body.get('settings'))
+            for doc_type, mapping in (body.get('mappings') or {}).items():
+                index.get_properties(doc_type).update(
+                    normalize_mapping(mapping.get('properties', {})))
+            return 200, {'acknowledged': True}
+        if method == 'DELETE':
+            for index in self.get_indices(name):
+                del _indices[index.name]
+            return 200, {'acknowledged': True}
+        index = self.get_index(name)
+        if method == 'HEAD':
+            return 200, None
+        return 200, {name: {'settings': self.index_settings(index),
+                            'mappings': self.index_mappings(index)}}
+
+    def exists_type(self, name, doc_type):
+        index = self.get_index(name)
+        if doc_type not in index.mappings:
+            raise ApiError(404, u'TypeMissingException')
+        return 200, None
+
+    def index_settings(self, index):
+        settings = {'number_of_shards': '1', 'number_of_replicas': '0'}
+        for key, value in index.settings.items():
+            settings[key.replace('index.', '', 1)] = value
+        return {'index': settings}
+
+    def index_mappings(self, index, doc_types=None):
+        return dict([(doc_type, {'properties': properties})
+                     for doc_type, properties in index.mappings.items()
+                     if not doc_types or doc_type in doc_types])
+
+    def get_settings(self, method, prefix, suffix, params, body):
+        return 200, dict([(index.name, {'settings': self.index_settings(index)})
+                          for index in self.get_indices(prefix and prefix[0])])
+
+    def mapping_api(self, method, prefix, suffix, params, body):
+        doc_type = (suffix or prefix[1:] or [None])[0]
+        if method in ('PUT', 'POST'):
+            for index in self.get_indices(prefix[0]):
+                mapping = (body or {}).get(doc_type, body or {})
+                merge_mapping(index.get_properties(doc_type),
+                              normalize_mapping(mapping.get('properties', {})))
+            return 200, {'acknowledged': True}
+
+        if method == 'DELETE':
+            found = False
+            for index in self.get_indices(prefix[0]):
+                if doc_type in index.mappings:
+                    found = True
+                    del index.mappings[doc_type]
+                    for key in [k for k in index.docs if k[0] == doc_type]:
+                        del index.docs[key]
+            if not found:
+                raise ApiError(404, u'TypeMissingException[[{0}] type[{1}] '
+                                    u'missing]'.format(prefix[0], doc_type))
+            return 200, {'acknowledged': True}
+
+        doc_types = doc_type and doc_type.split(',') or None
+        return 200, dict([(index.name, {'mappings': self.index_mappings(
+            index, doc_types)}) for index in self.get_indices(
+                prefix and prefix[0])])
+
+    def refresh(self, method, prefix, suffix, params, body):
+        # the documents are always searchable
+        self.get_indices(prefix and prefix[0])
+        return 200, {'_shards': self.shards()}
+
+    def shards(self):
+        return {'total': 1, 'successful': 1, 'failed': 0}
+
+    # documents
+
+    def doc_api(self, method, name, doc_type, id, body, params):
+        if method in ('PUT', 'POST'):
+            return self.index_doc(name, doc_type, id, body, params)
+        if method == 'DELETE':
+            return self.delete_doc(name, doc_type, id)
+        if method in ('GET', 'HEAD'):
+            status, data = self.get_doc(name, doc_type, id, params)
+            if method == 'HEAD':
+                return status, None
+            return status, data
+        unsupported('api', method)
+
+    def index_doc(self, name, doc_type, id, source, params):
+        index = self.get_index(name, create=True)
+        if id is None:
+            id = uuid.uuid4().hex
+        id = unicode(id)
+        key = (doc_type, id)
+        existing = index.docs.get(key)
+        if existing is not None and params.get('op_type') == 'create':
+            raise ApiError(409, u'DocumentAlreadyExistsException[[{0}][{1}]: '
+                                u'document already exists]'.format(name, id))
+        version = existing and existing.version + 1 or 1
+        update_mapping(index.get_properties(doc_type), source)
+        doc = index.docs[key] = Document(index, doc_type, id, source, version)
+
+        data = doc.meta()
+        data['_version'] = version
+        data['created'] = existing is None
+        return existing is None and 201 or 200, data
+
+    def delete_doc(self, name, doc_type, id):
+        index = self.get_index(name)
+        doc = index.docs.pop((doc_type, unicode(id)), None)
+        data = OrderedDict([('found', doc is not None), ('_index', name),
+                            ('_type', doc_type), ('_id', unicode(id)),
+                            ('_version', doc and doc.version + 1 or 1)])
+        return doc is not None and 200 or 404, data
+
+    def get_doc(self, name, doc_type, id, params):
+        index = self.get_index(name)
+        doc = None
+        if doc_type in (None, '_all'):
+            for (t, i), d in index.docs.items():
+                if i == unicode(id):
+                    doc = d
+                    break
+        else:
+            doc = index.docs.get((doc_type, unicode(id)))
+        if doc is None:
+            return 404, OrderedDict([('_index', name), ('_type', doc_type),
+                                     ('_id', unicode(id)), ('found', False)])
+        data = doc.meta()
+        data['_version'] = doc.version
+        data['found'] = True
+        source = self.filter_source(doc.source, params)
+        if source is not None:
+            data['_source'] = source
+        return 200, data
+
+    def filter_source(self, source, params, body_source=None):
+        if params.get('_source') in ('false', False) or body_source is False:
+            return None
+        includes = parse_patterns(params.get('_source_include')
+                                  or params.get('_source'))
+        excludes = parse_patterns(params.get('_source_exclude'))
+        if isinstance(body_source, dict):
+            includes = parse_patterns(body_source.get('include'))
+            excludes = parse_patterns(body_source.get('exclude'))
+        elif body_source not in (None, True):
+            includes = parse_patterns(body_source)
+        if not includes and not excludes:
+            return source
+        return filter_source(source, includes, excludes)
+
+    def update(self, method, prefix, suffix, params, body):
+        name, doc_type, id = prefix
+        index = self.get_index(name)
+        doc = index.docs.get((doc_type, unicode(id)))
+        if doc is None:
+            if 'upsert' not in body:
+                raise ApiError(404, u'DocumentMissingException[[{0}] '
+                                    u'missing]'.format(id))
+            source = body['upsert']
+        else:
+            source = dict(doc.source)
+            source.update(body.get('doc', {}))
+        return self.index_doc(name, doc_type, id, source, {})
+
+    def mget(self, method, prefix, suffix, params, body):
+        name = prefix and prefix[0] or None
+        doc_type = len(prefix) > 1 and prefix[1] or None
+        if 'ids' in body:
+            specs = [{'_id': id} for id in body['ids']]
+        else:
+            specs = body.get('docs', [])
+
+        docs = []
+        for spec in specs:
+            spec_params = dict(params)
+            if '_source' in spec:
+                spec_params['_source'] = spec['_source']
+            try:
+                status, data = self.get_doc(spec.get('_index', name),
+                                            spec.get('_type', doc_type),
+                                            spec['_id'], spec_params)
+            except ApiError as e:
+                data = {'_index': spec.get('_index', name),
+                        '_id': unicode(spec['_id']), 'error': e.error}
+            docs.append(data)
+        return 200, {'docs': docs}
+
+    def bulk(self, method, prefix, suffix, params, body):
+        name = prefix and prefix[0] or None
+        doc_type = len(prefix) > 1 and prefix[1] or None
+        items = []
+        errors = False
+        lines = list(body or [])
+        while lines:
+            action = lines.pop(0)
+            op, meta = action.items()[0]
+            source = op != 'delete' and lines.pop(0) or None
+            args = (meta.get('_index', name), meta.get('_type', doc_type),
+                    meta.get('_id'))
+            try:
+                if op in ('index', 'create'):
+                    status, data = self.index_doc(
+                        args[0], args[1], args[2], source,
+                        {'op_type': op == 'create' and 'create' or None})
+                elif op == 'delete':
+                    status, data = self.delete_doc(*args)
+                elif op == 'update':
+                    status, data = self.update(None, list(args), [], {}, source)
+                else:
+                    unsupported('bulk action', op)
+            except ApiError as e:
+                status, data = e.status, {'_index': args[0], '_type': args[1],
+                                          '_id': args[2], 'error': e.error}
+            if status >= 300 and op != 'delete':
+                errors = True
+            data['status'] = status
+            items.append({op: data})
+        return 200, {'took': 0, 'errors': errors, 'items': items}
+
+    # search
+
+    def get_docs(self, prefix):
+        names = prefix and prefix[0] or None
+        doc_types = len(prefix) > 1 and prefix[1].split(',') or None
+        docs = []
+        for index in self.get_indices(names):
+            docs.extend([doc for (doc_type, id), doc in index.docs.items()
+                         if not doc_types or doc_type in doc_types])
+        return docs
+
+    def execute(self, docs, body, params):
+        body = body or {}
+        query = body.get('query')
+        matcher = Matcher(query)
+
+        hits = []
+        for doc in docs:
+            score = matcher.score(doc)
+            if score is not None:
+                hits.append((score, doc))
+
+        response = {'took': 0, 'timed_out': False, '_shards': self.shards()}
+        if 'aggs' in body or 'aggregations' in body:
+            response['aggregations'] = aggregate(
+                body.get('aggs') or body.get('aggregations'),
+                [doc for score, doc in hits], docs)
+
+        post_filter = body.get('post_filter') or body.get('filter')
+        if post_filter:
+            hits = [(score, doc) for score, doc in hits
+                    if matcher.match_filter(post_filter, doc)]
+
+        sort = body.get('sort')
+        if sort:
+            sort_values = sort_docs(hits, sort)
+        else:
+            hits.sort(key=lambda h: -h[0])
+
+        start = int(params.get('from', body.get('from', 0)))
+        size = int(params.get('size', body.get('size', 10)))
+        if params.get('search_type') == 'count':
+            size = 0
+
+        results = []
+        for score, doc in hits[start:start + size]:
+            hit = doc.meta()
+            hit['_score'] = score
+            source = self.filter_source(doc.source, params,
+                                        body.get('_source'))
+            if source is not None:
+                hit['_source'] = source
+            if sort:
+                hit['sort'] = [to_sort_value(v) for v in sort_values[id(doc)]]
+            if 'highlight' in body:
+                highlight = matcher.highlight(doc, body['highlight'])
+                if highlight:
+                    hit['highlight'] = highlight
+            results.append(hit)
+
+        response['hits'] = {
+            'total': len(hits),
+            'max_score': hits and max([s for s, d in hits]) or None,
+            'hits': results}
+
+        if 'suggest' in body:
+            response['suggest'] = suggest(body['suggest'], docs)
+        return response
+
+    def search(self, method, prefix, suffix, params, body):
+        if 'scroll' in params:
+            return 200, self.start_scroll(self.get_docs(prefix), body, params)
+        return 200, self.execute(self.get_docs(prefix), body, params)
+
+    def start_scroll(self, docs, body, params):
+        """
+        Runs the whole search at once and keeps the hits for the scrolls,
+        a scan search returns no hit until the first scroll.
+        """
+        size = int(params.get('size', (body or {}).get('size', 10)))
+        scan = params.get('search_type') == 'scan'
+        params = dict(params, size=len(docs))
+        params['from'] = 0
+        params.pop('search_type', None)
+        response = self.execute(docs, body, params)
+
+        hits = response['hits']['hits']
+        first = []
+        if not scan:
+            first, hits = hits[:size], hits[size:]
+        scroll_id = uuid.uuid4().hex
+        _scrolls[scroll_id] = (hits, size, response['hits']['total'])
+        response['hits']['hits'] = first
+        response['_scroll_id'] = scroll_id
+        return response
+
+    def scroll(self, method, suffix, params, body):
+        scroll_ids = suffix and suffix[0] or params.get('scroll_id') or body
+        if method == 'DELETE':
+            for scroll_id in (scroll_ids or '').split(','):
+                _scrolls.pop(scroll_id, None)
+            return 200, {}
+
+        if scroll_ids not in _scrolls:
+            raise ApiError(404, u'SearchContextMissingException[No search '
+                                u'context found for id [{0}]]'.format(scroll_ids))
+        hits, size, total = _scrolls.pop(scroll_ids)
+        if hits:
+            # the context is dropped once exhausted
+            _scrolls[scroll_ids] = (hits[size:], size, total)
+        return 200, {'_scroll_id': scroll_ids,
+                     'took': 0,
+                     'timed_out': False,
+                     '_shards': self.shards(),
+                     'hits': {'total': total,
+                              'max_score': None,
+                              'hits': hits[:size]}}
+
+    def count(self, method, prefix, suffix, params, body):
+        docs = self.get_docs(prefix)
+        matcher = Matcher((body or {}).get('query'))
+        count = len([doc for doc in docs if matcher.score(doc) is not None])
+        return 200, {'count': count, '_shards': self.shards()}
+
+    def msearch(self, method, prefix, suffix, params, body):
+        responses = []
+        lines = list(body or [])
+        while lines:
+            header, search = lines.pop(0), lines.pop(0)
+            search_prefix = [header.get('index') or (prefix and prefix[0])
+                             or '_all']
+            doc_type = header.get('type') or (len(prefix) > 1 and prefix[1])
+            if doc_type:
+                search_prefix.append(doc_type)
+            try:
+                responses.append(self.execute(self.get_docs(search_prefix),
+                                              search, {}))
+            except ApiError as e:
+                responses.append({'error': e.error, 'status': e.status})
+        return 200, {'responses': responses}
+
+    def suggest(self, method, prefix, suffix, params, body):
+        response = suggest(body or {}, self.get_docs(prefix))
+        response['_shards'] = self.shards()
+        return 200, response
+
+    def mlt(self, method, prefix, suffix, params, body):
+        name, doc_type, id = prefix
+        index = self.get_index(name)
+        source_doc = index.docs.get((doc_type, unicode(id)))
+        if source_doc is None:
+            raise ApiError(404, u'DocumentMissingException[[{0}][{1}]: '
+                                u'document missing]'.format(name, id))
+
+        fields = parse_patterns(params.get('mlt_fields')) or ['_all']
+        min_term_freq = int(params.get('min_term_freq', 2))
+        min_doc_freq = int(params.get('min_doc_freq', 5))
+        max_query_terms = int(params.get('max_query_terms', 25))
+        percent = float(params.get('percent_terms_to_match', 0.3))
+
+        docs = self.get_docs([params.get('search_indices', name),
+                              params.get('search_types', doc_type)])
+        # pick the most interesting terms of the document
+        query_terms = []
+        for field in fields:
+            tfs = {}
+            for term in get_terms(source_doc, field):
+                tfs[term] = tfs.get(term, 0) + 1
+            for term, tf in tfs.items():
+                df = len([d for d in docs if term in get_terms(d, field)])
+                if tf >= min_term_freq and df >= min_doc_freq:
+                    idf = math.log(float(len(docs)) / (df + 1)) + 1
+                    query_terms.append((tf * idf, field, term))
+        query_terms = sorted(query_terms, reverse=True)[:max_query_terms]
+        minimum = max(1, int(len(query_terms) * percent))
+
+        include = params.get('include') in ('true', True)
+        matches = []
+        for doc in docs:
+            if doc is source_doc and not include:
+                continue
+            score = [s for s, field, term in query_terms
+                     if term in get_terms(doc, field)]
+            if query_terms and len(score) >= minimum:
+                matches.append(doc)
+
+        search_params = dict([(k[len('search_'):], v)
+                              for k, v in params.items()
+                              if k in ('search_from', 'search_size')])
+        body = dict(body or {})
+        body.pop('query', None)
+        return 200, self.execute(matches, body, search_params)
@@ -0,0 +1,54 @@
+import logging
+import threading
+
+from django.conf import settings
+
+from django_elasticsearch.cache import start_memo
+from django_elasticsearch.cache import stop_memo
+
+
+logger = logging.getLogger('django_elasticsearch')
+
+_local = threading.local()
+
+
+def get_current_request():
+    return getattr(_local, 'request', None)
+
+
+class EsRequestMiddleware(object):
+    """
+    Keeps track of the current request, so that the slow query log
+    can tell which view made a call.
+    """
+
+    def process_request(self, request):
+        _local.request = request
+
+    def process_response(self, request, response):
+        _local.request = None
+        return response
+
+
+class EsRequestMemoMiddleware(EsRequestMiddleware):
+    """
+    Deduplicates identical searches, counts and gets
+    for the duration of a request.
+    Also keeps track of the current request, like EsRequestMiddleware.
+    """
+
+    def process_request(self, request):
+        super(EsRequestMemoMiddleware, self).process_request(request)
+        start_memo()
+
+    def process_response(self, request, response):
+        response = super(EsRequestMemoMiddleware, self).process_response(
+            request, response)
+        saved = stop_memo()
+        request.es_saved_calls = saved
+        if saved:
+            logger.debug("%s elasticsearch calls saved on %s",
+                         saved, request.path)
+            if settings.DEBUG:
+                response['X-Elasticsearch-Saved-Calls'] = str(saved)
+        return response
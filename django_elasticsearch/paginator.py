@@ -0,0 +1,47 @@
+from django.core.paginator import Paginator
+from django.core.paginator import EmptyPage
+from django.core.paginator import PageNotAnInteger
+
+
+class EsPaginator(Paginator):
+    """
+    Paginator that runs the search of the page before counting,
+    so that the count is taken from the search response (hits.total)
+    instead of a separate count request.
+    It also works with a regular django queryset.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(EsPaginator, self).__init__(*args, **kwargs)
+        # (number, object_list) of the last page searched
+        self._fetched = None
+
+    def _fetch(self, number):
+        if self._fetched is None or self._fetched[0] != number:
+            bottom = (number - 1) * self.per_page
+            top = bottom + self.per_page
+            # fetch the orphans too, in case it is the last page
+            self._fetched = (number,
+                             list(self.object_list[bottom:top + self.orphans]))
+        return self._fetched[1]
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        # restframework 2 validates the number before asking for the page,
+        # search it now so that the count comes with it.
+        self._fetch(number)
+        return super(EsPaginator, self).validate_number(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        object_list = self._fetch(number)
+        top = number * self.per_page
+        # the count is known now
+        if top + self.orphans < self.count:
+            object_list = object_list[:self.per_page]
+        return self._get_page(object_list, number, self)
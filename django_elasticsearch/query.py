@@ -1,12 +1,89 @@
+import re
 import copy
+import json
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
+from django.db import connections
 from django.db.models import Model
 from django.db.models.query import QuerySet
 from django.db.models.query import REPR_OUTPUT_SIZE
 
+from elasticsearch import TransportError
+from elasticsearch import ConnectionTimeout
+from elasticsearch import helpers
+
+from django_elasticsearch import cache
 from django_elasticsearch.client import es_client
-from django_elasticsearch.utils import nested_update
+from django_elasticsearch.client import raw_search
+from django_elasticsearch.signals import es_timeout
+from django_elasticsearch.slowlog import log_timeout
+
+
+# the start of a raw response filtered on timed_out, hits.total and hits.hits
+RAW_HITS_RE = re.compile(r'^\{(?:"timed_out":(?:true|false),)?'
+                         r'"hits":\{"total":\d+(,"hits":)?')
+
+# the sort values elasticsearch 1.x gives to the missing numbers and dates
+MISSING_SORT_VALUES = (2 ** 63 - 1, -2 ** 63, float('inf'), float('-inf'))
+
+
+def split_raw_hits(content, tail_keys=()):
+    """
+    Splits a raw search response into the json of its hits, untouched,
+    and the rest of the response, decoded.
+    tail_keys are the keys following the hits (aggregations, suggest),
+    The hits are only spliced if the response has timed_out, hits.total,
+    hits.hits then the tail_keys in that order, like elasticsearch
+    writes it, otherwise they are decoded and encoded again.
+    """
+    match = RAW_HITS_RE.match(content)
+    if match is None or not match.group(1):
+        # not laid out as expected, or no hits at all
+        rest = json.loads(content)
+        hits = rest.get('hits', {}).pop('hits', [])
+        return json.dumps(hits), rest
+
+    start = match.end()
+    # right after the hits: ...]}}
+    end = len(content) - 2
+    for key in ('aggregations', 'suggest'):
+        if key not in tail_keys:
+            continue
+        # search backward: the documents could contain it too,
+        # but only the real one is followed by a valid tail.
+        marker = ']},"' + key + '":'
+        pos = content.rfind(marker)
+        while pos >= start:
+            try:
+                json.loads('{' + content[pos + 3:])
+            except ValueError:
+                pos = content.rfind(marker, start, pos)
+            else:
+                end = pos + 1
+                break
+        break
+    rest = json.loads(content[:match.start(1)] + content[end:])
+    return content[start:end], rest
+
+
+class RequestTimeoutClient(object):
+    """
+    Passes request_timeout to every call of the client,
+    for the helpers that make several calls (e.g. scan).
+    """
+
+    def __init__(self, client, request_timeout):
+        self.client = client
+        self.request_timeout = request_timeout
+
+    def __getattr__(self, name):
+        func = getattr(self.client, name)
+
+        def call(*args, **kwargs):
+            kwargs.setdefault('request_timeout', self.request_timeout)
+            return func(*args, **kwargs)
+        return call
 
 
 class EsQueryset(QuerySet):
@@ -25,6 +102,8 @@ class EsQueryset(QuerySet):
         self.mode = self.MODE_SEARCH
         self.mlt_kwargs = None
         self.filters = {}
+        # applied to the hits after the aggregations
+        self.post_filters = {}
         self.extra_body = None
         self.facets_fields = None
         self.suggest_fields = None
@@ -38,15 +117,35 @@ class EsQueryset(QuerySet):
         self.ndx = None
         self._query = ''
         self._deserialize = False
+        self._facets_only = False
+        # result cache (django cache framework), disabled if None or 0
+        self._cache_timeout = getattr(settings, 'ELASTICSEARCH_CACHE_TIMEOUT', None)
+        # None lets elasticsearch decide what to cache
+        self._cache = getattr(settings, 'ELASTICSEARCH_QUERY_CACHE', None)
+        # document cache of get (django cache framework), disabled if None
+        self._doc_cache_timeout = getattr(
+            settings, 'ELASTICSEARCH_DOCUMENT_CACHE_TIMEOUT', None)
+        # None fetches the whole _source
+        self._source_fields = None
+        self._realtime = True
+        self._refresh = False
 
         self._start = 0
         self._stop = None
+        # None unless paginating with seek
+        self._seek = None
+        # time budgets, server side (e.g. '500ms') and client side (seconds)
+        self._timeout = None
+        self._request_timeout = None
 
         # results
         self._suggestions = None
         self._facets = None
+        self._timed_out = False
         self._result_cache = []  # store
         self._total = None
+        # set by set_response, count() only sets _total
+        self._searched = False
 
     def __deepcopy__(self, memo):
         """
@@ -54,7 +153,8 @@ class EsQueryset(QuerySet):
         """
         obj = self.__class__(self.model)
         for k, v in self.__dict__.items():
-            if k not in ['_result_cache', '_facets', '_suggestions', '_total']:
+            if k not in ['_result_cache', '_facets', '_suggestions', '_total',
+                         '_searched']:
                 obj.__dict__[k] = copy.deepcopy(v, memo)
         return obj
 
@@ -65,6 +165,7 @@ class EsQueryset(QuerySet):
         # clone._facets = None
         clone._result_cache = []  # store
         clone._total = None
+        clone._timed_out = False
         return clone
 
     def __iter__(self):
@@ -119,6 +220,74 @@ class EsQueryset(QuerySet):
         self.do_search()
         return len(self._result_cache)
 
+    def make_filter(self, filters):
+        """
+        Compiles the lookups to a single bool filter,
+        it does not affect the scoring so elasticsearch can cache it.
+        """
+        clauses = {}
+        mapping = self.model.es.get_mapping()
+
+        for field, value in filters.items():
+            try:
+                value = value.lower()
+            except AttributeError:
+                pass
+
+            field, operator = self.sanitize_lookup(field)
+
+            try:
+                is_nested = 'properties' in mapping[field]
+            except KeyError:
+                # abstract
+                is_nested = False
+
+            field_name = is_nested and field + ".id" or field
+            if is_nested and isinstance(value, Model):
+                value = value.id
+
+            occur = 'must'
+            if operator == 'exact':
+                clause = {'term': {field_name: value}}
+
+            elif operator == 'not':
+                occur = 'must_not'
+                clause = {'term': {field_name: value}}
+
+            elif operator == 'should':
+                occur = 'should'
+                clause = {'term': {field_name: value}}
+
+            elif operator == 'contains':
+                # Note: a query filter is only cacheable through fquery
+                clause = {'fquery': {'query': {'match': {field_name: {
+                    'query': value}}}}}
+                if self._cache is not None:
+                    clause['fquery']['_cache'] = self._cache
+
+            elif operator in ['gt', 'gte', 'lt', 'lte']:
+                clause = {'range': {field_name: {operator: value}}}
+
+            elif operator == 'range':
+                clause = {'range': {field_name: {
+                    'gte': value[0],
+                    'lte': value[1]}}}
+
+            elif operator == 'isnull':
+                if value:
+                    clause = {'missing': {'field': field_name}}
+                else:
+                    clause = {'exists': {'field': field_name}}
+
+            clauses.setdefault(occur, []).append(clause)
+
+        # term and range filters are cached by default,
+        # but not the bool filter combining them.
+        if self._cache is not None:
+            clauses['_cache'] = self._cache
+
+        return {'bool': clauses}
+
     def make_search_body(self):
         body = {}
         search = {}
@@ -138,58 +307,14 @@ class EsQueryset(QuerySet):
                 },
             }
 
+        filters = []
         if self.filters:
-            # TODO: should we add _cache = true ?!
-            search['filter'] = {}
-            mapping = self.model.es.get_mapping()
-
-            for field, value in self.filters.items():
-                try:
-                    value = value.lower()
-                except AttributeError:
-                    pass
-
-                field, operator = self.sanitize_lookup(field)
-
-                try:
-                    is_nested = 'properties' in mapping[field]
-                except KeyError:
-                    # abstract
-                    is_nested = False
-
-                field_name = is_nested and field + ".id" or field
-                if is_nested and isinstance(value, Model):
-                    value = value.id
-
-                if operator == 'exact':
-                    filtr = {'bool': {'must': [{'term': {field_name: value}}]}}
-
-                elif operator == 'not':
-                    filtr = {'bool': {'must_not': [{'term': {field_name: value}}]}}
-
-                elif operator == 'should':
-                    filtr = {'bool': {operator: [{'term': {field_name: value}}]}}
-
-                elif operator == 'contains':
-                    filtr = {'query': {'match': {field_name: {'query': value}}}}
-
-                elif operator in ['gt', 'gte', 'lt', 'lte']:
-                    filtr = {'bool': {'must': [{'range': {field_name: {
-                        operator: value}}}]}}
-
-                elif operator == 'range':
-                    filtr = {'bool': {'must': [{'range': {field_name: {
-                        'gte': value[0],
-                        'lte': value[1]}}}]}}
-
-                elif operator == 'isnull':
-                    if value:
-                        filtr = {'missing': {'field': field_name}}
-                    else:
-                        filtr = {'exists': {'field': field_name}}
-
-                nested_update(search['filter'], filtr)
-
+            filters.append(self.make_filter(self.filters))
+        if self._seek:
+            filters.append(self.make_seek_filter())
+        if filters:
+            search['filter'] = (len(filters) == 1 and filters[0]
+                                or {'bool': {'must': filters}})
             body['query'] = {'filtered': search}
         else:
             body = search
@@ -198,6 +323,8 @@ class EsQueryset(QuerySet):
 
     @property
     def is_evaluated(self):
+        if self._facets_only:
+            return self._searched
         return bool(self._result_cache)
 
     @property
@@ -208,10 +335,10 @@ class EsQueryset(QuerySet):
     def _fetch_all(self):
         self.do_search()
 
-    def do_search(self):
-        if self.is_evaluated:
-            return
-
+    def make_search_params(self):
+        """
+        Returns the kwargs of es_client.search for this queryset.
+        """
         body = self.make_search_body()
         if self.facets_fields:
             aggs = dict([
@@ -220,13 +347,28 @@ class EsQueryset(QuerySet):
                 for field in self.facets_fields
             ])
             if self.facets_limit:
-                aggs[field]['terms']['size'] = self.facets_limit
+                for field in self.facets_fields:
+                    aggs[field]['terms']['size'] = self.facets_limit
 
             if self.global_facets:
                 aggs = {'global_count': {'global': {}, 'aggs': aggs}}
+            elif self.post_filters:
+                # each facet is narrowed by the post filters
+                # on the other fields, not by its own
+                for field in self.facets_fields:
+                    others = dict([
+                        (lookup, value)
+                        for lookup, value in self.post_filters.items()
+                        if self.sanitize_lookup(lookup)[0] != field])
+                    if others:
+                        aggs[field] = {'filter': self.make_filter(others),
+                                       'aggs': {field: aggs[field]}}
 
             body['aggs'] = aggs
 
+        if self.post_filters:
+            body['post_filter'] = self.make_filter(self.post_filters)
+
         if self.suggest_fields:
             suggest = {}
             for field_name in self.suggest_fields:
@@ -236,10 +378,17 @@ class EsQueryset(QuerySet):
                     suggest[field_name]["term"]["size"] = self.suggest_limit
             body['suggest'] = suggest
 
-        if self.ordering:
+        if self._seek is not None:
+            # the pk is the tiebreaker, the score can't be seeked
+            body['sort'] = [{field: desc and "desc" or "asc"}
+                            for field, desc in self.get_seek_ordering()]
+        elif self.ordering:
             body['sort'] = [{f: "asc"} if f[0] != '-' else {f[1:]: "desc"}
                             for f in self.ordering] + ["_score"]
 
+        if self._source_fields:
+            body['_source'] = self.get_source_fields()
+
         search_params = {
             'index': self.index,
             'doc_type': self.doc_type
@@ -249,34 +398,120 @@ class EsQueryset(QuerySet):
         if self._stop:
             search_params['size'] = self._stop - self._start
 
+        if self._facets_only:
+            # only the aggregations are needed, don't fetch any document
+            search_params.pop('from', None)
+            search_params['size'] = 0
+
         if self.extra_body:
             body.update(self.extra_body)
         search_params['body'] = body
-        self._body = body
 
+        return search_params
+
+    def do_search(self):
+        if self.is_evaluated:
+            return
+
+        search_params = self.make_search_params()
+        r = self.get_cached_response('search', search_params)
+        if r is None:
+            r = self.execute_search(dict(search_params))
+            if r.get('timed_out'):
+                # partial results, not worth caching
+                self.record_timeout('search', search_params)
+            else:
+                self.set_cached_response('search', search_params, r)
+
+        self._body = search_params['body']
+        self.set_response(r)
+
+    def get_timeout_params(self):
+        if self._request_timeout is not None:
+            return {'request_timeout': self._request_timeout}
+        return {}
+
+    def record_timeout(self, operation, params, error=None):
+        """
+        Logs and signals (es_timeout) a call that exceeded its time budget.
+        """
+        log_timeout(operation, params, self._timeout, self._request_timeout,
+                    error)
+        es_timeout.send(sender=self.__class__,
+                        operation=operation,
+                        index=self.index,
+                        doc_type=self.doc_type,
+                        timeout=self._timeout,
+                        request_timeout=self._request_timeout,
+                        error=error)
+
+    def execute_search(self, search_params):
+        try:
+            return self._execute_search(search_params)
+        except ConnectionTimeout as e:
+            self.record_timeout('search', search_params, error=e)
+            raise
+
+    def _execute_search(self, search_params):
+        search_params.update(self.get_timeout_params())
         if self.mode == self.MODE_MLT:
+            mlt_kwargs = dict(self.mlt_kwargs)
             # change include's defaults to False
-            search_params['include'] = self.mlt_kwargs.pop('include', False)
+            search_params['include'] = mlt_kwargs.pop('include', False)
             # update search params names
-            search_params.update(self.mlt_kwargs)
+            search_params.update(mlt_kwargs)
             for param in ['type', 'indices', 'types', 'scroll', 'size', 'from']:
                 if param in search_params:
                     search_params['search_{0}'.format(param)] = search_params.pop(param)
-            r = es_client.mlt(**search_params)
+            return es_client.mlt(**search_params)
         else:
             if 'from' in search_params:
                 search_params['from_'] = search_params.pop('from')
+            query_cache = self.get_query_cache()
+            if query_cache is not None:
+                # Note: not a parameter of the search of elasticsearch-py 1.x
+                search_params['params'] = {
+                    'query_cache': query_cache and 'true' or 'false'}
+            if self._timeout is not None:
+                search_params['timeout'] = self._timeout
 
-            r = es_client.search(**search_params)
+            return es_client.search(**search_params)
 
+    def _cache_params(self, params):
+        if self.mode == self.MODE_MLT:
+            params = dict(params, mlt=self.mlt_kwargs)
+        return params
+
+    def get_cached_response(self, operation, params):
+        """
+        Looks for the response in the request memo, then in the result cache.
+        """
+        params = self._cache_params(params)
+        r = cache.get_memoized(operation, params)
+        if r is None and self._cache_timeout:
+            r = cache.get_cached(cache.make_key(operation, params))
+            if r is not None:
+                cache.memoize(operation, params, r)
+        return r
+
+    def set_cached_response(self, operation, params, r):
+        params = self._cache_params(params)
+        cache.memoize(operation, params, r)
+        if self._cache_timeout:
+            cache.set_cached(cache.make_key(operation, params), r,
+                             self._cache_timeout)
+
+    def set_response(self, r):
+        """
+        Populates the results, facets and suggestions from a search response.
+        """
         self._response = r
+        self._searched = True
         if self.facets_fields:
-            if self.global_facets:
-                self._facets = r['aggregations']['global_count']
-            else:
-                self._facets = r['aggregations']
+            self._facets = self.make_facets(r)
 
         self._suggestions = r.get('suggest')
+        self._timed_out = r.get('timed_out', False)
         if self._deserialize:
             self._result_cache = [self.model.es.deserialize(e['_source'])
                                   for e in r['hits']['hits']]
@@ -286,7 +521,116 @@ class EsQueryset(QuerySet):
 
         self._total = r['hits']['total']
 
-        return
+    def make_facets(self, r):
+        """
+        Returns the facets of a search response.
+        """
+        if self.global_facets:
+            return r['aggregations']['global_count']
+        facets = dict(r['aggregations'])
+        if self.post_filters:
+            for field in self.facets_fields:
+                if field in facets[field]:
+                    # unwrap the filter aggregation
+                    facets[field] = facets[field][field]
+        return facets
+
+    @classmethod
+    def evaluate_many(cls, querysets):
+        """
+        Evaluates several querysets in a single multi search request.
+        Note: the mlt api can't be batched, those querysets
+        are evaluated separately.
+        """
+        pending = []
+        body = []
+        for qs in querysets:
+            if qs.is_evaluated:
+                continue
+
+            if qs.mode == cls.MODE_MLT:
+                qs.do_search()
+                continue
+
+            search_params = qs.make_search_params()
+            r = qs.get_cached_response('search', search_params)
+            if r is not None:
+                qs._body = search_params['body']
+                qs.set_response(r)
+                continue
+
+            # from and size go in the body of a multi search
+            search = dict(search_params['body'])
+            for param in ['from', 'size']:
+                if param in search_params:
+                    search[param] = search_params[param]
+            if qs._timeout is not None:
+                search['timeout'] = qs._timeout
+
+            header = {'index': search_params['index'],
+                      'type': search_params['doc_type']}
+            query_cache = qs.get_query_cache()
+            if query_cache is not None:
+                header['query_cache'] = query_cache
+
+            body.extend([header, search])
+            pending.append((qs, search_params, search))
+
+        if pending:
+            msearch_params = {'body': body}
+            # the whole request waits for the slowest search
+            request_timeouts = [qs._request_timeout for qs, _, _ in pending
+                                if qs._request_timeout is not None]
+            if request_timeouts:
+                msearch_params['request_timeout'] = max(request_timeouts)
+            try:
+                r = es_client.msearch(**msearch_params)
+            except ConnectionTimeout as e:
+                for qs, search_params, _ in pending:
+                    qs.record_timeout('msearch', search_params, error=e)
+                raise
+
+            for (qs, search_params, search), response in zip(pending, r['responses']):
+                if 'error' in response:
+                    raise TransportError(response.get('status', 'N/A'),
+                                         response['error'])
+                if response.get('timed_out'):
+                    # partial results, not worth caching
+                    qs.record_timeout('search', search_params)
+                else:
+                    qs.set_cached_response('search', search_params, response)
+                qs._body = search
+                qs.set_response(response)
+
+        return querysets
+
+    @classmethod
+    def evaluate_parallel(cls, querysets, max_workers=None):
+        """
+        Evaluates several querysets concurrently on a bounded pool of threads
+        sharing the client's connection pool.
+        """
+        pending = []
+        for qs in querysets:
+            # the same instance must not be evaluated by two threads
+            if not qs.is_evaluated and qs not in pending:
+                pending.append(qs)
+
+        if max_workers is None:
+            max_workers = getattr(settings, 'ELASTICSEARCH_PARALLEL_WORKERS', 4)
+        if len(pending) < 2 or max_workers < 2:
+            for qs in pending:
+                qs.do_search()
+            return querysets
+
+        pool = ThreadPool(min(max_workers, len(pending)))
+        try:
+            pool.map(_do_search, pending)
+        finally:
+            pool.close()
+            pool.join()
+
+        return querysets
 
     def query(self, query):
         clone = self._clone()
@@ -301,12 +645,77 @@ class EsQueryset(QuerySet):
         clone.global_facets = use_globals
         return clone
 
+    def facets_only(self):
+        """
+        Only fetch the facets (and the count), without any document.
+        Note: the response is small and can be cached by elasticsearch.
+        """
+        clone = self._clone()
+        clone._facets_only = True
+        return clone
+
     def suggest(self, fields, limit=None):
         clone = self._clone()
         clone.suggest_fields = fields
         clone.suggest_limit = limit
         return clone
 
+    def seek(self, values=None):
+        """
+        Keyset pagination: only returns the documents sorted after
+        the given sort values, which are those of the last hit of the
+        previous page (see sort_values), None starts from the first one.
+        Unlike from/size, it costs the same on any page.
+        Note: the pk is added to the ordering as a tiebreaker, the
+        documents are not sorted by score, and the queryset must be
+        sliced from 0.
+        """
+        clone = self._clone()
+        clone._seek = list(values or [])
+        return clone
+
+    def get_seek_ordering(self):
+        """
+        The (field, descending) tuples of the ordering of seek.
+        """
+        pk = self.model._meta.pk.name
+        ordering = []
+        for f in self.ordering or []:
+            ordering.append((f.lstrip('-'), f.startswith('-')))
+            if f.lstrip('-') == pk:
+                # unique, the next fields never break a tie
+                return ordering
+        return ordering + [(pk, False)]
+
+    def make_seek_filter(self):
+        """
+        Compiles the seek values to a filter on the documents sorted
+        after them: for an ordering a, b and the values x, y:
+        a > x, or a is missing, or a == x and b > y, or ...
+        The missing values are sorted last, like elasticsearch does,
+        their sort value is None or a placeholder (MISSING_SORT_VALUES).
+        """
+        ordering = self.get_seek_ordering()
+        if len(self._seek) != len(ordering):
+            raise ValueError("seek needs a value for each field of the "
+                             "ordering and the pk, got {0}.".format(self._seek))
+
+        # Note: unlike make_filter, the values are the indexed terms
+        # the documents are sorted on, they are not lowercased
+        clauses = []
+        equal = []
+        for (field, desc), value in zip(ordering, self._seek):
+            missing = {'missing': {'field': field}}
+            if value is None or value in MISSING_SORT_VALUES:
+                # only the other missing values can come after it
+                equal.append(missing)
+                continue
+            after = {'range': {field: {desc and 'lt' or 'gt': value}}}
+            clauses.append({'bool': {'must': equal + [after]}})
+            clauses.append({'bool': {'must': equal + [missing]}})
+            equal = equal + [{'term': {field: value}}]
+        return {'bool': {'should': clauses}}
+
     def order_by(self, *fields):
         clone = self._clone()
         clone.ordering = fields
@@ -317,6 +726,17 @@ class EsQueryset(QuerySet):
         clone.filters.update(kwargs)
         return clone
 
+    def post_filter(self, **kwargs):
+        """
+        Like filter, but applied to the hits after the aggregations:
+        the non global facets count the documents without these filters,
+        each facet being still narrowed by the post filters on the other
+        fields, all in one request.
+        """
+        clone = self._clone()
+        clone.post_filters.update(kwargs)
+        return clone
+
     def sanitize_lookup(self, lookup):
         valid_operators = ['exact', 'not', 'should', 'range', 'gt', 'lt', 'gte', 'lte', 'contains', 'isnull']
         words = lookup.split('__')
@@ -365,9 +785,19 @@ class EsQueryset(QuerySet):
         if pk is None:
             raise AttributeError("EsQueryset.get needs to get passed a 'pk' or 'id' parameter.")
 
-        r = es_client.get(index=self.index,
-                          doc_type=self.doc_type,
-                          id=pk)
+        get_params = self.make_get_params(pk)
+        r = self.get_cached_document(get_params)
+        if r is None:
+            request_params = dict(get_params, **self.get_timeout_params())
+            if self._refresh:
+                request_params['refresh'] = True
+            try:
+                r = es_client.get(**request_params)
+            except ConnectionTimeout as e:
+                self.record_timeout('get', get_params, error=e)
+                raise
+            self.set_cached_document(get_params, r)
+        cache.memoize('get', get_params, r)
         self._response = r
 
         if self._deserialize:
@@ -375,23 +805,240 @@ class EsQueryset(QuerySet):
         else:
             return r['_source']
 
+    def make_get_params(self, pk, fields=None):
+        get_params = {
+            'index': self.index,
+            'doc_type': self.doc_type,
+            'id': pk
+        }
+        if fields or self._source_fields:
+            get_params['_source_include'] = self.get_source_fields(fields)
+        if not self._realtime:
+            get_params['realtime'] = False
+        return get_params
+
+    def get_cached_document(self, get_params):
+        """
+        Returns the get response from the request memo
+        or the document cache, None if not there.
+        """
+        if self._refresh:
+            return None
+        r = cache.get_memoized('get', get_params)
+        if r is None and self._doc_cache_timeout:
+            r = cache.get_cached(cache.make_key('get', get_params))
+        return r
+
+    def set_cached_document(self, get_params, r):
+        if self._doc_cache_timeout:
+            # any write on the index invalidates it, see cache.make_key
+            cache.set_cached(cache.make_key('get', get_params), r,
+                             self._doc_cache_timeout)
+
+    def in_bulk(self, id_list, fields=None):
+        """
+        Returns a dict of the documents (or instances) keyed by pk,
+        fetched in a single multi get request.
+        Missing documents are not in the dict.
+        Like get, it goes through the request memo and the document cache.
+        :arg fields: only fetch those fields from the _source
+        (defaults to the fields of .only())
+        """
+        if not id_list:
+            return {}
+
+        docs = []
+        missing = []
+        for pk in id_list:
+            get_params = self.make_get_params(pk, fields)
+            r = self.get_cached_document(get_params)
+            if r is None:
+                missing.append((pk, get_params))
+            else:
+                docs.append(r)
+
+        if missing:
+            mget_params = {
+                'index': self.index,
+                'doc_type': self.doc_type,
+                'body': {'ids': [pk for pk, get_params in missing]}
+            }
+            if fields or self._source_fields:
+                mget_params['_source_include'] = self.get_source_fields(fields)
+            if not self._realtime:
+                mget_params['realtime'] = False
+            request_params = dict(mget_params, **self.get_timeout_params())
+            if self._refresh:
+                request_params['refresh'] = True
+            try:
+                r = es_client.mget(**request_params)
+            except ConnectionTimeout as e:
+                self.record_timeout('mget', mget_params, error=e)
+                raise
+            self._response = r
+
+            for (pk, get_params), doc in zip(missing, r['docs']):
+                if doc.get('found'):
+                    self.set_cached_document(get_params, doc)
+                    cache.memoize('get', get_params, doc)
+                docs.append(doc)
+
+        # elasticsearch ids are strings
+        pks = dict([(unicode(pk), pk) for pk in id_list])
+        results = {}
+        for doc in docs:
+            if not doc.get('found'):
+                continue
+            if self._deserialize:
+                obj = self.model.es.deserialize(doc['_source'])
+            else:
+                obj = doc['_source']
+            results[pks.get(doc['_id'], doc['_id'])] = obj
+
+        return results
+
+    def raw_response(self, filter_path=None, start=None, stop=None):
+        """
+        Returns the search response as the json string elasticsearch sent,
+        without decoding it, to be spliced as is in an http response.
+        filter_path trims it (e.g. ['hits.total', 'hits.hits._source']),
+        start and stop are the bounds of the slice to fetch.
+        Note: not cached, and not available for mlt querysets.
+        """
+        if self.mode == self.MODE_MLT:
+            raise NotImplementedError("raw_response is not available "
+                                      "for mlt querysets.")
+        clone = self._clone()
+        if start is not None:
+            clone._start = start
+        if stop is not None:
+            clone._stop = stop
+        search_params = clone.make_search_params()
+
+        params = {}
+        for param in ('from', 'size'):
+            if param in search_params:
+                params[param] = search_params[param]
+        if self._timeout is not None:
+            params['timeout'] = self._timeout
+        params.update(self.get_timeout_params())
+        if filter_path:
+            if not isinstance(filter_path, basestring):
+                filter_path = ','.join(filter_path)
+            params['filter_path'] = filter_path
+
+        return raw_search(index=self.index, doc_type=self.doc_type,
+                          body=search_params['body'], params=params)
+
+    def raw_hits(self, filter_path=None, start=None, stop=None):
+        """
+        Returns the hits of the search as the json string elasticsearch
+        sent ('[{"_source": {...}}, ...]' by default), to be spliced as is
+        in an http response, and the rest of the response decoded
+        (hits.total, timed_out, aggregations, suggest).
+        filter_path trims the hits, it must start with 'hits.hits'.
+        Note: not cached, and not available for mlt querysets.
+        """
+        tail_keys = []
+        if self.facets_fields:
+            tail_keys.append('aggregations')
+        if self.suggest_fields:
+            tail_keys.append('suggest')
+        filter_path = list(filter_path or ['hits.hits._source'])
+        filter_path += ['timed_out', 'hits.total'] + tail_keys
+        content = self.raw_response(filter_path, start, stop)
+        return split_raw_hits(content, tail_keys)
+
+    def scan(self, size=500, scroll='5m', preserve_order=False):
+        """
+        Iterates over every matching document, fetched by batches of
+        `size` (per shard) with a scroll, so the memory use doesn't depend
+        on the number of documents. The slice, facets and suggestions
+        are ignored, and so is the ordering unless preserve_order is True.
+        """
+        search_params = self.make_search_params()
+        body = search_params['body']
+        for key in ('aggs', 'suggest'):
+            body.pop(key, None)
+        if not preserve_order:
+            body.pop('sort', None)
+
+        client = es_client
+        kwargs = {}
+        if self._timeout is not None:
+            kwargs['timeout'] = self._timeout
+        if self._request_timeout is not None:
+            # the scrolls too, not only the initial search
+            client = RequestTimeoutClient(es_client, self._request_timeout)
+
+        hits = helpers.scan(client, query=body, scroll=scroll,
+                            preserve_order=preserve_order, size=size,
+                            index=self.index, doc_type=self.doc_type, **kwargs)
+        while True:
+            try:
+                hit = next(hits)
+            except StopIteration:
+                return
+            except ConnectionTimeout as e:
+                self.record_timeout('scan', dict(kwargs, body=body), error=e)
+                raise
+            if self._deserialize:
+                yield self.model.es.deserialize(hit['_source'])
+            else:
+                yield hit['_source']
+
     def mlt(self, id, **kwargs):
-        self.mode = self.MODE_MLT
-        self.mlt_kwargs = kwargs
-        self.mlt_kwargs['id'] = id
-        return self
+        clone = self._clone()
+        clone.mode = self.MODE_MLT
+        clone.mlt_kwargs = kwargs
+        clone.mlt_kwargs['id'] = id
+        return clone
 
-    def complete(self, field_name, query):
-        resp = es_client.suggest(index=self.index,
-                                 body={field_name: {
-                                     "text": query,
-                                     "completion": {
-                                         "field": field_name,
-                                         # stick to fuzziness settings
-                                         "fuzzy" : {}
-                                     }}})
+    def complete(self, field_name, query, size=5, context=None):
+        """
+        Returns the completion options of field_name, or of a list of
+        fields, merged and ranked by score in a single suggest request.
+        context restricts them to a category (see the context suggester),
+        e.g. {'kind': 'book'}.
+        """
+        if isinstance(field_name, basestring):
+            field_names = [field_name]
+        else:
+            field_names = list(field_name)
 
-        return [r['text'] for r in resp[field_name][0]['options']]
+        cache_key = ','.join(field_names)
+        if context:
+            cache_key += ':' + json.dumps(context, sort_keys=True)
+        options = cache.completion_cache.get(self.index, cache_key,
+                                             query, size)
+        if options is not None:
+            return options
+
+        body = {}
+        for name in field_names:
+            body[name] = {"text": query,
+                          "completion": {
+                              "field": name,
+                              "size": size,
+                              # stick to fuzziness settings
+                              "fuzzy" : {}
+                          }}
+            if context:
+                body[name]["completion"]["context"] = context
+        resp = es_client.suggest(index=self.index, body=body)
+
+        # the best score of every option, across the fields
+        scores = {}
+        for name in field_names:
+            for option in resp[name][0]['options']:
+                text = option['text']
+                scores[text] = max(scores.get(text, option['score']),
+                                   option['score'])
+        options = [text for text, score in
+                   sorted(scores.items(), key=lambda o: (-o[1], o[0]))][:size]
+
+        cache.completion_cache.set(self.index, cache_key, query, size, options)
+        return options
 
     def update(self):
         raise NotImplementedError("Db operational methods have been "
@@ -406,6 +1053,15 @@ class EsQueryset(QuerySet):
         self.do_search()
         return self._facets
 
+    @property
+    def sort_values(self):
+        """
+        The sort values of every hit, only available with an ordering
+        or seek.
+        """
+        self.do_search()
+        return [hit.get('sort') for hit in self._response['hits']['hits']]
+
     @property
     def suggestions(self):
         self.do_search()
@@ -413,16 +1069,32 @@ class EsQueryset(QuerySet):
 
     def count(self):
         # if we pass a body without a query, elasticsearch complains
-        if self._total:
+        # Note: a search already gave us the total (hits.total)
+        if self._total is not None:
             return self._total
         if self.mode == self.MODE_MLT:
             # Note: there is no count on the mlt api, need to fetch the results
             self.do_search()
         else:
-            r = es_client.count(
-                index=self.index,
-                doc_type=self.doc_type,
-                body=self.make_search_body() or None)
+            qs = self
+            if self.post_filters:
+                # the count api has no post_filter
+                qs = self._clone()
+                qs.filters.update(self.post_filters)
+            count_params = {
+                'index': self.index,
+                'doc_type': self.doc_type,
+                'body': qs.make_search_body() or None
+            }
+            r = self.get_cached_response('count', count_params)
+            if r is None:
+                try:
+                    r = es_client.count(**dict(count_params,
+                                               **self.get_timeout_params()))
+                except ConnectionTimeout as e:
+                    self.record_timeout('count', count_params, error=e)
+                    raise
+                self.set_cached_response('count', count_params, r)
             self._total = r['count']
         return self._total
 
@@ -430,6 +1102,87 @@ class EsQueryset(QuerySet):
         self._deserialize = True
         return self
 
+    def get_query_cache(self):
+        """
+        Returns the query_cache parameter of the search (the shard query
+        cache of elasticsearch 1.x), None leaves it to elasticsearch.
+        """
+        if self._cache is not None:
+            return self._cache
+        if self._facets_only:
+            # the responses without hits are the cacheable ones
+            return True
+        return None
+
+    def cache(self, enabled=True):
+        # Note: sets the _cache flag of the filters and the query_cache
+        # parameter of the search, False explicitly disables them.
+        clone = self._clone()
+        clone._cache = enabled
+        return clone
+
+    def cached(self, timeout=None):
+        """
+        Cache the responses of the searches, counts and gets in django's
+        cache, until the index is modified or for timeout seconds,
+        (defaults to ELASTICSEARCH_CACHE_TIMEOUT or 60), 0 disables it.
+        """
+        clone = self._clone()
+        if timeout is None:
+            timeout = cache.get_default_timeout()
+        clone._cache_timeout = timeout
+        clone._doc_cache_timeout = timeout
+        return clone
+
+    def only(self, *fields):
+        """
+        Only fetches these fields of the _source, in searches and gets.
+        """
+        clone = self._clone()
+        clone._source_fields = fields or None
+        return clone
+
+    def get_source_fields(self, fields=None):
+        fields = list(fields or self._source_fields)
+        pk_name = self.model._meta.pk.name
+        if self._deserialize and pk_name not in fields:
+            # the instances need their pk
+            fields.append(pk_name)
+        return fields
+
+    def realtime(self, enabled=True, refresh=False):
+        """
+        get is realtime by default, enabled=False only reads the refreshed
+        documents, refresh=True refreshes the shard before the get
+        and bypasses the caches.
+        """
+        clone = self._clone()
+        clone._realtime = enabled
+        clone._refresh = refresh
+        return clone
+
+    def timeout(self, timeout=None, request_timeout=None):
+        """
+        Sets the time budget of the requests:
+        timeout is passed to the search, elasticsearch then returns
+        what the shards found in time (see timed_out),
+        request_timeout is how long the client waits for any response,
+        in seconds, before raising a ConnectionTimeout.
+        Both are recorded with the es_timeout signal when exceeded.
+        """
+        clone = self._clone()
+        clone._timeout = timeout
+        clone._request_timeout = request_timeout
+        return clone
+
+    @property
+    def timed_out(self):
+        """
+        True if elasticsearch returned partial results after the timeout.
+        """
+        self.do_search()
+        return self._timed_out
+
     def extra(self, body):
         # Note: will .update() the body of the query
         # so it is possible to override anything
@@ -439,3 +1192,13 @@ class EsQueryset(QuerySet):
 
     def prefetch_related(self):
         raise NotImplementedError(".prefetch_related is not available for an EsQueryset.")
+
+
+def _do_search(qs):
+    # runs in a worker thread of EsQueryset.evaluate_parallel
+    try:
+        qs.do_search()
+    finally:
+        # deserialization may have opened db connections in this thread
+        for connection in connections.all():
+            connection.close()
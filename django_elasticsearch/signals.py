@@ -0,0 +1,23 @@
+from django.dispatch import Signal
+
+
+# Sent after every call to the elasticsearch client (es_client)
+# operation: the client method, like 'search' or 'indices.refresh'
+# params: the kwargs of the call (body, from_, size...)
+# duration: wall time in ms, took: time reported by elasticsearch in ms
+# hits: the number of documents found (when it makes sense)
+# request_size, response_size: size in bytes of the json bodies,
+# None unless settings.ELASTICSEARCH_SIGNAL_SIZES is True
+# error: the exception raised by the call, if any
+es_request = Signal(providing_args=['operation', 'index', 'doc_type',
+                                    'params', 'duration', 'took', 'hits',
+                                    'request_size', 'response_size',
+                                    'error'])
+
+
+# Sent when a search exceeded its time budget (see EsQueryset.timeout)
+# timeout: the server side budget, elasticsearch returned partial results
+# request_timeout: the client side budget in seconds, error is then
+# the ConnectionTimeout raised by the call
+es_timeout = Signal(providing_args=['operation', 'index', 'doc_type',
+                                    'timeout', 'request_timeout', 'error'])
@@ -0,0 +1,81 @@
+"""
+Logs the elasticsearch calls slower than settings.ELASTICSEARCH_SLOW_QUERY_MS
+to the 'django_elasticsearch.slow' logger.
+"""
+import json
+import random
+import logging
+
+from django.conf import settings
+
+from django_elasticsearch.middleware import get_current_request
+
+
+logger = logging.getLogger('django_elasticsearch.slow')
+
+
+def get_threshold():
+    return getattr(settings, 'ELASTICSEARCH_SLOW_QUERY_MS', None)
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.view_name or '{0}.{1}'.format(match.func.__module__,
+                                                   match.func.__name__)
+    return request.path
+
+
+def log_slow_query(operation, params, duration, response=None):
+    # sampling keeps it cheap when a lot of queries are slow
+    rate = getattr(settings, 'ELASTICSEARCH_SLOW_QUERY_SAMPLING', 1.0)
+    if rate < 1 and random.random() >= rate:
+        return
+
+    request = get_current_request()
+    view = request is not None and get_view_name(request) or None
+
+    took = hits = None
+    if isinstance(response, dict):
+        took = response.get('took')
+        if 'hits' in response:
+            hits = response['hits']['total']
+
+    params = dict(params)
+    body = params.pop('body', None)
+    logger.warning("Slow elasticsearch %s (%dms, took: %sms, hits: %s) "
+                   "from %s, params: %s, body: %s",
+                   operation, duration, took, hits, view,
+                   json.dumps(params, default=str),
+                   json.dumps(body, default=str),
+                   extra={'operation': operation,
+                          'duration': duration,
+                          'took': took,
+                          'hits': hits,
+                          'view': view,
+                          'params': params,
+                          'body': body})
+
+
+def log_timeout(operation, params, timeout=None, request_timeout=None,
+                error=None):
+    request = get_current_request()
+    view = request is not None and get_view_name(request) or None
+
+    params = dict(params)
+    body = params.pop('body', None)
+    if error is None:
+        message = "partial results after %s" % timeout
+    else:
+        message = "no response after %ss" % request_timeout
+    logger.warning("Elasticsearch %s exceeded its time budget (%s) "
+                   "from %s, params: %s, body: %s",
+                   operation, message, view,
+                   json.dumps(params, default=str),
+                   json.dumps(body, default=str),
+                   extra={'operation': operation,
+                          'timeout': timeout,
+                          'request_timeout': request_timeout,
+                          'view': view,
+                          'params': params,
+                          'body': body})
@@ -4,6 +4,8 @@ from django_elasticsearch.tests.test_qs import EsQuerysetTestCase
 from django_elasticsearch.tests.test_views import EsViewTestCase
 from django_elasticsearch.tests.test_serializer import EsJsonSerializerTestCase
 from django_elasticsearch.tests.test_restframework import EsRestFrameworkTestCase
+from django_elasticsearch.tests.test_benchmarks import EsBenchmarkTestCase
+from django_elasticsearch.tests.test_memory import EsMemoryTransportTestCase
 
 
 __all__ = ['EsQuerysetTestCase',
@@ -11,4 +13,6 @@ __all__ = ['EsQuerysetTestCase',
            'EsIndexableTestCase',
            'EsAutoIndexTestCase',
            'EsJsonSerializerTestCase',
-           'EsRestFrameworkTestCase']
+           'EsRestFrameworkTestCase',
+           'EsBenchmarkTestCase',
+           'EsMemoryTransportTestCase']
@@ -0,0 +1,331 @@
+"""
+Offline benchmarks of the hot paths of django_elasticsearch.
+
+Every request goes through StubTransport, which answers with canned
+responses without touching the network, so the figures only measure
+the python side: serialization, query compilation, cloning, ...
+
+Run them with:
+    python manage.py es_benchmark [--size 100] [--repeat 5] [--output f.json]
+
+Store a baseline, then check a later run against it:
+    python manage.py es_benchmark --save-baseline baseline.json
+    python manage.py es_benchmark --baseline baseline.json --tolerance 0.2
+"""
+import json
+import time
+import platform
+from datetime import date
+from datetime import datetime
+from decimal import Decimal
+from collections import OrderedDict
+
+import django
+from django.test import Client
+from django.test.utils import override_settings
+
+from elasticsearch import Transport
+from elasticsearch import TransportError
+from elasticsearch.exceptions import HTTP_EXCEPTIONS
+
+from test_app.models import Dummy
+from test_app.models import TestModel
+from test_app.models import Test2Model
+
+
+class StubTransport(Transport):
+    """
+    Transport that never hits the network, the responses are looked up
+    in `responses` by endpoint: the first part of the url starting with
+    an underscore (_search, _count, _mapping, _bulk...) or 'doc'.
+    The bodies are still (de)serialized like a real transport would.
+    """
+    responses = {}
+
+    def __init__(self, hosts, **kwargs):
+        kwargs['sniff_on_start'] = False
+        kwargs['sniff_on_connection_fail'] = False
+        super(StubTransport, self).__init__(hosts, **kwargs)
+
+    @classmethod
+    def set_response(cls, endpoint, response, status=200):
+        cls.responses[endpoint] = (status, json.dumps(response))
+
+    @classmethod
+    def reset(cls):
+        cls.responses = {}
+
+    @staticmethod
+    def get_endpoint(url):
+        for part in url.split('?')[0].split('/'):
+            if part.startswith('_'):
+                return part
+        return 'doc'
+
+    def perform_request(self, method, url, params=None, body=None):
+        if body is not None:
+            body = self.serializer.dumps(body)
+
+        ignore = ()
+        if params:
+            ignore = params.pop('ignore', ())
+            if isinstance(ignore, int):
+                ignore = (ignore,)
+
+        status, data = self.responses.get(self.get_endpoint(url),
+                                          (200, '{}'))
+        data = self.deserializer.loads(data, 'application/json')
+        if not 200 <= status < 300 and status not in ignore:
+            raise HTTP_EXCEPTIONS.get(status, TransportError)(
+                status, data.get('error'), data)
+        return status, data
+
+
+def measure(func, number=1, repeat=3, items=1):
+    """
+    Calls func `number` times, `repeat` times over
+    and returns the timings in milliseconds per call.
+    `items` is the number of documents processed by one call.
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        for j in range(number):
+            func()
+        timings.append((time.time() - start) * 1000 / number)
+
+    best = min(timings)
+    return OrderedDict([
+        ('number', number),
+        ('repeat', repeat),
+        ('items', items),
+        ('best_ms', best),
+        ('mean_ms', sum(timings) / len(timings)),
+        ('timings_ms', timings),
+        ('items_per_sec', best and items * 1000 / best or None),
+    ])
+
+
+def make_dataset(size):
+    """
+    Creates `size` Test2Model instances (and their related Dummy),
+    always with the same values so that two runs can be compared.
+    """
+    instances = []
+    for i in range(size):
+        dummy = Dummy.objects.create(foo=u'dummy {0}'.format(i))
+        instance = Test2Model.objects.create(
+            char=u'char {0}'.format(i),
+            text=u'lorem ipsum dolor sit amet ' * (i % 10 + 1),
+            email=u'user{0}@example.com'.format(i),
+            ipaddr=u'127.0.0.1',
+            genipaddr=u'::1',
+            slug=u'slug-{0}'.format(i),
+            url=u'http://example.com/{0}'.format(i),
+            intf=i,
+            bigint=i * 1000,
+            intlist=u'1,2,3',
+            floatf=i / 3.0,
+            dec=Decimal('1.50'),
+            posint=i,
+            smint=i % 100,
+            possmint=i % 100,
+            nullboolf=bool(i % 2),
+            timef=datetime(2015, 1, 1, 12, i % 60).time(),
+            fk=dummy,
+            oto=dummy)
+        instance.mtm.add(dummy)
+        instances.append(instance)
+
+    # auto_now_add can't be set on creation
+    Test2Model.objects.filter(pk__in=[i.pk for i in instances]).update(
+        datetf=datetime(2015, 1, 1, 12, 0, 0, 1))
+    return list(Test2Model.objects.filter(pk__in=[i.pk for i in instances])
+                .order_by('pk'))
+
+
+def make_search_response(model, sources):
+    hits = [{'_index': model.es.index,
+             '_type': model.es.doc_type,
+             '_id': unicode(source['id']),
+             '_score': 1.0,
+             '_source': source} for source in sources]
+    return {'took': 1,
+            'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+            'hits': {'total': len(hits), 'max_score': 1.0, 'hits': hits}}
+
+
+def make_mapping_response(model):
+    return {model.es.index: {'mappings': model.es.make_mapping()}}
+
+
+def bench_serialize(dataset, number, repeat):
+    serializer = Test2Model.es.get_serializer()
+
+    def run():
+        for instance in dataset:
+            serializer.format(instance)
+    return measure(run, number, repeat, items=len(dataset))
+
+
+def bench_deserialize(dataset, number, repeat):
+    serializer = Test2Model.es.get_serializer()
+    sources = [json.loads(serializer.serialize(instance))
+               for instance in dataset]
+
+    def run():
+        for source in sources:
+            serializer.deserialize(source)
+    return measure(run, number, repeat, items=len(sources))
+
+
+def bench_search_body(dataset, number, repeat):
+    qs = (TestModel.es.search('foo bar', facets=['is_active'])
+          .filter(username__contains='foo',
+                  email__isnull=False,
+                  id__gte=1, id__lt=1000,
+                  date_joined__range=(date(2015, 1, 1), date(2016, 1, 1)))
+          .exclude(is_staff=True, last_name='bar')
+          .filter(first_name__should='foo')
+          .order_by('-id', 'username'))
+
+    return measure(qs.make_search_body, number * 100, repeat, items=1)
+
+
+def bench_clone(dataset, number, repeat):
+    def run():
+        (TestModel.es.all()
+         .filter(username='foo')
+         .exclude(is_staff=True)
+         .order_by('-id')
+         .facet(['is_active'])
+         .query('bar'))
+    return measure(run, number * 100, repeat, items=1)
+
+
+def bench_reindex(dataset, number, repeat):
+    def run():
+        Test2Model.es.reindex_all(queryset=dataset)
+    return measure(run, number, repeat, items=len(dataset))
+
+
+def bench_drf_list(dataset, number, repeat):
+    client = Client()
+
+    def run():
+        response = client.get('/rf/tests/')
+        assert response.status_code == 200, response.status_code
+    return measure(run, number * 10, repeat, items=1)
+
+
+BENCHMARKS = OrderedDict([
+    ('serialize', bench_serialize),
+    ('deserialize', bench_deserialize),
+    ('search_body', bench_search_body),
+    ('clone', bench_clone),
+    ('reindex', bench_reindex),
+    ('drf_list', bench_drf_list),
+])
+
+
+def get_meta():
+    return OrderedDict([
+        ('python', platform.python_version()),
+        ('django', django.get_version()),
+        ('platform', platform.platform()),
+        ('date', datetime.now().isoformat()),
+    ])
+
+
+def setup_responses(dataset):
+    StubTransport.reset()
+    serializer = TestModel.es.get_serializer()
+    users = [json.loads(serializer.serialize(user))
+             for user in TestModel.objects.all()[:10]]
+    StubTransport.set_response('_search',
+                               make_search_response(TestModel, users))
+    StubTransport.set_response('_count', {'count': len(users)})
+    StubTransport.set_response('_mapping', make_mapping_response(TestModel))
+    StubTransport.set_response('doc', {'_index': Test2Model.es.index,
+                                       '_type': Test2Model.es.doc_type,
+                                       '_id': '1',
+                                       '_version': 1,
+                                       'created': True})
+
+
+def run_benchmarks(size=100, number=1, repeat=5, names=None):
+    """
+    Runs the benchmarks against a fresh dataset of `size` documents,
+    the database is expected to be a test one.
+    Returns a dict of results suitable for json.dumps.
+    """
+    results = OrderedDict()
+    with override_settings(ELASTICSEARCH_CONNECTION_KWARGS={
+            'transport_class': StubTransport}):
+        dataset = make_dataset(size)
+        for i in range(10):
+            TestModel.objects.create(username=u'user{0}'.format(i),
+                                     first_name=u'foo', last_name=u'bar',
+                                     email=u'user{0}@example.com'.format(i))
+        setup_responses(dataset)
+        # the mappings are cached on the managers
+        TestModel.es._mapping = None
+        for name, bench in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            results[name] = bench(dataset, number, repeat)
+        StubTransport.reset()
+        TestModel.es._mapping = None
+
+    return OrderedDict([
+        ('meta', get_meta()),
+        ('size', size),
+        ('results', results),
+    ])
+
+
+def dumps(results):
+    return json.dumps(results, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        f.write(dumps(results))
+
+
+def compare(baseline, results, tolerance=0.2):
+    """
+    Compares the best timings of two runs.
+    Returns a list of (name, baseline_ms, current_ms, ratio, regressed),
+    a benchmark regressed if it is more than `tolerance` slower.
+    Note: the best timing is the least noisy, the others only measure
+    what else was running on the machine.
+    """
+    if baseline['size'] != results['size']:
+        raise ValueError("The baseline was measured on {0} documents, "
+                         "not {1}.".format(baseline['size'], results['size']))
+
+    comparison = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['best_ms']
+        after = result['best_ms']
+        ratio = before and after / before or 1.0
+        comparison.append((name, before, after, ratio,
+                           ratio > 1 + tolerance))
+    return comparison
+
+
+def format_comparison(comparison):
+    lines = []
+    for name, before, after, ratio, regressed in comparison:
+        lines.append('{0:<12} {1:>10.3f}ms {2:>10.3f}ms {3:>+7.1%}{4}'.format(
+            name, before, after, ratio - 1, regressed and '  REGRESSION' or ''))
+    return '\n'.join(lines)
@@ -0,0 +1,46 @@
+import json
+
+from django.test import TestCase
+
+from django_elasticsearch.tests.benchmarks import BENCHMARKS
+from django_elasticsearch.tests.benchmarks import StubTransport
+from django_elasticsearch.tests.benchmarks import run_benchmarks
+from django_elasticsearch.tests.benchmarks import dumps
+from django_elasticsearch.tests.benchmarks import compare
+
+
+class EsBenchmarkTestCase(TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(size=2, number=1, repeat=1)
+        self.assertEqual(results['results'].keys(), BENCHMARKS.keys())
+        for result in results['results'].values():
+            self.assertTrue(result['best_ms'] >= 0)
+            self.assertEqual(len(result['timings_ms']), 1)
+        self.assertEqual(json.loads(dumps(results))['size'], 2)
+        # the stub is cleaned up
+        self.assertEqual(StubTransport.responses, {})
+
+    def test_run_some_benchmarks(self):
+        results = run_benchmarks(size=1, number=1, repeat=1,
+                                 names=['clone'])
+        self.assertEqual(results['results'].keys(), ['clone'])
+
+    def test_compare(self):
+        baseline = {'size': 10, 'results': {
+            'serialize': {'best_ms': 10.0},
+            'clone': {'best_ms': 1.0},
+            'removed': {'best_ms': 1.0}}}
+        results = {'size': 10, 'results': {
+            'serialize': {'best_ms': 11.0},
+            'clone': {'best_ms': 1.5},
+            'added': {'best_ms': 1.0}}}
+
+        comparison = compare(baseline, results, tolerance=0.2)
+        self.assertEqual(sorted([(c[0], c[-1]) for c in comparison]),
+                         [('clone', True), ('serialize', False)])
+        comparison = compare(baseline, results, tolerance=0.6)
+        self.assertFalse(any([c[-1] for c in comparison]))
+
+        results['size'] = 100
+        with self.assertRaises(ValueError):
+            compare(baseline, results)
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import mock
+
 from elasticsearch import NotFoundError
 
 from django.test import TestCase
 from django.test.utils import override_settings
 
+from django_elasticsearch import cache
 from django_elasticsearch.managers import es_client
 from django_elasticsearch.tests.utils import withattrs
 
@@ -129,6 +132,91 @@ class EsIndexableTestCase(TestCase):
         data = TestModel.es.complete('first_name', 'woo')
         self.assertTrue('woot' in data)
 
+    @withattrs(TestModel.Elasticsearch, 'completion_fields', ['first_name',
+                                                               'last_name'])
+    def test_multi_field_completion(self):
+        TestModel.es.flush()
+        instance = TestModel.objects.create(username=u"2", first_name=u"bar",
+                                            last_name=u"wolf")
+        instance.es.do_index()
+        TestModel.es.do_update()
+
+        with mock.patch.object(es_client, 'suggest',
+                               wraps=es_client.suggest) as mocked:
+            data = TestModel.es.complete(['first_name', 'last_name'], 'wo')
+        self.assertEqual(mocked.call_count, 1)
+        self.assertEqual(data, ['wolf', 'woot'])
+        self.assertEqual(TestModel.es.complete(['first_name', 'last_name'],
+                                               'wo', size=1), ['wolf'])
+
+        with self.assertRaises(ValueError):
+            TestModel.es.complete(['first_name', 'username'], 'wo')
+
+    @withattrs(TestModel.Elasticsearch, 'completion_fields', ['last_name'])
+    @withattrs(TestModel.Elasticsearch, 'mappings', {'last_name_complete': {
+        'context': {'first': {'type': 'category', 'path': 'first_name'}}}})
+    def test_completion_context(self):
+        TestModel.es.flush()
+        TestModel.es.do_update()
+        self.assertEqual(TestModel.es.complete('last_name', 'f',
+                                               context={'first': 'woot'}),
+                         ['foo'])
+        self.assertEqual(TestModel.es.complete('last_name', 'f',
+                                               context={'first': 'bar'}),
+                         [])
+
+    @withattrs(TestModel.Elasticsearch, 'completion_fields', ['first_name'])
+    @override_settings(ELASTICSEARCH_COMPLETION_CACHE_SIZE=1000)
+    def test_completion_cache(self):
+        TestModel.es.flush()
+        TestModel.es.do_update()
+        self.assertEqual(TestModel.es.complete('first_name', 'w'), ['woot'])
+
+        with mock.patch.object(es_client, 'suggest') as mocked:
+            # same prefix
+            self.assertEqual(TestModel.es.complete('first_name', 'W '), ['woot'])
+            # longer prefixes are filtered from the non truncated 'w'
+            self.assertEqual(TestModel.es.complete('first_name', 'woo'), ['woot'])
+            self.assertEqual(TestModel.es.complete('first_name', 'wox'), [])
+        self.assertFalse(mocked.called)
+
+        # indexing invalidates the cache
+        instance = TestModel.objects.create(username=u"2", first_name=u"wooden")
+        instance.es.do_index()
+        TestModel.es.do_update()
+        data = TestModel.es.complete('first_name', 'woo')
+        self.assertEqual(sorted(data), ['wooden', 'woot'])
+
+        # truncated results can't be filtered
+        self.assertEqual(len(TestModel.es.complete('first_name', 'w', size=1)), 1)
+        with mock.patch.object(es_client, 'suggest') as mocked:
+            TestModel.es.complete('first_name', 'wo', size=1)
+        self.assertTrue(mocked.called)
+
+    @withattrs(TestModel.Elasticsearch, 'completion_fields', ['first_name'])
+    @override_settings(ELASTICSEARCH_COMPLETION_CACHE_SIZE=1000,
+                       ELASTICSEARCH_CACHE_GENERATIONS=True)
+    def test_completion_cache_shared_generation(self):
+        TestModel.es.flush()
+        TestModel.es.do_update()
+        self.assertEqual(TestModel.es.complete('first_name', 'w'), ['woot'])
+
+        # a write made by another process only bumps the shared generation
+        instance = TestModel.objects.create(username=u"2", first_name=u"wooden")
+        with mock.patch.object(cache, '_local_generations', {}):
+            instance.es.do_index()
+            TestModel.es.do_update()
+        data = TestModel.es.complete('first_name', 'w')
+        self.assertEqual(sorted(data), ['wooden', 'woot'])
+
+    @withattrs(TestModel.Elasticsearch, 'completion_fields', ['first_name'])
+    def test_completion_cache_disabled(self):
+        TestModel.es.complete('first_name', 'w')
+        with mock.patch.object(es_client, 'suggest',
+                               wraps=es_client.suggest) as mocked:
+            TestModel.es.complete('first_name', 'w')
+        self.assertTrue(mocked.called)
+
     @withattrs(TestModel.Elasticsearch, 'fields', ['username', 'date_joined'])
     def test_get_mapping(self):
         TestModel.es._mapping = None
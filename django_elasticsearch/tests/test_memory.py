@@ -0,0 +1,90 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from elasticsearch import NotFoundError
+from elasticsearch import RequestError
+from elasticsearch import helpers
+
+from django_elasticsearch.client import es_client
+from django_elasticsearch.memory import MemoryTransport
+
+
+@override_settings(ELASTICSEARCH_TRANSPORT_CLASS=MemoryTransport)
+class EsMemoryTransportTestCase(TestCase):
+    index = 'django-test-memory'
+
+    def setUp(self):
+        es_client.indices.create(self.index, body={'mappings': {'doc': {
+            'properties': {'tag': {'type': 'string',
+                                   'index': 'not_analyzed'}}}}})
+        helpers.bulk(es_client.get_client(), [
+            {'_index': self.index, '_type': 'doc', '_id': i,
+             '_source': {'title': u'Document number {0}'.format(i),
+                         'tag': i % 2 and u'Odd' or u'Even',
+                         'rank': i,
+                         'date': u'2015-01-0{0}T12:00:00'.format(i)}}
+            for i in range(1, 6)])
+
+    def tearDown(self):
+        es_client.indices.delete(index=self.index)
+
+    def search(self, **body):
+        return es_client.search(index=self.index, doc_type='doc', body=body)
+
+    def test_dynamic_mapping(self):
+        mapping = es_client.indices.get_mapping(index=self.index, doc_type='doc')
+        properties = mapping[self.index]['mappings']['doc']['properties']
+        self.assertEqual(properties['tag'], {'type': 'string',
+                                             'index': 'not_analyzed'})
+        self.assertEqual(properties['rank'], {'type': 'long'})
+        self.assertEqual(properties['date'], {'type': 'date',
+                                              'format': 'dateOptionalTime'})
+
+    def test_filters(self):
+        r = self.search(query={'filtered': {'filter': {'bool': {
+            'must': [{'term': {'tag': u'Odd'}},
+                     {'range': {'date': {'gt': '2015-01-01T12:00:00'}}}],
+            'must_not': [{'missing': {'field': 'title'}}]}}}})
+        self.assertEqual(r['hits']['total'], 2)
+        self.assertEqual(sorted([h['_id'] for h in r['hits']['hits']]),
+                         [u'3', u'5'])
+
+        r = self.search(query={'match': {'title': u'numbr'}})
+        self.assertEqual(r['hits']['total'], 0)
+        r = self.search(query={'match': {'title': {'query': u'numbr',
+                                                   'fuzziness': 1}}})
+        self.assertEqual(r['hits']['total'], 5)
+
+    def test_sort_and_paginate(self):
+        r = es_client.search(index=self.index, doc_type='doc',
+                             body={'sort': [{'rank': 'desc'}]},
+                             from_=1, size=2)
+        self.assertEqual([h['_id'] for h in r['hits']['hits']], [u'4', u'3'])
+        self.assertEqual(r['hits']['hits'][0]['sort'], [4])
+        self.assertEqual(r['hits']['total'], 5)
+
+    def test_terms_aggregation(self):
+        r = self.search(size=0, aggs={'tags': {'terms': {'field': 'tag'}}})
+        self.assertEqual(r['hits']['hits'], [])
+        self.assertEqual(r['aggregations']['tags']['buckets'],
+                         [{'key': u'Odd', 'doc_count': 3},
+                          {'key': u'Even', 'doc_count': 2}])
+
+    def test_documents(self):
+        r = es_client.mget(index=self.index, doc_type='doc',
+                           body={'ids': [1, 42]}, _source_include=['rank'])
+        self.assertEqual(r['docs'][0]['_source'], {'rank': 1})
+        self.assertFalse(r['docs'][1]['found'])
+
+        es_client.delete(index=self.index, doc_type='doc', id=1)
+        with self.assertRaises(NotFoundError):
+            es_client.get(index=self.index, doc_type='doc', id=1)
+        self.assertEqual(es_client.count(index=self.index)['count'], 4)
+
+    def test_errors(self):
+        with self.assertRaises(NotFoundError):
+            es_client.search(index='django-test-missing')
+        with self.assertRaises(RequestError):
+            self.search(query={'more_like_this_field': {}})
+        with self.assertRaises(RequestError):
+            es_client.indices.create(self.index)
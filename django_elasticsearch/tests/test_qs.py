@@ -1,3 +1,4 @@
+import json
 import time
 import mock
 from datetime import datetime, timedelta
@@ -7,8 +8,19 @@ from django.test.utils import override_settings
 from django.contrib.auth.models import Group
 from django.template import Template, Context
 
+from elasticsearch import Transport
+from elasticsearch import Connection
+from elasticsearch import NotFoundError
+from elasticsearch import ConnectionError
+from elasticsearch import ConnectionTimeout
+
+from django_elasticsearch import cache
 from django_elasticsearch.client import es_client
+from django_elasticsearch.client import perform_raw_request
+from django_elasticsearch.signals import es_request
+from django_elasticsearch.signals import es_timeout
 from django_elasticsearch.managers import EsQueryset
+from django_elasticsearch.query import split_raw_hits
 from django_elasticsearch.tests.utils import withattrs
 
 from test_app.models import TestModel
@@ -102,11 +114,51 @@ class EsQuerysetTestCase(TestCase):
         self.assertEqual(qs.facets['doc_count'], 4)
         self.assertEqual(qs.facets['last_name']['buckets'], expected)
 
+    def test_facets_only(self):
+        qs = TestModel.es.queryset.facet(['last_name']).facets_only()
+        self.assertEqual(qs.make_search_params()['size'], 0)
+        expected = [{u'doc_count': 3, u'key': u'smith'},
+                    {u'doc_count': 1, u'key': u'bar'}]
+        self.assertEqual(qs.facets['last_name']['buckets'], expected)
+        self.assertEqual(qs.response['hits']['hits'], [])
+        self.assertEqual(list(qs), [])
+
+        with mock.patch.object(es_client, 'search') as mocked:
+            # use cache
+            self.assertEqual(qs.count(), 4)
+            qs.facets
+        self.assertFalse(mocked.called)
+
+        # a count doesn't evaluate it
+        qs = TestModel.es.queryset.facet(['last_name']).facets_only()
+        self.assertEqual(qs.count(), 4)
+        self.assertEqual(qs.facets['last_name']['buckets'], expected)
+
     def test_non_global_facets(self):
         qs = TestModel.es.search("Foo").facet(['last_name'], use_globals=False)
         expected = [{u'doc_count': 1, u'key': u'bar'}]
         self.assertEqual(qs.facets['last_name']['buckets'], expected)
 
+    def test_post_filter(self):
+        qs = (TestModel.es.queryset.order_by('username')
+              .facet(['last_name', 'first_name'], use_globals=False)
+              .post_filter(last_name=u'Smith'))
+        self.assertEqual(qs.deserialize()[:10], [self.t3, self.t2, self.t1])
+        self.assertEqual(qs.count(), 3)
+        # unaffected by its own post filter
+        self.assertEqual(qs.facets['last_name']['buckets'],
+                         [{u'doc_count': 3, u'key': u'smith'},
+                          {u'doc_count': 1, u'key': u'bar'}])
+        # narrowed by the post filter on last_name
+        self.assertEqual(qs.facets['first_name']['buckets'],
+                         [{u'doc_count': 1, u'key': u'jack'},
+                          {u'doc_count': 1, u'key': u'john'},
+                          {u'doc_count': 1, u'key': u'mama'}])
+
+        # the count api has no post_filter
+        qs = TestModel.es.queryset.post_filter(last_name=u'Smith')
+        self.assertEqual(qs.count(), 3)
+
     def test_suggestions(self):
         qs = TestModel.es.search('smath').suggest(['last_name',], limit=3)
         expected = {
@@ -138,6 +190,148 @@ class EsQuerysetTestCase(TestCase):
         self.assertEqual(contents[2], self.t2)
         self.assertEqual(contents[3], self.t1)
 
+    def test_seek(self):
+        qs = TestModel.es.queryset.order_by('username').seek()
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t3.id, self.t4.id])
+
+        qs = qs.seek(qs.sort_values[-1])
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t2.id, self.t1.id])
+        self.assertEqual(list(qs.seek(qs.sort_values[-1])[:2]), [])
+
+        # the pk breaks the ties
+        qs = TestModel.es.queryset.order_by('last_name').seek()
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t4.id, self.t1.id])
+        qs = qs.seek(qs.sort_values[-1])
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t2.id, self.t3.id])
+
+        # combined with the filters, descending
+        qs = TestModel.es.filter(last_name=u"Smith").order_by('-date_joined').seek()
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t3.id, self.t2.id])
+        qs = qs.seek(qs.sort_values[-1])
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t1.id])
+        self.assertTrue('filtered' in qs.make_search_params()['body']['query'])
+
+        # the missing values come last
+        qs = TestModel.es.queryset.order_by('last_login').seek()
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t2.id, self.t3.id])
+        qs = qs.seek(qs.sort_values[-1])
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t4.id, self.t1.id])
+        qs = qs.seek(qs.sort_values[-1])
+        self.assertEqual(list(qs[:2]), [])
+
+        # elasticsearch 1.x placeholder of a missing date
+        qs = TestModel.es.queryset.order_by('last_login')
+        qs = qs.seek([2 ** 63 - 1, self.t1.id - 1])
+        self.assertEqual([d['id'] for d in qs[:2]], [self.t1.id])
+
+        with self.assertRaises(ValueError):
+            TestModel.es.queryset.order_by('username').seek([u'woot']).make_search_params()
+
+    def test_raw_hits(self):
+        qs = TestModel.es.queryset.order_by('username').facet(['last_name'])
+        hits, response = qs.raw_hits(start=1, stop=3)
+        self.assertEqual(json.loads(hits), [
+            {'_source': json.loads(self.t4.es.serialize())},
+            {'_source': json.loads(self.t2.es.serialize())}])
+        self.assertEqual(response['hits']['total'], 4)
+        self.assertEqual(qs.make_facets(response), qs.facets)
+
+    def test_split_raw_hits(self):
+        # a document can look like the end of the hits
+        content = ('{"timed_out":false,"hits":{"total":2,"hits":['
+                   '{"_source":{"a":{"b":[1]},"aggregations":{"c":1}}},'
+                   '{"_source":{"d":1}}]},'
+                   '"aggregations":{"x":{"buckets":[1]},'
+                   '"aggregations":{"buckets":[]}}}')
+        hits, response = split_raw_hits(content, ['aggregations'])
+        self.assertEqual(len(json.loads(hits)), 2)
+        self.assertEqual(response, {'timed_out': False, 'hits': {'total': 2},
+                                    'aggregations': {
+                                        'x': {'buckets': [1]},
+                                        'aggregations': {'buckets': []}}})
+
+        hits, response = split_raw_hits('{"hits":{"total":0}}')
+        self.assertEqual((hits, response), ('[]', {'hits': {'total': 0}}))
+
+        # not laid out like elasticsearch does, the hits are encoded again
+        content = ('{"hits": {"hits": [{"_id": "1"}], "total": 1}, '
+                   '"timed_out": false}')
+        hits, response = split_raw_hits(content)
+        self.assertEqual(json.loads(hits), [{'_id': '1'}])
+        self.assertEqual(response, {'timed_out': False, 'hits': {'total': 1}})
+
+    def test_raw_request_retried(self):
+        calls = []
+
+        class FlakyConnection(Connection):
+            def perform_request(self, method, url, params=None, body=None,
+                                timeout=None, ignore=()):
+                calls.append(self)
+                if len(calls) == 1:
+                    raise ConnectionError('N/A', 'down', Exception())
+                return 200, {}, '{"took": 1}'
+
+        transport = Transport([{'host': 'a'}, {'host': 'b'}],
+                              connection_class=FlakyConnection)
+        data = perform_raw_request(transport, 'POST', '/_search', body={})
+        self.assertEqual(data, '{"took": 1}')
+        self.assertEqual(len(calls), 2)
+        # the failed connection is marked as dead
+        self.assertEqual(transport.connection_pool.dead_count.keys(),
+                         [calls[0]])
+        # the other requests are still deserialized
+        self.assertEqual(transport.perform_request('GET', '/')[1], {'took': 1})
+
+    def test_raw_response(self):
+        qs = TestModel.es.queryset.order_by('username')
+        data = json.loads(qs.raw_response(['hits.total', 'hits.hits._id'],
+                                          start=1, stop=3))
+        self.assertEqual(data, {'hits': {'total': 4, 'hits': [
+            {'_id': unicode(self.t4.id)}, {'_id': unicode(self.t2.id)}]}})
+
+    def test_scan(self):
+        docs = list(TestModel.es.filter(last_name=u"Smith").scan(size=1))
+        self.assertEqual(len(docs), 3)
+        self.assertEqual(sorted([d['id'] for d in docs]),
+                         sorted([self.t1.id, self.t2.id, self.t3.id]))
+
+        qs = TestModel.es.queryset.order_by('username').deserialize()
+        self.assertEqual(list(qs.scan(size=3, preserve_order=True)),
+                         [self.t3, self.t4, self.t2, self.t1])
+
+    def test_timeout(self):
+        calls = []
+
+        def receiver(sender, **kwargs):
+            calls.append(kwargs)
+
+        es_timeout.connect(receiver)
+        try:
+            qs = TestModel.es.filter(last_name=u"Smith").timeout('10ms', 2)
+            self.assertEqual(len(qs), 3)
+            self.assertFalse(qs.timed_out)
+            self.assertEqual(calls, [])
+
+            partial = dict(qs.response, timed_out=True)
+            with mock.patch.object(es_client, 'search',
+                                   return_value=partial) as mocked:
+                qs = qs.filter()
+                self.assertTrue(qs.timed_out)
+            self.assertEqual(mocked.call_args[1]['timeout'], '10ms')
+            self.assertEqual(mocked.call_args[1]['request_timeout'], 2)
+            self.assertEqual(calls[0]['timeout'], '10ms')
+            self.assertEqual(calls[0]['error'], None)
+
+            with mock.patch.object(es_client, 'search') as mocked:
+                mocked.side_effect = ConnectionTimeout('TIMEOUT', 'timed out',
+                                                       Exception())
+                with self.assertRaises(ConnectionTimeout):
+                    list(qs.filter())
+            self.assertEqual(calls[1]['request_timeout'], 2)
+            self.assertTrue(isinstance(calls[1]['error'], ConnectionTimeout))
+        finally:
+            es_timeout.disconnect(receiver)
+
     def test_default_ordering(self):
         qs = TestModel.objects.all()
         qes = TestModel.es.all().deserialize()
@@ -162,6 +356,56 @@ class EsQuerysetTestCase(TestCase):
         with self.assertRaises(AttributeError):
             TestModel.es.queryset.get()
 
+    def test_in_bulk(self):
+        docs = TestModel.es.get_many([self.t1.pk, self.t2.pk, self.t4.pk + 100])
+        self.assertEqual(sorted(docs.keys()), [self.t1.pk, self.t2.pk])
+        self.assertEqual(docs[self.t1.pk]['username'], u"woot woot")
+
+        docs = TestModel.es.queryset.deserialize().in_bulk([self.t3.pk],
+                                                           fields=['id', 'username'])
+        self.assertEqual(docs[self.t3.pk], self.t3)
+        self.assertEqual(docs[self.t3.pk].username, u"BigMama")
+        self.assertEqual(docs[self.t3.pk].first_name, u"")
+
+        # the pk is fetched even if not asked for
+        docs = TestModel.es.queryset.deserialize().in_bulk([self.t3.pk],
+                                                           fields=['username'])
+        self.assertEqual(docs[self.t3.pk].pk, self.t3.pk)
+
+        self.assertEqual(TestModel.es.get_many([]), {})
+
+    def test_in_bulk_only(self):
+        docs = TestModel.es.queryset.only('username').in_bulk([self.t1.pk,
+                                                               self.t2.pk])
+        self.assertEqual(docs[self.t1.pk], {'username': u"woot woot"})
+
+        docs = TestModel.es.queryset.only('username').deserialize().in_bulk(
+            [self.t3.pk])
+        self.assertEqual(docs[self.t3.pk].pk, self.t3.pk)
+        self.assertEqual(docs[self.t3.pk].username, u"BigMama")
+        self.assertEqual(docs[self.t3.pk].first_name, u"")
+
+    def test_in_bulk_cached(self):
+        qs = TestModel.es.queryset.timeout(request_timeout=3)
+        cache.start_memo()
+        try:
+            qs.get(pk=self.t1.pk)
+            with mock.patch.object(es_client, 'mget',
+                                   wraps=es_client.mget) as mock_mget:
+                docs = qs.in_bulk([self.t1.pk, self.t2.pk])
+                self.assertEqual(sorted(docs.keys()), [self.t1.pk, self.t2.pk])
+                # both are memoized now
+                qs.in_bulk([self.t1.pk, self.t2.pk])
+            self.assertEqual(mock_mget.call_count, 1)
+            self.assertEqual(mock_mget.call_args[1]['body'], {'ids': [self.t2.pk]})
+            self.assertEqual(mock_mget.call_args[1]['request_timeout'], 3)
+            with mock.patch.object(es_client, 'get') as mock_get:
+                self.assertEqual(qs.get(pk=self.t2.pk)['username'],
+                                 docs[self.t2.pk]['username'])
+            self.assertFalse(mock_get.called)
+        finally:
+            cache.stop_memo()
+
     def test_filtering(self):
         contents = TestModel.es.filter(last_name=u"Smith").deserialize()
         self.assertTrue(self.t1 in contents)
@@ -342,6 +586,99 @@ class EsQuerysetTestCase(TestCase):
         reload(test_client)
         self.assertTrue(test_client.es_client.ping())
 
+    def test_lazy_client(self):
+        from django_elasticsearch.client import LazyEsClient
+        client = LazyEsClient()
+        self.assertTrue(client._client is None)
+        self.assertTrue(client.ping())
+        real_client = client.get_client()
+        self.assertTrue(client.get_client() is real_client)
+
+        # in a forked process
+        with mock.patch('os.getpid') as mock_getpid:
+            mock_getpid.return_value = -1
+            self.assertFalse(client.get_client() is real_client)
+            self.assertTrue(client.ping())
+
+    @override_settings(ELASTICSEARCH_URL=['http://localhost:9200',
+                                          'http://127.0.0.1:9200'],
+                       ELASTICSEARCH_MAXSIZE=2)
+    def test_client_settings(self):
+        connections = es_client.transport.connection_pool.connections
+        self.assertEqual(len(connections), 2)
+        self.assertEqual(connections[0].pool.pool.maxsize, 2)
+        self.assertEqual(TestModel.es.count(), 4)
+
+    @override_settings(ELASTICSEARCH_SIGNAL_SIZES=True)
+    def test_request_signal(self):
+        calls = {}
+
+        def receiver(sender, operation, **kwargs):
+            calls[operation] = kwargs
+
+        es_request.connect(receiver)
+        try:
+            list(TestModel.es.filter(last_name=u"Smith"))
+            TestModel.es.get(pk=self.t1.pk)
+            TestModel.es.do_update()
+            with self.assertRaises(NotFoundError):
+                TestModel.es.get(pk=self.t4.pk + 100)
+        finally:
+            es_request.disconnect(receiver)
+
+        search = calls['search']
+        self.assertEqual(search['index'], TestModel.es.index)
+        self.assertEqual(search['doc_type'], TestModel.es.doc_type)
+        self.assertEqual(search['hits'], 3)
+        self.assertTrue(search['duration'] > 0)
+        self.assertTrue(search['took'] is not None)
+        self.assertTrue(search['request_size'] > 0)
+        self.assertTrue(search['response_size'] > search['request_size'])
+        self.assertTrue(search['error'] is None)
+        self.assertTrue('body' in search['params'])
+
+        self.assertTrue('indices.refresh' in calls)
+        self.assertTrue(isinstance(calls['get']['error'], NotFoundError))
+
+    def test_request_signal_no_sizes(self):
+        calls = {}
+
+        def receiver(sender, operation, **kwargs):
+            calls[operation] = kwargs
+
+        es_request.connect(receiver)
+        try:
+            with mock.patch('django_elasticsearch.client._get_size') as get_size:
+                list(TestModel.es.filter(last_name=u"Smith"))
+        finally:
+            es_request.disconnect(receiver)
+
+        self.assertFalse(get_size.called)
+        self.assertEqual(calls['search']['hits'], 3)
+        self.assertTrue(calls['search']['request_size'] is None)
+        self.assertTrue(calls['search']['response_size'] is None)
+
+    @override_settings(ELASTICSEARCH_SLOW_QUERY_MS=0)
+    def test_slow_query_log(self):
+        with mock.patch('django_elasticsearch.slowlog.logger') as mock_logger:
+            list(TestModel.es.filter(last_name=u"Smith"))
+        extra = mock_logger.warning.call_args[1]['extra']
+        self.assertEqual(extra['operation'], 'search')
+        self.assertEqual(extra['hits'], 3)
+        self.assertTrue(extra['took'] is not None)
+        self.assertTrue('filtered' in extra['body']['query'])
+        self.assertEqual(extra['params']['index'], TestModel.es.index)
+
+        with override_settings(ELASTICSEARCH_SLOW_QUERY_SAMPLING=0):
+            with mock.patch('django_elasticsearch.slowlog.logger') as mock_logger:
+                list(TestModel.es.all())
+            self.assertFalse(mock_logger.warning.called)
+
+        with override_settings(ELASTICSEARCH_SLOW_QUERY_MS=10000):
+            with mock.patch('django_elasticsearch.slowlog.logger') as mock_logger:
+                list(TestModel.es.all())
+            self.assertFalse(mock_logger.warning.called)
+
     def test_extra(self):
         q = TestModel.es.search("Jack").extra({
             "highlight": {
@@ -371,6 +708,219 @@ class EsQuerysetTestCase(TestCase):
         with self.assertRaises(NotImplementedError):
             TestModel.es.all().prefetch_related()
 
+    def test_cache(self):
+        qs = TestModel.es.filter(last_name=u"Smith")
+        self.assertFalse('_cache' in qs.make_search_body()['query']['filtered']['filter']['bool'])
+
+        qs = qs.cache()
+        body = qs.make_search_body()
+        self.assertTrue(body['query']['filtered']['filter']['bool']['_cache'])
+        self.assertEqual(qs.count(), 3)
+        self.assertEqual(len(qs), 3)
+
+        qs = qs.cache(False).filter(first_name__contains=u"jack")
+        filtr = qs.make_search_body()['query']['filtered']['filter']['bool']
+        self.assertFalse(filtr['_cache'])
+        self.assertTrue({'fquery': {'query': {'match': {'first_name': {'query': 'jack'}}},
+                                    '_cache': False}} in filtr['must'])
+        self.assertEqual(qs.count(), 1)
+
+        # the shard query cache of elasticsearch 1.x
+        with mock.patch.object(es_client, 'search',
+                               wraps=es_client.search) as mock_search:
+            list(qs)
+            TestModel.es.queryset.facet(['last_name']).facets_only().facets
+            list(TestModel.es.queryset)
+        calls = mock_search.call_args_list
+        self.assertEqual(calls[0][1]['params']['query_cache'], 'false')
+        self.assertEqual(calls[1][1]['params']['query_cache'], 'true')
+        self.assertFalse('params' in calls[2][1])
+        self.assertFalse('request_cache' in calls[0][1])
+
+    def test_evaluate_many(self):
+        q1 = TestModel.es.filter(last_name=u"Smith")
+        q2 = TestModel.es.search("Foo").facet(['last_name'], use_globals=False)
+        q4 = TestModel.es.all().order_by('id')
+
+        with mock.patch.object(es_client, 'search') as mocked:
+            EsQueryset.evaluate_many([q1, q2, q4])
+            self.assertEqual(q1.count(), 3)
+            self.assertEqual(len(q1), 3)
+            expected = [{u'doc_count': 1, u'key': u'bar'}]
+            self.assertEqual(q2.facets['last_name']['buckets'], expected)
+            self.assertEqual(len(q4), 4)
+            self.assertEqual(q4.count(), 4)
+            self.assertEqual(list(q4)[0]['id'], self.t1.id)
+        self.assertFalse(mocked.called)
+
+        # already evaluated querysets are skipped
+        with mock.patch.object(es_client, 'msearch') as mocked:
+            EsQueryset.evaluate_many([q1, q2, q4])
+        self.assertFalse(mocked.called)
+
+    def test_evaluate_many_timeout(self):
+        calls = []
+
+        def receiver(sender, **kwargs):
+            calls.append(kwargs)
+
+        q1 = TestModel.es.filter(last_name=u"Smith").timeout('10ms', 2)
+        q2 = TestModel.es.all().timeout(request_timeout=5)
+        responses = [dict(q1.filter().response, timed_out=True),
+                     q2.filter().response]
+
+        es_timeout.connect(receiver)
+        try:
+            with mock.patch.object(EsQueryset, 'set_cached_response',
+                                   autospec=True) as cached:
+                with mock.patch.object(es_client, 'msearch',
+                                       return_value={'responses': responses}) as mocked:
+                    EsQueryset.evaluate_many([q1, q2])
+        finally:
+            es_timeout.disconnect(receiver)
+
+        body = mocked.call_args[1]['body']
+        self.assertEqual(body[1]['timeout'], '10ms')
+        self.assertFalse('timeout' in body[3])
+        self.assertEqual(mocked.call_args[1]['request_timeout'], 5)
+        self.assertTrue(q1.timed_out)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(calls[0]['timeout'], '10ms')
+        # the partial response is not cached
+        self.assertEqual([c[0][0] for c in cached.call_args_list], [q2])
+
+    def test_evaluate_parallel(self):
+        q1 = TestModel.es.filter(last_name=u"Smith")
+        q2 = TestModel.es.search("Foo").facet(['last_name'], use_globals=False)
+        q3 = TestModel.es.all().order_by('id')
+
+        EsQueryset.evaluate_parallel([q1, q2, q3, q1], max_workers=2)
+        with mock.patch.object(es_client, 'search') as mocked:
+            self.assertEqual(q1.count(), 3)
+            expected = [{u'doc_count': 1, u'key': u'bar'}]
+            self.assertEqual(q2.facets['last_name']['buckets'], expected)
+            self.assertEqual(list(q3)[0]['id'], self.t1.id)
+        self.assertFalse(mocked.called)
+
+    def test_mlt_clones(self):
+        qs = TestModel.es.all()
+        mlt_qs = qs.mlt(self.t1.id, mlt_fields=['last_name'])
+        self.assertEqual(qs.mode, EsQueryset.MODE_SEARCH)
+        self.assertEqual(mlt_qs.mode, EsQueryset.MODE_MLT)
+        self.assertEqual(qs.count(), 4)
+
+    @override_settings(ELASTICSEARCH_CACHE_GENERATIONS=True)
+    def test_cached(self):
+        cache.reset_stats()
+        qs = TestModel.es.filter(last_name=u"Smith").cached(timeout=10)
+        self.assertEqual(len(qs), 3)
+        self.assertEqual(qs.all().count(), 3)
+
+        with mock.patch.object(es_client, 'search') as mock_search:
+            with mock.patch.object(es_client, 'count') as mock_count:
+                self.assertEqual(len(qs.all()), 3)
+                self.assertEqual(qs.all().count(), 3)
+        self.assertFalse(mock_search.called)
+        self.assertFalse(mock_count.called)
+        self.assertEqual(cache.get_stats()['hits'], 2)
+        self.assertEqual(cache.get_stats()['misses'], 2)
+
+        # indexing invalidates the cache
+        self.t4.last_name = u"Smith"
+        self.t4.es.do_index()
+        TestModel.es.do_update()
+        self.assertEqual(len(qs.all()), 4)
+        self.assertEqual(qs.all().count(), 4)
+
+        # disabled
+        with mock.patch.object(es_client, 'count') as mock_count:
+            mock_count.return_value = {'count': 42}
+            self.assertEqual(qs.cached(0).count(), 42)
+
+    def test_generations_disabled(self):
+        # no cache enabled, the writes don't touch the django cache
+        with mock.patch.object(cache, 'get_es_cache') as mocked:
+            self.t1.es.do_index()
+            self.t1.es.delete()
+        self.assertFalse(mocked.called)
+
+    @override_settings(ELASTICSEARCH_CACHE_GENERATIONS=True)
+    def test_generations(self):
+        generation = cache.get_generation(TestModel.es.index)
+        TestModel.es.reindex_all()
+        # once for all the documents
+        self.assertEqual(cache.get_generation(TestModel.es.index),
+                         generation + 1)
+
+        # a broken cache backend doesn't fail the write
+        with mock.patch.object(cache, 'get_es_cache') as mocked:
+            mocked.return_value.set.side_effect = Exception('down')
+            self.t1.es.do_index()
+        self.assertTrue(mocked.called)
+
+    def test_only(self):
+        qs = TestModel.es.queryset.only('username', 'first_name')
+        expected = {u'username': u'woot woot', u'first_name': u'John'}
+        self.assertEqual(qs.get(pk=self.t1.pk), expected)
+        self.assertEqual(qs.filter(last_name=u'Bar')[:1],
+                         [{u'username': u'foo', u'first_name': u'Foo'}])
+
+    def test_realtime(self):
+        with mock.patch.object(es_client, 'get', wraps=es_client.get) as mock_get:
+            TestModel.es.queryset.get(pk=self.t1.pk)
+            TestModel.es.queryset.realtime(False, refresh=True).get(pk=self.t1.pk)
+        self.assertFalse('realtime' in mock_get.call_args_list[0][1])
+        self.assertEqual(mock_get.call_args_list[1][1]['realtime'], False)
+        self.assertEqual(mock_get.call_args_list[1][1]['refresh'], True)
+
+    @override_settings(ELASTICSEARCH_DOCUMENT_CACHE_TIMEOUT=10)
+    def test_document_cache(self):
+        qs = TestModel.es.queryset
+        self.assertEqual(qs.get(pk=self.t1.pk)['first_name'], u'John')
+        with mock.patch.object(es_client, 'get') as mock_get:
+            self.assertEqual(qs.get(pk=self.t1.pk)['first_name'], u'John')
+        self.assertFalse(mock_get.called)
+
+        # refresh skips the cache
+        with mock.patch.object(es_client, 'get', wraps=es_client.get) as mock_get:
+            qs.realtime(refresh=True).get(pk=self.t1.pk)
+        self.assertTrue(mock_get.called)
+
+        # indexing and deleting invalidate it
+        self.t1.first_name = u'Jim'
+        self.t1.es.do_index()
+        self.assertEqual(qs.get(pk=self.t1.pk)['first_name'], u'Jim')
+        self.t1.es.delete()
+        with self.assertRaises(NotFoundError):
+            qs.get(pk=self.t1.pk)
+
+    def test_request_memo(self):
+        cache.start_memo()
+        try:
+            with mock.patch.object(es_client, 'search', wraps=es_client.search) as mock_search:
+                with mock.patch.object(es_client, 'get', wraps=es_client.get) as mock_get:
+                    self.assertEqual(len(TestModel.es.filter(last_name=u"Smith")), 3)
+                    self.assertEqual(len(TestModel.es.filter(last_name=u"Smith")), 3)
+                    self.assertEqual(len(TestModel.es.filter(last_name=u"Bar")), 1)
+                    TestModel.es.get(pk=self.t1.pk)
+                    self.t1.es.get()
+            self.assertEqual(mock_search.call_count, 2)
+            self.assertEqual(mock_get.call_count, 1)
+
+            # writes clear the memo
+            self.t4.es.do_index()
+            TestModel.es.do_update()
+            with mock.patch.object(es_client, 'search', wraps=es_client.search) as mock_search:
+                self.assertEqual(len(TestModel.es.filter(last_name=u"Bar")), 1)
+            self.assertEqual(mock_search.call_count, 1)
+        finally:
+            self.assertEqual(cache.stop_memo(), 2)
+
+        # no memo outside of a request
+        with mock.patch.object(es_client, 'search', wraps=es_client.search) as mock_search:
+            len(TestModel.es.filter(last_name=u"Bar"))
+        self.assertEqual(mock_search.call_count, 1)
+
     def test_range_plus_must(self):
         q = TestModel.es.filter(date_joined__gt='now-10d').filter(first_name="John")
         self.assertEqual(q.count(), 1)
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
+import json
 import mock
+from unittest import skipIf
 
 from rest_framework import status
 from rest_framework import VERSION
@@ -7,12 +9,15 @@ from rest_framework.settings import api_settings
 from rest_framework.test import APIClient
 
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.db.models.query import QuerySet
 from django.contrib.auth.models import User
 
 from elasticsearch import TransportError
 
 from django_elasticsearch.client import es_client
+from django_elasticsearch.breaker import circuit_breaker
+from django_elasticsearch.paginator import EsPaginator
 from django_elasticsearch.tests.utils import withattrs
 from django_elasticsearch.contrib.restframework import ElasticsearchFilterBackend
 from test_app.models import TestModel
@@ -48,6 +53,7 @@ class EsRestFrameworkTestCase(TestCase):
     def tearDown(self):
         super(EsRestFrameworkTestCase, self).tearDown()
         es_client.indices.delete(index=TestModel.es.get_index())
+        circuit_breaker.reset()
 
     def _test_filter_backend(self):
         queryset = TestModel.es.all()
@@ -106,6 +112,135 @@ class EsRestFrameworkTestCase(TestCase):
     def test_pagination(self):
         self._test_pagination()
 
+    def test_pagination_single_request(self):
+        # the count comes from the search response
+        with mock.patch.object(es_client, 'count') as mock_count:
+            self._test_pagination()
+            r = self.client.get('/rf/tests/', {'username': 'nobody'})
+            self.assertEqual(r.data['count'], 0)
+        self.assertFalse(mock_count.called)
+
+    def test_paginator_validate_number(self):
+        # restframework 2 validates the page number before asking for it
+        paginator = EsPaginator(TestModel.es.all().order_by('-id'), 1)
+        with mock.patch.object(es_client, 'count') as mock_count, \
+                mock.patch.object(es_client, 'search',
+                                  wraps=es_client.search) as mock_search:
+            page = paginator.page(paginator.validate_number(2))
+        self.assertFalse(mock_count.called)
+        self.assertEqual(mock_search.call_count, 1)
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(page.object_list[0]['id'], self.model2.id)
+
+    @skipIf(int(VERSION[0]) < 3, "restframework 3 only")
+    def test_pagination_class(self):
+        from rest_framework.pagination import PageNumberPagination
+        from test_app.views import TestViewSet
+
+        class CustomPagination(PageNumberPagination):
+            page_size_query_param = 'page_size'
+
+        # the pagination class of the project is kept
+        with mock.patch.object(TestViewSet, 'pagination_class', CustomPagination):
+            self.assertTrue(isinstance(TestViewSet().paginator, CustomPagination))
+            with mock.patch.object(es_client, 'count',
+                                   wraps=es_client.count) as mock_count:
+                r = self.client.get('/rf/tests/', {'ordering': '-id', 'page': 2,
+                                                   'page_size': 1})
+        self.assertEqual(r.data['count'], 3)
+        self.assertEqual(r.data['results'][0]['id'], self.model2.id)
+        if hasattr(PageNumberPagination, 'django_paginator_class'):
+            self.assertFalse(mock_count.called)
+
+    @skipIf(int(VERSION[0]) < 3, "restframework 3 only")
+    def test_cursor_pagination(self):
+        r = self.client.get('/rf/cursor/', {'ordering': '-id', 'page_size': 2})
+        self.assertFalse('count' in r.data)
+        self.assertEqual([d['id'] for d in r.data['results']],
+                         [self.model3.id, self.model2.id])
+        self.assertTrue('cursor=' in r.data['next'])
+
+        with mock.patch.object(es_client, 'count') as mock_count:
+            r = self.client.get(r.data['next'])
+        self.assertFalse(mock_count.called)
+        self.assertEqual([d['id'] for d in r.data['results']],
+                         [self.model1.id])
+        self.assertEqual(r.data['next'], None)
+
+        r = self.client.get('/rf/cursor/', {'cursor': 'garbage', 'page_size': 2})
+        self.assertEqual(r.status_code, 404)
+        # one value per field of the ordering, plus the pk
+        r = self.client.get('/rf/cursor/', {'ordering': 'username', 'page_size': 2,
+                                            'cursor': 'WzFd'})
+        self.assertEqual(r.status_code, 404)
+
+    @skipIf(int(VERSION[0]) < 3, "restframework 3 only")
+    def test_cursor_pagination_filters(self):
+        model4 = TestModel.objects.create(username='4', last_name='test')
+        model4.es.do_index()
+        TestModel.es.do_update()
+
+        params = {'ordering': 'username', 'page_size': 1, 'last_name': 'test'}
+        r = self.client.get('/rf/cursor/', params)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data['filter_status'], 'Ok')
+        self.assertEqual([d['id'] for d in r.data['results']], [self.model2.id])
+
+        r = self.client.get(r.data['next'])
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([d['id'] for d in r.data['results']], [model4.id])
+        self.assertEqual(r.data['next'], None)
+
+    @skipIf(int(VERSION[0]) < 3, "restframework 3 only")
+    def test_cursor_pagination_fallback(self):
+        for i in range(circuit_breaker.threshold):
+            circuit_breaker.record_failure()
+
+        with mock.patch.object(es_client, 'search') as mock_search:
+            r = self.client.get('/rf/cursor/', {'page_size': 2})
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(r.data['filter_status'], 'Failed')
+            self.assertEqual([d['id'] for d in r.data['results']],
+                             [self.model1.id, self.model2.id])
+
+            r = self.client.get(r.data['next'])
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual([d['id'] for d in r.data['results']],
+                             [self.model3.id])
+            self.assertEqual(r.data['next'], None)
+        self.assertFalse(mock_search.called)
+
+    @skipIf(int(VERSION[0]) < 3, "restframework 3 only")
+    def test_raw_list(self):
+        from test_app.views import TestViewSet
+        with mock.patch.object(TestViewSet, 'es_raw', True):
+            r = self.client.get('/rf/tests/', {'ordering': '-id',
+                                               'page': 2, 'page_size': 1})
+        self.assertEqual(r.status_code, 200)
+        data = json.loads(r.content)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['results'],
+                         [{'_source': json.loads(self.model2.es.serialize())}])
+        self.assertEqual(data['filter_status'], 'Ok')
+
+        r = self.client.get('/rf/tests/', {'username': 'nobody'})
+        with mock.patch.object(TestViewSet, 'es_raw', True):
+            raw = self.client.get('/rf/tests/', {'username': 'nobody'})
+        self.assertEqual(json.loads(raw.content),
+                         {'count': 0, 'results': [], 'filter_status': 'Ok'})
+
+    @skipIf(int(VERSION[0]) < 3, "restframework 3 only")
+    @withattrs(TestModel.Elasticsearch, 'facets_fields', ['first_name',])
+    def test_raw_list_facets(self):
+        from test_app.views import TestViewSet
+        r = self.client.get('/rf/tests/')
+        with mock.patch.object(TestViewSet, 'es_raw', True):
+            raw = self.client.get('/rf/tests/')
+        data = json.loads(raw.content)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['results']), 3)
+        self.assertEqual(data['facets'], r.data['facets'])
+
     @withattrs(TestModel.Elasticsearch, 'facets_fields', ['first_name',])
     def test_facets(self):
         queryset = TestModel.es.all()
@@ -120,6 +255,17 @@ class EsRestFrameworkTestCase(TestCase):
         r = self.client.get('/rf/tests/', {'q': 'test'})
         self.assertTrue('facets' in r.data)
 
+    @withattrs(TestModel.Elasticsearch, 'facets_fields', ['first_name',])
+    def test_post_filter_viewset(self):
+        from test_app.views import TestViewSet
+        with mock.patch.object(TestViewSet, 'post_filter_fields',
+                               ('first_name',), create=True):
+            r = self.client.get('/rf/tests/', {'first_name': 'nobody'})
+        self.assertEqual(r.data['count'], 0)
+        # the facets ignore the post filter
+        self.assertEqual(r.data['facets']['first_name']['buckets'],
+                         [{u'doc_count': 1, u'key': u'test'}])
+
     @withattrs(TestModel.Elasticsearch, 'suggest_fields', ['first_name'])
     def test_suggestions_viewset(self):
         r = self.client.get('/rf/tests/', {'q': 'tset'})
@@ -141,6 +287,21 @@ class EsRestFrameworkTestCase(TestCase):
         # first_name is NOT in the completion_fields -> 404
         self.assertEqual(r.status_code, 404)
 
+    @withattrs(TestModel.Elasticsearch, 'completion_fields', ['username',
+                                                              'first_name'])
+    def test_multi_field_completion_viewset(self):
+        TestModel.es.flush()
+        TestModel.es.do_update()
+
+        r = self.client.get('/rf/tests/autocomplete/', {'f': 'username,first_name',
+                                                        'q': 'te'})
+        self.assertEqual(r.data, ['test'])
+        r = self.client.get('/rf/tests/autocomplete/?f=username&f=first_name&q=w')
+        self.assertEqual(r.data, ['whatever'])
+
+        r = self.client.get('/rf/tests/autocomplete/', {'q': 'w'})
+        self.assertEqual(r.status_code, 404)
+
     def test_post_put_delete(self):
         client = APIClient()
 
@@ -165,6 +326,97 @@ class EsRestFrameworkTestCase(TestCase):
         self.assertEqual(r.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(TestModel.objects.filter(pk=pk).exists())
 
+    @override_settings(ELASTICSEARCH_CACHE_GENERATIONS=True,
+                       ELASTICSEARCH_REFRESH_INTERVAL=0)
+    def test_conditional_get(self):
+        from test_app.views import TestViewSet
+        with mock.patch.object(TestViewSet, 'conditional', True):
+            self._test_conditional_get()
+
+    def _test_conditional_get(self):
+        r = self.client.get('/rf/tests/')
+        with mock.patch.object(es_client, 'search') as mock_search, \
+                mock.patch.object(circuit_breaker, 'record_success') as mock_record:
+            r = self.client.get('/rf/tests/', HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertFalse(mock_search.called)
+        self.assertFalse(mock_record.called)
+        self.assertEqual(r.status_code, 304)
+
+        url = '/rf/tests/{0}/'.format(self.model1.pk)
+        r = self.client.get(url)
+        self.assertEqual(r.data['username'], '1')
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+
+    @skipIf(int(VERSION[0]) < 3, "restframework 3 only")
+    def test_retrieve(self):
+        from rest_framework.serializers import ModelSerializer
+        from test_app.views import TestViewSet
+
+        class PublicSerializer(ModelSerializer):
+            class Meta:
+                model = TestModel
+                fields = ('username', 'date_joined')
+
+        url = '/rf/tests/{0}/'.format(self.model1.pk)
+        with mock.patch.object(TestViewSet, 'serializer_class', PublicSerializer), \
+                mock.patch.object(es_client, 'get',
+                                  wraps=es_client.get) as mock_get:
+            r = self.client.get(url)
+        self.assertEqual(r.status_code, 200)
+        # through the serializer, only its fields are fetched
+        self.assertEqual(sorted(mock_get.call_args[1]['_source_include']),
+                         ['date_joined', 'id', 'username'])
+        self.assertEqual(sorted(r.data.keys()),
+                         ['date_joined', 'filter_status', 'username'])
+        self.assertEqual(r.data['username'], '1')
+        self.assertEqual(
+            r.data['date_joined'],
+            PublicSerializer(self.model1).data['date_joined'])
+
+    @skipIf(int(VERSION[0]) < 3, "restframework 3 only")
+    def test_retrieve_source_fields(self):
+        from test_app.views import TestViewSet
+        url = '/rf/tests/{0}/'.format(self.model1.pk)
+        with mock.patch.object(TestViewSet, 'es_source_fields',
+                               ['username', 'first_name']), \
+                mock.patch.object(es_client, 'get',
+                                  wraps=es_client.get) as mock_get:
+            r = self.client.get(url)
+        self.assertEqual(mock_get.call_args[1]['_source_include'],
+                         ['id', 'username', 'first_name'])
+        self.assertEqual(r.data['id'], self.model1.pk)
+        self.assertEqual(r.data['username'], '1')
+        self.assertEqual(r.data['first_name'], 'test')
+
+        # from the serializer, by default
+        with mock.patch.object(es_client, 'get',
+                               wraps=es_client.get) as mock_get:
+            r = self.client.get(url)
+        includes = mock_get.call_args[1]['_source_include']
+        self.assertTrue('username' in includes)
+        self.assertFalse('username_complete' in includes)
+        self.assertEqual(r.data['username'], '1')
+
+        # the whole _source
+        with mock.patch.object(TestViewSet, 'es_source_fields', None), \
+                mock.patch.object(es_client, 'get',
+                                  wraps=es_client.get) as mock_get:
+            r = self.client.get(url)
+        self.assertFalse('_source_include' in mock_get.call_args[1])
+        self.assertEqual(r.data['username'], '1')
+
+    def test_circuit_open(self):
+        for i in range(circuit_breaker.threshold):
+            circuit_breaker.record_failure()
+
+        with mock.patch.object(es_client, 'search') as mock_search:
+            r = self.client.get('/rf/tests/')
+        self.assertFalse(mock_search.called)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data['filter_status'], 'Failed')
+        self.assertEqual(r.data['count'], 3)
+
     def test_fallback_gracefully(self):
         # Note: can't use override settings because of how restframework handle settings :(
         #from django_elasticsearch.tests.urls import TestViewSet
@@ -2,12 +2,23 @@ import mock
 import json
 
 from django.test import TestCase
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.test.utils import modify_settings
 
 from elasticsearch import TransportError
+from elasticsearch import ConnectionError
+from elasticsearch import ConnectionTimeout
 
 from django_elasticsearch.managers import es_client
+from django_elasticsearch.breaker import circuit_breaker
+from django_elasticsearch.middleware import EsRequestMemoMiddleware
+from django_elasticsearch.tests.utils import withattrs
 
 from test_app.models import TestModel
+from test_app.views import TestListView
+from test_app.views import TestDetailView
 
 
 class EsViewTestCase(TestCase):
@@ -23,6 +34,7 @@ class EsViewTestCase(TestCase):
     def tearDown(self):
         super(EsViewTestCase, self).tearDown()
         es_client.indices.delete(index=TestModel.es.get_index())
+        circuit_breaker.reset()
 
     def _test_detail_view(self):
         response = self.client.get('/tests/{id}/'.format(id=self.instance.pk))
@@ -33,6 +45,24 @@ class EsViewTestCase(TestCase):
     def test_detail_view(self):
         self._test_detail_view()
 
+    def test_detail_view_source_fields(self):
+        from test_app.views import TestDetailView
+        with mock.patch.object(TestDetailView, 'es_source_fields',
+                               ['username', 'first_name']), \
+                mock.patch.object(es_client, 'get',
+                                  wraps=es_client.get) as mock_get:
+            self._test_detail_view_fields()
+        # the pk is needed to deserialize
+        self.assertEqual(mock_get.call_args[1]['_source_include'],
+                         ['username', 'first_name', 'id'])
+
+    def _test_detail_view_fields(self):
+        response = self.client.get('/tests/{id}/'.format(id=self.instance.pk))
+        content = json.loads(response.content)
+        self.assertEqual(content['fields']['first_name'], u"woot")
+        # not fetched
+        self.assertEqual(content['fields']['last_name'], u"")
+
     def test_404(self):
         resp = self.client.get('/tests/{0}/'.format(self.instance.pk + 10))
         resp.status_code = 404
@@ -59,3 +89,224 @@ class EsViewTestCase(TestCase):
             self.assertEqual(len(content), 1)
             self.assertEqual(content[0]['fields']['first_name'], u"woot")
             self.assertEqual(content[0]['fields']['last_name'], u"foo")
+
+    def test_timeout_list_view(self):
+        from test_app.views import TestListView
+        with mock.patch.object(TestListView, 'es_timeout', 2), \
+                mock.patch.object(es_client, 'search') as mock_search:
+            mock_search.side_effect = ConnectionTimeout('TIMEOUT', 'timed out',
+                                                        Exception())
+            response = self.client.get('/tests/')
+        self.assertEqual(mock_search.call_args[1]['request_timeout'], 2)
+        # db fallback
+        content = json.loads(response.content)
+        self.assertEqual(len(content), 1)
+        self.assertEqual(content[0]['fields']['first_name'], u"woot")
+
+    @override_settings(ELASTICSEARCH_BREAKER_THRESHOLD=1,
+                       ELASTICSEARCH_TIMEOUT=5)
+    def test_timeout_circuit_breaker(self):
+        from test_app.views import TestListView
+        error = ConnectionTimeout('TIMEOUT', 'timed out', Exception())
+
+        # the view's budget is not a failure of the cluster
+        client = es_client.get_client()
+        with mock.patch.object(TestListView, 'es_timeout', 2), \
+                mock.patch.object(client, 'search', side_effect=error), \
+                mock.patch.object(circuit_breaker, 'record_success') as mock_success:
+            self.client.get('/tests/')
+        self.assertFalse(mock_success.called)
+        self.assertEqual(circuit_breaker.state, circuit_breaker.CLOSED)
+
+        # but a budget longer than the client's timeout is
+        with mock.patch.object(TestListView, 'es_timeout', 5), \
+                mock.patch.object(client, 'search', side_effect=error):
+            self.client.get('/tests/')
+        self.assertEqual(circuit_breaker.state, circuit_breaker.OPEN)
+
+    @override_settings(ELASTICSEARCH_CACHE_GENERATIONS=True,
+                       ELASTICSEARCH_REFRESH_INTERVAL=0)
+    @withattrs(TestListView, 'conditional', True)
+    def test_conditional_list_view(self):
+        response = self.client.get('/tests/')
+        etag = response['ETag']
+        self.assertTrue('Last-Modified' in response)
+
+        with mock.patch('django_elasticsearch.query.EsQueryset.do_search') as mock_search, \
+                mock.patch.object(circuit_breaker, 'record_success') as mock_record:
+            response = self.client.get('/tests/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertFalse(mock_search.called)
+            # elasticsearch was not called
+            self.assertFalse(mock_record.called)
+
+        # any write changes the etag
+        self.instance.es.do_index()
+        response = self.client.get('/tests/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @withattrs(TestListView, 'conditional', True)
+    def test_conditional_list_view_unsettled(self):
+        # no generations, no validators
+        response = self.client.get('/tests/')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # the last write may not be searchable yet
+        with override_settings(ELASTICSEARCH_CACHE_GENERATIONS=True,
+                               ELASTICSEARCH_REFRESH_INTERVAL=60):
+            self.instance.es.do_index()
+            response = self.client.get('/tests/')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    @withattrs(TestDetailView, 'conditional', True)
+    def test_conditional_detail_view(self):
+        url = '/tests/{id}/'.format(id=self.instance.pk)
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # a new version of the document
+        self.instance.es.do_index()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_request_memo_middleware(self):
+        middleware = EsRequestMemoMiddleware()
+        request = RequestFactory().get('/tests/')
+        middleware.process_request(request)
+        try:
+            with mock.patch.object(es_client, 'get', wraps=es_client.get) as mock_get:
+                doc = TestModel.es.get(pk=self.instance.pk)
+                # like the restframework retrieve does
+                doc['filter_status'] = 'Ok'
+                self.assertFalse('filter_status' in
+                                 TestModel.es.get(pk=self.instance.pk))
+            self.assertEqual(mock_get.call_count, 1)
+        finally:
+            with self.settings(DEBUG=True):
+                response = middleware.process_response(request, HttpResponse())
+        self.assertEqual(request.es_saved_calls, 1)
+        self.assertEqual(response['X-Elasticsearch-Saved-Calls'], '1')
+
+        # the memo ends with the request
+        with mock.patch.object(es_client, 'get', wraps=es_client.get) as mock_get:
+            TestModel.es.get(pk=self.instance.pk)
+        self.assertEqual(mock_get.call_count, 1)
+
+    @modify_settings(MIDDLEWARE_CLASSES={
+        'append': 'django_elasticsearch.middleware.EsRequestMemoMiddleware'})
+    def test_request_memo_middleware_stack(self):
+        url = '/tests/{id}/'.format(id=self.instance.pk)
+        for i in range(2):
+            response = self.client.get(url)
+            self.assertEqual(response.wsgi_request.es_saved_calls, 0)
+            content = json.loads(response.content)
+            self.assertEqual(content['fields']['first_name'], u"woot")
+
+    @override_settings(ELASTICSEARCH_SLOW_QUERY_MS=0)
+    @modify_settings(MIDDLEWARE_CLASSES={
+        'append': 'django_elasticsearch.middleware.EsRequestMiddleware'})
+    def test_request_middleware_slow_query_log(self):
+        url = '/tests/{id}/'.format(id=self.instance.pk)
+        with mock.patch('django_elasticsearch.slowlog.logger') as mock_logger:
+            with mock.patch('django_elasticsearch.middleware.start_memo') as mock_memo:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(mock_memo.called)
+        extra = mock_logger.warning.call_args[1]['extra']
+        self.assertEqual(extra['operation'], 'get')
+        self.assertEqual(extra['view'], 'test_detail')
+        self.assertFalse(hasattr(response.wsgi_request, 'es_saved_calls'))
+
+    def test_export_view(self):
+        for i in range(4):
+            TestModel.objects.create(username=u"export{0}".format(i)).es.do_index()
+        TestModel.es.do_update()
+
+        response = self.client.get('/tests/export/')
+        self.assertTrue(response.streaming)
+        content = json.loads(''.join(response.streaming_content))
+        self.assertEqual(len(content), 5)
+        self.assertTrue(u"woot" in [d['first_name'] for d in content])
+
+        response = self.client.get('/tests/export/', {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = ''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue('username' in lines[0].split(','))
+
+    def test_timeout_export_view(self):
+        from test_app.views import TestExportView
+        client = es_client.get_client()
+        with mock.patch.object(TestExportView, 'es_timeout', 2), \
+                mock.patch.object(TestExportView, 'es_search_timeout', '100ms'), \
+                mock.patch.object(client, 'search', wraps=client.search) as mock_search, \
+                mock.patch.object(client, 'scroll', wraps=client.scroll) as mock_scroll:
+            response = self.client.get('/tests/export/')
+            content = json.loads(''.join(response.streaming_content))
+        self.assertEqual(len(content), 1)
+        self.assertEqual(mock_search.call_args[1]['request_timeout'], 2)
+        self.assertEqual(mock_search.call_args[1]['timeout'], '100ms')
+        self.assertEqual(mock_scroll.call_args[1]['request_timeout'], 2)
+
+        # past its budget, the view falls back on the database
+        error = ConnectionTimeout('TIMEOUT', 'timed out', Exception())
+        with mock.patch.object(TestExportView, 'es_timeout', 2), \
+                mock.patch.object(client, 'search', side_effect=error):
+            response = self.client.get('/tests/export/')
+            content = json.loads(''.join(response.streaming_content))
+        self.assertEqual(content[0]['first_name'], u"woot")
+
+    def test_fallback_export_view(self):
+        with mock.patch('django_elasticsearch.query.EsQueryset.scan') as mock_scan:
+            mock_scan.side_effect = TransportError()
+            response = self.client.get('/tests/export/')
+            content = json.loads(''.join(response.streaming_content))
+            self.assertEqual(len(content), 1)
+            self.assertEqual(content[0]['first_name'], u"woot")
+
+    @override_settings(ELASTICSEARCH_BREAKER_THRESHOLD=2,
+                       ELASTICSEARCH_BREAKER_COOLDOWN=60)
+    def test_circuit_breaker(self):
+        # the outcomes are recorded by the client
+        with mock.patch.object(es_client.get_client(), 'search') as mock_search:
+            mock_search.side_effect = ConnectionError('N/A', 'down')
+            self._test_list_view()
+            self.assertEqual(circuit_breaker.state, circuit_breaker.CLOSED)
+            self._test_list_view()
+            self.assertEqual(circuit_breaker.state, circuit_breaker.OPEN)
+
+            # straight to the db
+            self._test_list_view()
+            self.assertEqual(mock_search.call_count, 2)
+
+        # a 404 doesn't mean the cluster is down
+        with override_settings(ELASTICSEARCH_BREAKER_COOLDOWN=0):
+            self.assertEqual(circuit_breaker.state, circuit_breaker.HALF_OPEN)
+            resp = self.client.get('/tests/{0}/'.format(self.instance.pk + 10))
+            self.assertEqual(resp.status_code, 404)
+        self.assertEqual(circuit_breaker.state, circuit_breaker.CLOSED)
+
+    @override_settings(ELASTICSEARCH_BREAKER_THRESHOLD=1,
+                       ELASTICSEARCH_BREAKER_COOLDOWN=0)
+    def test_circuit_breaker_probe(self):
+        circuit_breaker.record_failure()
+        self.assertEqual(circuit_breaker.state, circuit_breaker.HALF_OPEN)
+
+        # without an elasticsearch call, no probe and no success
+        circuit_breaker.call(lambda: None)
+        with self.assertRaises(ValueError):
+            circuit_breaker.call(int, 'nan')
+        self.assertTrue(circuit_breaker._probe_at is None)
+        self.assertEqual(circuit_breaker.state, circuit_breaker.HALF_OPEN)
+
+        # nor outside of circuit_breaker.call
+        TestModel.es.count()
+        self.assertEqual(circuit_breaker.state, circuit_breaker.HALF_OPEN)
+
+        circuit_breaker.call(TestModel.es.count)
+        self.assertEqual(circuit_breaker.state, circuit_breaker.CLOSED)
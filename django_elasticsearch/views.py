@@ -1,5 +1,15 @@
+import csv
+import json
+import time
+import hashlib
+from datetime import datetime
+from itertools import chain
+
+from django.conf import settings
 from django.http import Http404
+from django.http import StreamingHttpResponse
 from django.views.generic import View
+from django.views.decorators.http import condition
 from django.views.generic.list import BaseListView
 from django.views.generic.detail import BaseDetailView
 
@@ -10,6 +20,51 @@ except ImportError:
     from urllib3.connection import ConnectionError
 from elasticsearch import TransportError
 
+from django_elasticsearch.cache import get_modified
+from django_elasticsearch.cache import get_generation
+from django_elasticsearch.cache import generations_enabled
+from django_elasticsearch.breaker import circuit_breaker
+from django_elasticsearch.paginator import EsPaginator
+
+
+def is_settled(index):
+    """
+    A write is only searchable after the next refresh of the index,
+    the lists sent meanwhile may not have it, so they get no validators
+    (otherwise they would be answered 304 once it is searchable).
+    Returns False if the generations of the index are not kept.
+    """
+    if not generations_enabled():
+        return False
+    timestamp = get_modified(index)
+    interval = getattr(settings, 'ELASTICSEARCH_REFRESH_INTERVAL', 1)
+    return timestamp is None or time.time() - timestamp >= interval
+
+
+def get_list_etag(index, request):
+    """
+    Changes with the query string and with every write on the index
+    (see cache.bump_generation), no search is needed to compute it.
+    None until the last write is searchable (see is_settled).
+    """
+    if not is_settled(index):
+        return None
+    return hashlib.md5('{0}:{1}:{2}'.format(
+        index, get_generation(index),
+        request.get_full_path())).hexdigest()
+
+
+def get_document_etag(index, doc_type, pk, version):
+    return hashlib.md5('{0}:{1}:{2}:{3}'.format(
+        index, doc_type, pk, version)).hexdigest()
+
+
+def get_last_modified(index):
+    if not is_settled(index):
+        return None
+    timestamp = get_modified(index)
+    return timestamp and datetime.utcfromtimestamp(timestamp) or None
+
 
 class ElasticsearchView(View):
     """
@@ -18,19 +73,51 @@ class ElasticsearchView(View):
     """
     db_fallback = True
     es_queryset = None
+    # answer 304 Not Modified when the client's copy is up to date,
+    # the lists need ELASTICSEARCH_CACHE_GENERATIONS and a shared cache
+    conditional = False
+    # time budget of the elasticsearch calls, in seconds, past which
+    # the view falls back on the database (ELASTICSEARCH_TIMEOUT if None)
+    es_timeout = None
+    # server side budget of the searches (e.g. '500ms'), past which
+    # elasticsearch answers with partial results (see EsQueryset.timed_out)
+    es_search_timeout = None
 
     def __init__(self, *args, **kwargs):
         self.es_failed = False
         super(ElasticsearchView, self).__init__(*args, **kwargs)
 
+    def get_etag(self, request, *args, **kwargs):
+        return None
+
+    def get_last_modified(self, request, *args, **kwargs):
+        # Note: only the writes made through django_elasticsearch count,
+        # and the cache backend must be shared by every process.
+        return get_last_modified(self.model.es.index)
+
+    def conditional_get(self, get, request, *args, **kwargs):
+        if not self.conditional:
+            return get(request, *args, **kwargs)
+        return condition(etag_func=self.get_etag,
+                         last_modified_func=self.get_last_modified)(get)(
+                             request, *args, **kwargs)
+
     def get_queryset(self):
         if self.es_failed:
             return super(ElasticsearchView, self).get_queryset()
         else:
-            return self.es_queryset or self.model.es.all().deserialize()
+            queryset = self.es_queryset or self.model.es.all().deserialize()
+            return self.apply_timeout(queryset)
+
+    def apply_timeout(self, queryset):
+        if self.es_timeout is None and self.es_search_timeout is None:
+            return queryset
+        return queryset.timeout(self.es_search_timeout, self.es_timeout)
 
 
 class ElasticsearchListView(ElasticsearchView, BaseListView):
+    paginator_class = EsPaginator
+
     def get_paginate_by(self, *args, **kwargs):
         # disable pagination since elasticsearch does it by itself
         if self.es_failed:
@@ -38,9 +125,25 @@ class ElasticsearchListView(ElasticsearchView, BaseListView):
         else:
             return super(ElasticsearchListView, self).get_paginate_by(*args, **kwargs)
 
+    def get_etag(self, request, *args, **kwargs):
+        return get_list_etag(self.model.es.index, request)
+
+    def get_context_data(self, **kwargs):
+        context = super(ElasticsearchListView, self).get_context_data(**kwargs)
+        # partial results, see es_search_timeout
+        context['timed_out'] = getattr(self.object_list, 'timed_out', False)
+        return context
+
+    def _get(self, request, *args, **kwargs):
+        # only the searches go through the breaker, not the 304s
+        # answered from the etag, it goes straight to the fallback
+        # while the circuit is open
+        return circuit_breaker.call(super(ElasticsearchListView, self).get,
+                                    request, *args, **kwargs)
+
     def get(self, request, *args, **kwargs):
         try:
-            return super(ElasticsearchListView, self).get(request, *args, **kwargs)
+            return self.conditional_get(self._get, request, *args, **kwargs)
         except (TransportError, ConnectionError):
             self.es_failed = True
             if self.db_fallback:
@@ -50,18 +153,152 @@ class ElasticsearchListView(ElasticsearchView, BaseListView):
 
 
 class ElasticsearchDetailView(ElasticsearchView, BaseDetailView):
+    # only fetch these fields of the _source
+    es_source_fields = None
+    # see EsQueryset.realtime
+    es_realtime = True
+    es_refresh = False
+
+    def get_queryset(self):
+        queryset = super(ElasticsearchDetailView, self).get_queryset()
+        if self.es_failed:
+            return queryset
+        if self.es_source_fields:
+            queryset = queryset.only(*self.es_source_fields)
+        if not self.es_realtime or self.es_refresh:
+            queryset = queryset.realtime(self.es_realtime, self.es_refresh)
+        return queryset
+
     def get_object(self, queryset=None):
+        if queryset is None and getattr(self, 'object', None) is not None:
+            # already fetched by get_etag
+            return self.object
         try:
             return super(ElasticsearchDetailView, self).get_object(queryset=queryset)
         except NotFoundError:
             raise Http404
 
+    def get_etag(self, request, *args, **kwargs):
+        pk = self.kwargs.get(self.pk_url_kwarg)
+        if pk is None:
+            return None
+        queryset = self.get_queryset()
+        try:
+            self.object = circuit_breaker.call(queryset.get, pk=pk)
+        except NotFoundError:
+            raise Http404
+        return get_document_etag(queryset.index, queryset.doc_type, pk,
+                                 queryset._response.get('_version'))
+
+    def _get(self, request, *args, **kwargs):
+        get = super(ElasticsearchDetailView, self).get
+        if getattr(self, 'object', None) is not None:
+            # fetched by get_etag, through the breaker
+            return get(request, *args, **kwargs)
+        # goes straight to the fallback while the circuit is open
+        return circuit_breaker.call(get, request, *args, **kwargs)
+
     def get(self, request, *args, **kwargs):
         try:
-            return super(ElasticsearchDetailView, self).get(request, *args, **kwargs)
+            return self.conditional_get(self._get, request, *args, **kwargs)
         except (TransportError, ConnectionError):
             self.es_failed = True
+            self.object = None
             if self.db_fallback:
                 return super(ElasticsearchDetailView, self).get(request, *args, **kwargs)
             else:
                 raise
+
+
+class Echo(object):
+    """
+    File-like object that returns what is written to it,
+    for the csv writer of a streamed response.
+    """
+    def write(self, value):
+        return value
+
+
+def to_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class ElasticsearchStreamingView(ElasticsearchView):
+    """
+    Streams every document of the queryset as json or csv (?format=csv),
+    the documents are fetched by batches of scroll_size with a scroll,
+    so the memory use stays the same whatever their number.
+    """
+    export_format = 'json'
+    format_param = 'format'
+    # csv columns, defaults to the fields of the first document
+    export_fields = None
+    scroll_size = 500
+    scroll = '5m'
+    preserve_order = False
+
+    def get_queryset(self):
+        if self.es_failed:
+            return self.model._default_manager.all()
+        # documents, not instances
+        return self.apply_timeout(self.es_queryset or self.model.es.all())
+
+    def get_documents(self):
+        if self.es_failed:
+            serializer = self.model.es.get_serializer()
+            return (json.loads(serializer.serialize(instance))
+                    for instance in self.get_queryset().iterator())
+
+        docs = self.get_queryset().scan(size=self.scroll_size,
+                                        scroll=self.scroll,
+                                        preserve_order=self.preserve_order)
+        # run the search now, errors can't be handled once streaming
+        try:
+            first = next(docs)
+        except StopIteration:
+            return iter([])
+        return chain([first], docs)
+
+    def stream_json(self, docs):
+        yield '['
+        for i, doc in enumerate(docs):
+            yield (i and ',' or '') + json.dumps(doc)
+        yield ']'
+
+    def stream_csv(self, docs):
+        writer = csv.writer(Echo())
+        fields = self.export_fields
+        if fields is not None:
+            yield writer.writerow(fields)
+        for doc in docs:
+            if fields is None:
+                fields = sorted(doc.keys())
+                yield writer.writerow(fields)
+            yield writer.writerow([to_csv_value(doc.get(field))
+                                   for field in fields])
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get(self.format_param, self.export_format)
+        if export_format not in ('json', 'csv'):
+            raise Http404("Unknown format {0}.".format(export_format))
+
+        try:
+            docs = circuit_breaker.call(self.get_documents)
+        except (TransportError, ConnectionError):
+            self.es_failed = True
+            if self.db_fallback:
+                docs = self.get_documents()
+            else:
+                raise
+
+        if export_format == 'csv':
+            return StreamingHttpResponse(self.stream_csv(docs),
+                                         content_type='text/csv')
+        return StreamingHttpResponse(self.stream_json(docs),
+                                     content_type='application/json')
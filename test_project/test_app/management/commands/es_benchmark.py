@@ -0,0 +1,83 @@
+from optparse import make_option
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_test_environment
+
+from django_elasticsearch.tests.benchmarks import BENCHMARKS
+from django_elasticsearch.tests.benchmarks import run_benchmarks
+from django_elasticsearch.tests.benchmarks import dumps
+from django_elasticsearch.tests.benchmarks import load
+from django_elasticsearch.tests.benchmarks import save
+from django_elasticsearch.tests.benchmarks import compare
+from django_elasticsearch.tests.benchmarks import format_comparison
+
+
+class Command(BaseCommand):
+    help = ("Runs the offline benchmarks against a test database "
+            "and outputs the results as json. Available benchmarks: "
+            + ", ".join(BENCHMARKS.keys()))
+    args = "[benchmark benchmark ...]"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--size', type='int', default=100,
+                    help="Number of documents in the dataset."),
+        make_option('--number', type='int', default=1,
+                    help="Number of calls per timing."),
+        make_option('--repeat', type='int', default=5,
+                    help="Number of timings, the best one is kept."),
+        make_option('--output', default=None,
+                    help="Write the results to this file instead of stdout."),
+        make_option('--save-baseline', dest='save_baseline', default=None,
+                    help="Store the results as the baseline in this file."),
+        make_option('--baseline', default=None,
+                    help="Compare the results to this baseline and fail "
+                         "if a benchmark is slower."),
+        make_option('--tolerance', type='float', default=0.2,
+                    help="Accepted slowdown against the baseline, "
+                         "0.2 means 20%."),
+    )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = load(options['baseline'])
+            except (IOError, ValueError) as e:
+                raise CommandError("Can't read the baseline: {0}".format(e))
+            if baseline['size'] != options['size']:
+                raise CommandError("The baseline was measured on {0} documents, "
+                                   "use --size {0}.".format(baseline['size']))
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            results = run_benchmarks(size=options['size'],
+                                     number=options['number'],
+                                     repeat=options['repeat'],
+                                     names=args)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            save(results, options['output'])
+        else:
+            self.stdout.write(dumps(results))
+
+        if options['save_baseline']:
+            save(results, options['save_baseline'])
+
+        if baseline is not None:
+            try:
+                comparison = compare(baseline, results, options['tolerance'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stderr.write(format_comparison(comparison))
+            regressions = [c[0] for c in comparison if c[-1]]
+            if regressions:
+                raise CommandError("Slower than the baseline: {0}".format(
+                    ", ".join(regressions)))
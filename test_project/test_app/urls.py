@@ -3,18 +3,24 @@ from django.conf.urls import patterns
 
 from test_app.views import TestDetailView
 from test_app.views import TestListView
+from test_app.views import TestExportView
 
 
 urlpatterns = patterns(
     '',
     url(r'^tests/(?P<pk>\d+)/$', TestDetailView.as_view(), name='test_detail'),
     url(r'^tests/$', TestListView.as_view(), name='test_list'),
+    url(r'^tests/export/$', TestExportView.as_view(), name='test_export'),
 )
 
 from test_app.views import TestViewSet
+from rest_framework import VERSION
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
 router.register(r'rf/tests', TestViewSet)
+if int(VERSION[0]) >= 3:
+    from test_app.views import TestCursorViewSet
+    router.register(r'rf/cursor', TestCursorViewSet, base_name='cursor')
 
 urlpatterns += router.urls
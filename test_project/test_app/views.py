@@ -5,6 +5,7 @@ from django.views.generic.detail import SingleObjectMixin
 
 from django_elasticsearch.views import ElasticsearchListView
 from django_elasticsearch.views import ElasticsearchDetailView
+from django_elasticsearch.views import ElasticsearchStreamingView
 
 
 from test_app.models import TestModel
@@ -37,6 +38,11 @@ class TestListView(JsonViewMixin, ElasticsearchListView):
         return self.object_list
 
 
+class TestExportView(ElasticsearchStreamingView):
+    model = TestModel
+    scroll_size = 2
+
+
 ### contrib.restframework test viewsets
 from rest_framework.viewsets import ModelViewSet
 from django_elasticsearch.contrib.restframework import AutoCompletionMixin
@@ -69,3 +75,16 @@ else:
         search_param = 'q'
         paginate_by = 10
         paginate_by_param = 'page_size'
+
+    from django_elasticsearch.contrib.restframework import ElasticsearchCursorPagination
+
+    class TestCursorPagination(ElasticsearchCursorPagination):
+        page_size_query_param = 'page_size'
+
+    class TestCursorViewSet(IndexableModelMixin, ModelViewSet):
+        model = TestModel
+        queryset = TestModel.objects.all()
+        serializer_class = TestSerializer
+        filter_fields = ('last_name',)
+        ordering_fields = ('id', 'username')
+        pagination_class = TestCursorPagination
@@ -1,4 +1,5 @@
 # Django settings for test_project project.
+import os
 
 DEBUG = False
 TEMPLATE_DEBUG = DEBUG
@@ -12,6 +13,13 @@ ELASTICSEARCH_SETTINGS = {
     "index.store.type": "memory"
 }
 
+# the tests run against an in-memory stand-in of elasticsearch,
+# set ELASTICSEARCH_URL to run them against a real cluster.
+if os.environ.get('ELASTICSEARCH_URL'):
+    ELASTICSEARCH_URL = os.environ['ELASTICSEARCH_URL']
+else:
+    ELASTICSEARCH_TRANSPORT_CLASS = 'django_elasticsearch.memory.MemoryTransport'
+
 
 class DisableMigrations(object):
 